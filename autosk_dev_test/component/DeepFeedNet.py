@@ -29,11 +29,17 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                  tanh_alpha_layer_4=2./3., tanh_alpha_layer_5=2./3., tanh_alpha_layer_6=2./3.,
                  tanh_beta_layer_1=1.7159, tanh_beta_layer_2=1.7159, tanh_beta_layer_3=1.7159,
                  tanh_beta_layer_4=1.7159, tanh_beta_layer_5=1.7159, tanh_beta_layer_6=1.7159,
+                 rank_fraction_layer_1=1.0, rank_fraction_layer_2=1.0, rank_fraction_layer_3=1.0,
+                 rank_fraction_layer_4=1.0, rank_fraction_layer_5=1.0, rank_fraction_layer_6=1.0,
                  std_layer_2=0.005, std_layer_3=0.005, std_layer_4=0.005,
                  std_layer_5=0.005, std_layer_6=0.005,
                  momentum=0.99, beta1=0.9, beta2=0.99, rho=0.95,
-                 lr_policy='fixed', gamma=0.01, power=1.0, epoch_step=1,
-                 random_state=None):
+                 lr_policy='fixed', gamma=0.01, power=1.0, epoch_step=1, batch_policy='fixed',
+                 sampler='uniform', warm_start=False, weight_store_dir=None,
+                 lr_range_test_steps=0, time_budget=None, max_micro_batch_size=None,
+                 replay_size=0, sampled_softmax_threshold=None, lbfgs_threshold=0,
+                 compact_features=False, hash_buckets=0, lazy_updates=False,
+                 n_jobs=1, random_state=None):
         self.number_updates = number_updates
         self.batch_size = batch_size
         # Hacky implementation of condition on number of layers
@@ -50,6 +56,34 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
         self.gamma = gamma
         self.power = power
         self.epoch_step = epoch_step
+        self.batch_policy = batch_policy
+        self.sampler = sampler
+        # Initialize from the weights of previous fits with the same shapes
+        self.warm_start = warm_start
+        self.weight_store_dir = weight_store_dir
+        # Minibatches of the lr range test that clips the learning rate
+        self.lr_range_test_steps = lr_range_test_steps
+        # Seconds to build and train the net in, e.g. a part of the
+        # per_run_time_limit of auto-sklearn. Epochs are cut to fit.
+        self.time_budget = time_budget
+        # Larger minibatches are trained by gradient accumulation, which
+        # caps the memory of the activations
+        self.max_micro_batch_size = max_micro_batch_size
+        # Past points that partial_fit trains on along with new data
+        self.replay_size = replay_size
+        # Number of classes above which a sampled softmax of about as
+        # many classes is trained
+        self.sampled_softmax_threshold = sampled_softmax_threshold
+        # Datasets of up to this many points are fit with full batch L-BFGS
+        self.lbfgs_threshold = lbfgs_threshold
+        # Drop constant and duplicate input columns before the first layer
+        self.compact_features = compact_features
+        # Sparse input is hashed into this many columns, 0 keeps them all
+        self.hash_buckets = hash_buckets
+        # Sparse input only updates the first layer rows it uses
+        self.lazy_updates = lazy_updates
+        # Threads used for prediction
+        self.n_jobs = n_jobs
 
         # Empty features and shape
         self.n_features = None
@@ -68,6 +102,7 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
         self.leakiness_per_layer = []
         self.tanh_alpha_per_layer = []
         self.tanh_beta_per_layer = []
+        self.rank_fraction_per_layer = []
         for i in range(1, self.num_layers):
             self.num_units_per_layer.append(int(args.get("num_units_layer_" + str(i))))
             self.dropout_per_layer.append(float(args.get("dropout_layer_" + str(i))))
@@ -77,13 +112,34 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
             self.leakiness_per_layer.append(float(args.get("leakiness_layer_" + str(i))))
             self.tanh_alpha_per_layer.append(float(args.get("tanh_alpha_layer_" + str(i))))
             self.tanh_beta_per_layer.append(float(args.get("tanh_beta_layer_" + str(i))))
+            self.rank_fraction_per_layer.append(float(args.get("rank_fraction_layer_" + str(i))))
         self.estimator = None
         self.random_state = random_state
 
+        # Fitted column selection in front of the estimator
+        self.compactor = None
+        self.first_layer_reduction = 0
+
+    def _fit_compactor(self, X):
+        self.compactor = None
+        if self.compact_features:
+            from implementation import FeatureCompaction
+            self.compactor = FeatureCompaction.FeatureCompactor().fit(X)
+
+    def _transform(self, X):
+        if self.compactor is None:
+            return X
+        return self.compactor.transform(X)
+
     def _prefit(self, X, y):
         self.batch_size = int(self.batch_size)
+        X = self._transform(X)
         self.n_features = X.shape[1]
         self.input_shape = (self.batch_size, self.n_features)
+        if self.max_micro_batch_size is None:
+            self.accumulation_steps = 1
+        else:
+            self.accumulation_steps = -(-self.batch_size // int(self.max_micro_batch_size))
 
         assert len(self.num_units_per_layer) == self.num_layers - 1,\
             "Number of created layers is different than actual layers"
@@ -102,13 +158,35 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                     y = y[:, np.newaxis]
             else:
                 self.num_output_units = number_classes
+        # Many classes are trained through a softmax over a sample of them.
+        # Its updates are not implemented for adadelta nor accumulation,
+        # these keep the full softmax.
+        if self.sampled_softmax_threshold is not None and \
+                self.num_output_units > self.sampled_softmax_threshold and \
+                not self.m_ismultilabel and self.solver != 'adadelta' and \
+                self.accumulation_steps == 1:
+            self.sampled_softmax = int(self.sampled_softmax_threshold)
+        else:
+            self.sampled_softmax = 0
+
+        if self.compactor is not None:
+            # Weights of the first layer that compaction saved
+            first_units = (self.num_units_per_layer + [self.num_output_units])[0]
+            self.first_layer_reduction = (self.compactor.n_features_in -
+                                          self.n_features) * first_units
 
         self.m_issparse = sp.issparse(X)
+        # Lazy rows need sparse input and are only implemented for sgd
+        # and momentum without accumulation, the rest train with the
+        # dense updates
+        self.use_lazy_updates = self.lazy_updates and self.m_issparse and \
+            self.solver in ('sgd', 'momentum', 'nesterov') and self.accumulation_steps == 1
 
         return X, y
 
     def fit(self, X, y):
 
+        self._fit_compactor(X)
         Xf, yf = self._prefit(X, y)
 
         epoch = (self.number_updates * self.batch_size)//X.shape[0]
@@ -126,6 +204,7 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                                        leakiness_per_layer=self.leakiness_per_layer,
                                                        tanh_alpha_per_layer=self.tanh_alpha_per_layer,
                                                        tanh_beta_per_layer=self.tanh_beta_per_layer,
+                                                       rank_fraction_per_layer=self.rank_fraction_per_layer,
                                                        num_output_units=self.num_output_units,
                                                        dropout_output=self.dropout_output,
                                                        learning_rate=self.learning_rate,
@@ -140,22 +219,55 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                                        gamma=self.gamma,
                                                        power=self.power,
                                                        epoch_step=self.epoch_step,
+                                                       batch_policy=self.batch_policy,
                                                        is_sparse=self.m_issparse,
                                                        is_binary=self.m_isbinary,
                                                        is_multilabel=self.m_ismultilabel,
+                                                       lr_range_test_steps=self.lr_range_test_steps,
+                                                       sampler=self.sampler,
+                                                       time_budget=self.time_budget,
+                                                       accumulation_steps=self.accumulation_steps,
+                                                       replay_size=self.replay_size,
+                                                       sampled_softmax=self.sampled_softmax,
+                                                       lbfgs_threshold=self.lbfgs_threshold,
+                                                       hash_buckets=self.hash_buckets if self.m_issparse else 0,
+                                                       lazy_updates=self.use_lazy_updates,
                                                        random_state=self.random_state)
+        if self.warm_start:
+            from implementation import WeightStore
+            store = WeightStore.WeightStore(self.weight_store_dir)
+            dataset_key = store.dataset_key(Xf)
+            shapes = [v.shape for v in self.estimator.get_param_values()]
+            self.estimator.set_param_values(store.load(dataset_key, shapes))
         self.estimator.fit(Xf, yf)
+        if self.warm_start:
+            store.save(dataset_key, self.estimator.get_param_values())
+        self.estimator.export()
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Trains one more epoch on a new chunk of data and the replay buffer
+        of the estimator. The first call fits the network, which fixes
+        the classes.
+        """
+        if self.estimator is None:
+            return self.fit(X, y)
+        if self.m_isbinary and len(y.shape) == 1:
+            y = y[:, np.newaxis]
+        self.estimator.partial_fit(self._transform(X), y)
+        self.estimator.export()
         return self
 
     def predict(self, X):
         if self.estimator is None:
             raise NotImplementedError
-        return self.estimator.predict(X, self.m_issparse)
+        return self.estimator.predict(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
 
     def predict_proba(self, X):
         if self.estimator is None:
             raise NotImplementedError()
-        return self.estimator.predict_proba(X, self.m_issparse)
+        return self.estimator.predict_proba(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
 
     @staticmethod
     def get_properties(dataset_properties=None):
@@ -216,6 +328,12 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
         cs.add_hyperparameter(l2)
         cs.add_hyperparameter(dropout_output)
 
+        # Order of the training points in each epoch
+        sampler = CategoricalHyperparameter("sampler",
+                                            choices=["uniform", "stratified", "loss"],
+                                            default="uniform")
+        cs.add_hyperparameter(sampler)
+
         #  Define parameters with different child parameters and conditions
         solver_choices = ["adam", "adadelta", "adagrad",
                           "sgd", "momentum", "nesterov",
@@ -241,7 +359,7 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                               default=0.9)
 
         # TODO: Add policy based on this sklearn sgd
-        policy_choices = ['fixed', 'inv', 'exp', 'step']
+        policy_choices = ['fixed', 'inv', 'exp', 'step', 'cyclic']
 
         lr_policy = CategoricalHyperparameter(name="lr_policy",
                                               choices=policy_choices,
@@ -259,6 +377,11 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                                   2, 20,
                                                   default=5)
 
+        # Grows the batch size by the decay of the lr policy instead
+        batch_policy = CategoricalHyperparameter(name="batch_policy",
+                                                 choices=['fixed', 'growth'],
+                                                 default='fixed')
+
         cs.add_hyperparameter(solver)
         cs.add_hyperparameter(beta1)
         cs.add_hyperparameter(beta2)
@@ -268,6 +391,7 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
         cs.add_hyperparameter(gamma)
         cs.add_hyperparameter(power)
         cs.add_hyperparameter(epoch_step)
+        cs.add_hyperparameter(batch_policy)
 
         # Define parameters that are needed it for each layer
         output_activation_choices = ['softmax', 'sigmoid', 'softplus', 'tanh']
@@ -323,6 +447,12 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                                          log=True,
                                                          default=1.7159)
             cs.add_hyperparameter(layer_tanh_beta)
+            # Fraction of the full rank of a factorized W = U.V
+            layer_rank_fraction = UniformFloatHyperparameter('rank_fraction_layer_' + str(i),
+                                                             0.01, 1.0,
+                                                             log=True,
+                                                             default=1.0)
+            cs.add_hyperparameter(layer_rank_fraction)
 
         # TODO: Could be in a function in a new module
         for i in range(2, max_num_layers):
@@ -369,6 +499,11 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
                                               parent=layer_activation_param,
                                               value='scaledTanh')
             cs.add_condition(activation_cond)
+            # Condition rank fraction on layer choice
+            layer_rank_param = cs.get_hyperparameter("rank_fraction_layer_" + str(i))
+            layer_cond = InCondition(child=layer_rank_param, parent=num_layers,
+                                     values=[l for l in layer_choices[i-1:]])
+            cs.add_condition(layer_cond)
 
         # Conditioning on solver
         momentum_depends_on_solver = InCondition(momentum, solver,
@@ -389,11 +524,15 @@ class DeepFeedNet(AutoSklearnClassificationAlgorithm):
         gamma_depends_on_policy = InCondition(child=gamma, parent=lr_policy,
                                               values=["inv", "exp", "step"])
         power_depends_on_policy = EqualsCondition(power, lr_policy, "inv")
-        epoch_step_depends_on_policy = EqualsCondition(epoch_step, lr_policy, "step")
+        epoch_step_depends_on_policy = InCondition(child=epoch_step, parent=lr_policy,
+                                                   values=["step", "cyclic"])
+        batch_policy_depends_on_policy = InCondition(child=batch_policy, parent=lr_policy,
+                                                     values=["inv", "exp", "step"])
 
         cs.add_condition(lr_policy_depends_on_solver)
         cs.add_condition(gamma_depends_on_policy)
         cs.add_condition(power_depends_on_policy)
         cs.add_condition(epoch_step_depends_on_policy)
+        cs.add_condition(batch_policy_depends_on_policy)
 
         return cs
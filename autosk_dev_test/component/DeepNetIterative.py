@@ -3,6 +3,9 @@
  Created: Hector Mendoza
 """
 
+import hashlib
+import os
+
 import numpy as np
 import scipy.sparse as sp
 
@@ -15,6 +18,15 @@ from autosklearn.pipeline.components.base import AutoSklearnClassificationAlgori
 from autosklearn.pipeline.constants import *
 
 
+def _random_state_key(random_state):
+    # The repr of a RandomState holds its address, which differs between
+    # the processes of restarted evaluations. Its state does not.
+    if isinstance(random_state, np.random.RandomState):
+        name, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+        return name, hashlib.md5(keys.tobytes()).hexdigest(), pos, has_gauss, cached_gaussian
+    return random_state
+
+
 class DeepNetIterative(AutoSklearnClassificationAlgorithm):
     def __init__(self, number_epochs, batch_size, num_layers,
                  dropout_output, learning_rate, solver,
@@ -39,6 +51,42 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         self.gamma = kwargs.get("gamma", 0.01)
         self.power = kwargs.get("power", 1.0)
         self.epoch_step = kwargs.get("epoch_step", 1)
+        self.batch_policy = kwargs.get("batch_policy", "fixed")
+        self.sampler = kwargs.get("sampler", "uniform")
+        # Initialize from the weights of previous fits with the same shapes
+        self.warm_start = kwargs.get("warm_start", False)
+        self.weight_store_dir = kwargs.get("weight_store_dir", None)
+        # Minibatches of the lr range test that clips the learning rate
+        self.lr_range_test_steps = kwargs.get("lr_range_test_steps", 0)
+        # Seconds to build and train the net in, e.g. a part of the
+        # per_run_time_limit of auto-sklearn. Epochs are cut to fit.
+        self.time_budget = kwargs.get("time_budget", None)
+        # Larger minibatches are trained by gradient accumulation, which
+        # caps the memory of the activations
+        self.max_micro_batch_size = kwargs.get("max_micro_batch_size", None)
+        # Past points that partial_fit trains on along with new data
+        self.replay_size = kwargs.get("replay_size", 0)
+        # Number of classes above which a sampled softmax of about as
+        # many classes is trained
+        self.sampled_softmax_threshold = kwargs.get("sampled_softmax_threshold", None)
+        # Datasets of up to this many points are fit with full batch L-BFGS
+        self.lbfgs_threshold = kwargs.get("lbfgs_threshold", 0)
+        # Drop constant and duplicate input columns before the first layer
+        self.compact_features = kwargs.get("compact_features", False)
+        # Sparse input is hashed into this many columns, 0 keeps them all
+        self.hash_buckets = kwargs.get("hash_buckets", 0)
+        # Sparse input only updates the first layer rows it uses
+        self.lazy_updates = kwargs.get("lazy_updates", False)
+        # Threads used for prediction
+        self.n_jobs = kwargs.get("n_jobs", 1)
+        # Checkpoint the training state after every epoch, a restarted
+        # evaluation of the same configuration resumes from it
+        self.checkpoint = kwargs.get("checkpoint", False)
+        self.checkpoint_dir = kwargs.get("checkpoint_dir", None)
+        self.configuration_key = hashlib.md5(repr((number_epochs, batch_size, num_layers,
+                                                   dropout_output, learning_rate, solver,
+                                                   lambda2, _random_state_key(random_state),
+                                                   sorted(kwargs.items()))).encode()).hexdigest()
         # Add special iterative member
         self._iterations = 0
 
@@ -58,6 +106,7 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         self.leakiness_per_layer = []
         self.tanh_alpha_per_layer = []
         self.tanh_beta_per_layer = []
+        self.rank_fraction_per_layer = []
         for i in range(1, self.num_layers):
             self.num_units_per_layer.append(int(kwargs.get("num_units_layer_" + str(i), 128)))
             self.dropout_per_layer.append(float(kwargs.get("dropout_layer_" + str(i), 0.5)))
@@ -67,13 +116,37 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
             self.leakiness_per_layer.append(float(kwargs.get("leakiness_layer_" + str(i), 1./3.)))
             self.tanh_alpha_per_layer.append(float(kwargs.get("tanh_alpha_layer_" + str(i), 2./3.)))
             self.tanh_beta_per_layer.append(float(kwargs.get("tanh_beta_layer_" + str(i), 1.7159)))
+            self.rank_fraction_per_layer.append(float(kwargs.get("rank_fraction_layer_" + str(i), 1.0)))
         self.estimator = None
         self.random_state = random_state
 
+        # Fitted column selection in front of the estimator
+        self.compactor = None
+        self.first_layer_reduction = 0
+        # (X, y, Xf, yf) of the data being fit, the compacted data is
+        # reused by the next iterations
+        self._fit_data = None
+
+    def _fit_compactor(self, X):
+        self.compactor = None
+        if self.compact_features:
+            from implementation import FeatureCompaction
+            self.compactor = FeatureCompaction.FeatureCompactor().fit(X)
+
+    def _transform(self, X):
+        if self.compactor is None:
+            return X
+        return self.compactor.transform(X)
+
     def _prefit(self, X, y):
         self.batch_size = int(self.batch_size)
+        X = self._transform(X)
         self.n_features = X.shape[1]
         self.input_shape = (self.batch_size, self.n_features)
+        if self.max_micro_batch_size is None:
+            self.accumulation_steps = 1
+        else:
+            self.accumulation_steps = -(-self.batch_size // int(self.max_micro_batch_size))
 
         assert len(self.num_units_per_layer) == self.num_layers - 1,\
             "Number of created layers is different than actual layers"
@@ -92,24 +165,53 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                     y = y[:, np.newaxis]
             else:
                 self.num_output_units = number_classes
+        # Many classes are trained through a softmax over a sample of them.
+        # Its updates are not implemented for adadelta nor accumulation,
+        # these keep the full softmax.
+        if self.sampled_softmax_threshold is not None and \
+                self.num_output_units > self.sampled_softmax_threshold and \
+                not self.m_ismultilabel and self.solver != 'adadelta' and \
+                self.accumulation_steps == 1:
+            self.sampled_softmax = int(self.sampled_softmax_threshold)
+        else:
+            self.sampled_softmax = 0
+
+        if self.compactor is not None:
+            # Weights of the first layer that compaction saved
+            first_units = (self.num_units_per_layer + [self.num_output_units])[0]
+            self.first_layer_reduction = (self.compactor.n_features_in -
+                                          self.n_features) * first_units
 
         self.m_issparse = sp.issparse(X)
+        # Lazy rows need sparse input and are only implemented for sgd
+        # and momentum without accumulation, the rest train with the
+        # dense updates
+        self.use_lazy_updates = self.lazy_updates and self.m_issparse and \
+            self.solver in ('sgd', 'momentum', 'nesterov') and self.accumulation_steps == 1
 
         return X, y
 
     def fit(self, X, y, sample_weight=None):
 
-        Xf, yf = self._prefit(X, y)
+        # iterative_fit compacts and prepares the raw data itself
         while not self.configuration_fully_fitted():
-            self.iterative_fit(Xf, yf, n_iter=1, sample_weight=sample_weight)
+            self.iterative_fit(X, y, n_iter=1, sample_weight=sample_weight)
 
         return self
 
     def iterative_fit(self, X, y, n_iter=1, refit=False, sample_weight=None):
-        Xf, yf = self._prefit(X, y)
-
         if refit:
             self.estimator = None
+        if self.estimator is None:
+            self._fit_compactor(X)
+            self._fit_data = None
+
+        if self._fit_data is not None and self._fit_data[0] is X and \
+                self._fit_data[1] is y:
+            Xf, yf = self._fit_data[2:]
+        else:
+            Xf, yf = self._prefit(X, y)
+            self._fit_data = (X, y, Xf, yf)
 
         if self.estimator is None:
             self._iterations = 1
@@ -125,6 +227,7 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                                            leakiness_per_layer=self.leakiness_per_layer,
                                                            tanh_alpha_per_layer=self.tanh_alpha_per_layer,
                                                            tanh_beta_per_layer=self.tanh_beta_per_layer,
+                                                           rank_fraction_per_layer=self.rank_fraction_per_layer,
                                                            num_output_units=self.num_output_units,
                                                            dropout_output=self.dropout_output,
                                                            learning_rate=self.learning_rate,
@@ -139,17 +242,61 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                                            gamma=self.gamma,
                                                            power=self.power,
                                                            epoch_step=self.epoch_step,
+                                                           batch_policy=self.batch_policy,
                                                            is_sparse=self.m_issparse,
                                                            is_binary=self.m_isbinary,
                                                            is_multilabel=self.m_ismultilabel,
+                                                           lr_range_test_steps=self.lr_range_test_steps,
+                                                           sampler=self.sampler,
+                                                           time_budget=self.time_budget,
+                                                           accumulation_steps=self.accumulation_steps,
+                                                           replay_size=self.replay_size,
+                                                           sampled_softmax=self.sampled_softmax,
+                                                           lbfgs_threshold=self.lbfgs_threshold,
+                                                           hash_buckets=self.hash_buckets if self.m_issparse else 0,
+                                                           lazy_updates=self.use_lazy_updates,
                                                            random_state=self.random_state)
+            if self.warm_start:
+                from implementation import WeightStore
+                store = WeightStore.WeightStore(self.weight_store_dir)
+                shapes = [v.shape for v in self.estimator.get_param_values()]
+                self.estimator.set_param_values(store.load(store.dataset_key(Xf), shapes))
+            if self.checkpoint:
+                # Checkpoints are keyed by the dataset like the weight store
+                from implementation import Checkpoint, WeightStore
+                fname = os.path.join(Checkpoint.checkpoint_directory(self.checkpoint_dir),
+                                     '%s_%s.npz' % (WeightStore.WeightStore.dataset_key(Xf),
+                                                    self.configuration_key))
+                state = Checkpoint.Checkpointer.load(fname)
+                if state is not None:
+                    self.estimator.set_train_state(state)
+                    self._iterations = self.estimator.epochs_trained + 1
+                    print('Resuming from epoch %d' % self.estimator.epochs_trained)
+                self.estimator.checkpointer = Checkpoint.Checkpointer(fname)
         self.estimator.num_epochs = n_iter
         print('Increasing epochs %d' % n_iter)
         print('Iterations: %d' % self._iterations)
         self.estimator.fit(Xf, yf)
+        if Xf.shape[0] <= self.lbfgs_threshold:
+            # L-BFGS ran to convergence, there are no epochs left
+            self._iterations = max(self._iterations, self.number_epochs)
+        if self.time_budget is not None and self._iterations < self.number_epochs:
+            # Projected again after every epoch, the rest is cut to the budget
+            self.number_epochs = self._iterations + \
+                self.estimator.budget_epochs(self.number_epochs - self._iterations)
 
         if self._iterations >= self.number_epochs:
             self._fully_fit = True
+            self._fit_data = None
+            if self.warm_start:
+                from implementation import WeightStore
+                store = WeightStore.WeightStore(self.weight_store_dir)
+                store.save(store.dataset_key(Xf), self.estimator.get_param_values())
+            if self.estimator.checkpointer is not None:
+                # Nothing left to resume
+                self.estimator.checkpointer.remove()
+                self.estimator.checkpointer = None
+            self.estimator.export()
         self._iterations += n_iter
         return self
 
@@ -161,15 +308,35 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         else:
             return self._fully_fit
 
+    def partial_fit(self, X, y):
+        """
+        Trains one more epoch on a new chunk of data and the replay buffer
+        of the estimator. The first call fits the network, which fixes
+        the classes.
+        """
+        if self.estimator is None:
+            return self.fit(X, y)
+        if self.m_isbinary and len(y.shape) == 1:
+            y = y[:, np.newaxis]
+        self.estimator.partial_fit(self._transform(X), y)
+        self.estimator.export()
+        return self
+
     def predict(self, X):
         if self.estimator is None:
             raise NotImplementedError
-        return self.estimator.predict(X, self.m_issparse)
+        return self.estimator.predict(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
 
     def predict_proba(self, X):
         if self.estimator is None:
             raise NotImplementedError()
-        return self.estimator.predict_proba(X, self.m_issparse)
+        return self.estimator.predict_proba(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
+
+    def predict_proba_snapshots(self, X):
+        # One set of predictions per cycle of the cyclic lr policy
+        if self.estimator is None:
+            raise NotImplementedError()
+        return self.estimator.predict_proba_snapshots(self._transform(X), self.m_issparse)
 
     @staticmethod
     def get_properties(dataset_properties=None):
@@ -227,6 +394,12 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         cs.add_hyperparameter(l2)
         cs.add_hyperparameter(dropout_output)
 
+        # Order of the training points in each epoch
+        sampler = CategoricalHyperparameter("sampler",
+                                            choices=["uniform", "stratified", "loss"],
+                                            default="uniform")
+        cs.add_hyperparameter(sampler)
+
         #  Define parameters with different child parameters and conditions
         solver_choices = ["adam", "adadelta", "adagrad",
                           "sgd", "momentum", "nesterov",
@@ -252,7 +425,7 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                               default=0.9)
 
         # TODO: Add policy based on this sklearn sgd
-        policy_choices = ['fixed', 'inv', 'exp', 'step']
+        policy_choices = ['fixed', 'inv', 'exp', 'step', 'cyclic']
 
         lr_policy = CategoricalHyperparameter(name="lr_policy",
                                               choices=policy_choices,
@@ -270,6 +443,11 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                                   2, 20,
                                                   default=5)
 
+        # Grows the batch size by the decay of the lr policy instead
+        batch_policy = CategoricalHyperparameter(name="batch_policy",
+                                                 choices=['fixed', 'growth'],
+                                                 default='fixed')
+
         cs.add_hyperparameter(solver)
         cs.add_hyperparameter(beta1)
         cs.add_hyperparameter(beta2)
@@ -279,6 +457,7 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         cs.add_hyperparameter(gamma)
         cs.add_hyperparameter(power)
         cs.add_hyperparameter(epoch_step)
+        cs.add_hyperparameter(batch_policy)
 
         # Define parameters that are needed it for each layer
         output_activation_choices = ['softmax', 'sigmoid', 'softplus', 'tanh']
@@ -328,6 +507,12 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                                          log=True,
                                                          default=1.7159)
             cs.add_hyperparameter(layer_tanh_beta)
+            # Fraction of the full rank of a factorized W = U.V
+            layer_rank_fraction = UniformFloatHyperparameter('rank_fraction_layer_' + str(i),
+                                                             0.01, 1.0,
+                                                             log=True,
+                                                             default=1.0)
+            cs.add_hyperparameter(layer_rank_fraction)
 
         # TODO: Could be in a function in a new module
         for i in range(2, max_num_layers):
@@ -374,6 +559,11 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
                                               parent=layer_activation_param,
                                               value='scaledTanh')
             cs.add_condition(activation_cond)
+            # Condition rank fraction on layer choice
+            layer_rank_param = cs.get_hyperparameter("rank_fraction_layer_" + str(i))
+            layer_cond = InCondition(child=layer_rank_param, parent=num_layers,
+                                     values=[l for l in layer_choices[i-1:]])
+            cs.add_condition(layer_cond)
 
         # Conditioning on solver
         momentum_depends_on_solver = InCondition(momentum, solver,
@@ -394,11 +584,15 @@ class DeepNetIterative(AutoSklearnClassificationAlgorithm):
         gamma_depends_on_policy = InCondition(child=gamma, parent=lr_policy,
                                               values=["inv", "exp", "step"])
         power_depends_on_policy = EqualsCondition(power, lr_policy, "inv")
-        epoch_step_depends_on_policy = EqualsCondition(epoch_step, lr_policy, "step")
+        epoch_step_depends_on_policy = InCondition(child=epoch_step, parent=lr_policy,
+                                                   values=["step", "cyclic"])
+        batch_policy_depends_on_policy = InCondition(child=batch_policy, parent=lr_policy,
+                                                     values=["inv", "exp", "step"])
 
         cs.add_condition(lr_policy_depends_on_solver)
         cs.add_condition(gamma_depends_on_policy)
         cs.add_condition(power_depends_on_policy)
         cs.add_condition(epoch_step_depends_on_policy)
+        cs.add_condition(batch_policy_depends_on_policy)
 
         return cs
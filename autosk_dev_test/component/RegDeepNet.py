@@ -34,6 +34,14 @@ class RegDeepNet(AutoSklearnRegressionAlgorithm):
         self.gamma = kwargs.get("gamma", 0.01)
         self.power = kwargs.get("power", 1.0)
         self.epoch_step = kwargs.get("epoch_step", 1)
+        # Threads used for prediction
+        self.n_jobs = kwargs.get("n_jobs", 1)
+        # Past points that partial_fit trains on along with new data
+        self.replay_size = kwargs.get("replay_size", 0)
+        # Datasets of up to this many points are fit with full batch L-BFGS
+        self.lbfgs_threshold = kwargs.get("lbfgs_threshold", 0)
+        # Drop constant and duplicate input columns before the first layer
+        self.compact_features = kwargs.get("compact_features", False)
 
         # Empty features and shape
         self.n_features = None
@@ -64,8 +72,24 @@ class RegDeepNet(AutoSklearnRegressionAlgorithm):
         self.estimator = None
         self.random_state = random_state
 
+        # Fitted column selection in front of the estimator
+        self.compactor = None
+        self.first_layer_reduction = 0
+
+    def _fit_compactor(self, X):
+        self.compactor = None
+        if self.compact_features:
+            from implementation import FeatureCompaction
+            self.compactor = FeatureCompaction.FeatureCompactor().fit(X)
+
+    def _transform(self, X):
+        if self.compactor is None:
+            return X
+        return self.compactor.transform(X)
+
     def _prefit(self, X, y):
         self.batch_size = int(self.batch_size)
+        X = self._transform(X)
         self.n_features = X.shape[1]
         self.input_shape = (self.batch_size, self.n_features)
 
@@ -82,12 +106,19 @@ class RegDeepNet(AutoSklearnRegressionAlgorithm):
         if len(y.shape) == 1:
             y = y[:, np.newaxis]
 
+        if self.compactor is not None:
+            # Weights of the first layer that compaction saved
+            first_units = (self.num_units_per_layer + [self.num_output_units])[0]
+            self.first_layer_reduction = (self.compactor.n_features_in -
+                                          self.n_features) * first_units
+
         self.m_issparse = sp.issparse(X)
 
         return X, y
 
     def fit(self, X, y):
 
+        self._fit_compactor(X)
         Xf, yf = self._prefit(X, y)
 
         from implementation import FeedForwardNet
@@ -120,20 +151,37 @@ class RegDeepNet(AutoSklearnRegressionAlgorithm):
                                                        is_binary=self.m_isbinary,
                                                        is_multilabel=self.m_ismultilabel,
                                                        is_regression=self.m_isregression,
+                                                       replay_size=self.replay_size,
+                                                       lbfgs_threshold=self.lbfgs_threshold,
                                                        random_state=self.random_state)
         self.estimator.fit(Xf, yf)
+        self.estimator.export()
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Trains one more epoch on a new chunk of data and the replay buffer
+        of the estimator. Targets keep the normalization of the first fit.
+        """
+        if self.estimator is None:
+            return self.fit(X, y)
+        y = (y - self.mean_y) / self.std_y
+        if len(y.shape) == 1:
+            y = y[:, np.newaxis]
+        self.estimator.partial_fit(self._transform(X), y)
+        self.estimator.export()
         return self
 
     def predict(self, X):
         if self.estimator is None:
             raise NotImplementedError
-        preds = self.estimator.predict(X, self.m_issparse)
+        preds = self.estimator.predict(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
         return preds * self.std_y + self.mean_y
 
     def predict_proba(self, X):
         if self.estimator is None:
             raise NotImplementedError()
-        return self.estimator.predict_proba(X, self.m_issparse)
+        return self.estimator.predict_proba(self._transform(X), self.m_issparse, n_jobs=self.n_jobs)
 
     @staticmethod
     def get_properties(dataset_properties=None):
@@ -0,0 +1,120 @@
+"""
+ Background checkpoints of the training state of a FeedForwardNet
+"""
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def checkpoint_directory(directory=None):
+    if directory is None:
+        directory = os.environ.get('AUTONET_CHECKPOINT_DIR',
+                                   os.path.join(tempfile.gettempdir(),
+                                                'autonet_checkpoints'))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another run created it meanwhile
+            pass
+    return directory
+
+
+class Checkpointer(object):
+    """
+    Writes training states to fname from a background thread, so that an
+    epoch does not wait for the disk. Only the newest state is written
+    when a previous write is still running. Files are written aside and
+    renamed, a run killed at any point leaves the last complete state.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        # Seconds the training thread spent handing over states, and
+        # seconds the background thread spent writing them
+        self.save_times = []
+        self.write_times = []
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._write_loop, name='checkpointer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, state_fn):
+        """
+        state_fn returns the state as a dict of arrays. It is called here,
+        the copying of the weights is the only part done on the caller
+        """
+        start = time.time()
+        state = state_fn()
+        with self._condition:
+            self._pending = state
+            self._condition.notify_all()
+        self.save_times.append(time.time() - start)
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                state, self._pending = self._pending, None
+                self._writing = True
+            start = time.time()
+            try:
+                with open(self.fname + '.tmp', 'wb') as fh:
+                    np.savez(fh, **state)
+                os.rename(self.fname + '.tmp', self.fname)
+            except (IOError, OSError) as e:
+                print('Checkpoint error: %s' % e)
+            self.write_times.append(time.time() - start)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self):
+        # Waits until the last saved state is on disk
+        with self._condition:
+            while self._pending is not None or self._writing:
+                self._condition.wait()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.fname)
+        except OSError:
+            pass
+
+    @staticmethod
+    def load(fname):
+        # The last complete state, or None
+        try:
+            with np.load(fname) as stored:
+                return dict((key, stored[key]) for key in stored.files)
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def load_estimator(cls, fname):
+        """
+        The FeedForwardNet of the last complete state in fname, or None.
+        Used to predict with what a killed run had trained, no training
+        functions are compiled. Resuming the run is set_train_state on a
+        net of the same configuration.
+        """
+        state = cls.load(fname)
+        if state is None:
+            return None
+        from .FeedForwardNet import FeedForwardNet
+        return FeedForwardNet.from_train_state(state, compile_functions=False)
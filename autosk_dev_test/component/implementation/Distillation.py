@@ -0,0 +1,80 @@
+"""
+ Distills a teacher network, or an ensemble of them, into a small
+ FeedForwardNet student
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from .FeedForwardNet import FeedForwardNet
+
+DEBUG = True
+
+
+class DistillationTrainer(object):
+    """
+    Trains a student on the class probabilities of the teachers, averaged
+    and softened by the temperature. Teachers are anything with a
+    predict_proba(X), e.g. fitted DeepNetIterative components.
+    """
+    def __init__(self, teachers, temperature=2.0, num_units_per_layer=(64,),
+                 is_multilabel=False, **kwargs):
+        self.teachers = teachers
+        self.temperature = temperature
+        self.num_units_per_layer = tuple(num_units_per_layer)
+        self.is_multilabel = is_multilabel
+        self.student_kwargs = kwargs
+        self.student = None
+
+    def soft_targets(self, X, eps=1e-7):
+        probabilities = np.mean([teacher.predict_proba(X) for teacher in self.teachers],
+                                axis=0)
+        probabilities = np.clip(probabilities, eps, 1 - eps)
+        if self.is_multilabel or probabilities.shape[1] == 2:
+            if not self.is_multilabel:
+                # Binary students have a single sigmoid output
+                probabilities = probabilities[:, 1:]
+            logits = np.log(probabilities) - np.log(1 - probabilities)
+            return 1. / (1. + np.exp(-logits / self.temperature))
+        softened = np.power(probabilities, 1. / self.temperature)
+        return softened / softened.sum(axis=1, keepdims=True)
+
+    def fit(self, X, soft_targets=None):
+        """
+        Fits the student on X, soft_targets are computed from the
+        teachers unless given
+        """
+        if soft_targets is None:
+            soft_targets = self.soft_targets(X)
+        is_binary = not self.is_multilabel and soft_targets.shape[1] == 1
+        num_hidden = len(self.num_units_per_layer)
+        student_kwargs = dict(input_shape=(100, X.shape[1]),
+                              num_layers=num_hidden + 1,
+                              num_units_per_layer=self.num_units_per_layer,
+                              dropout_per_layer=(0.0,) * num_hidden,
+                              dropout_output=0.0,
+                              activation_per_layer=('relu',) * num_hidden,
+                              weight_init_per_layer=('he_normal',) * num_hidden,
+                              std_per_layer=(0.005,) * num_hidden,
+                              rank_fraction_per_layer=(1.0,) * num_hidden,
+                              num_output_units=soft_targets.shape[1],
+                              solver='adam', learning_rate=0.001, num_epochs=20,
+                              is_sparse=sp.issparse(X))
+        student_kwargs.update(self.student_kwargs)
+        if DEBUG:
+            print("... distilling %d teachers at temperature %.2f" %
+                  (len(self.teachers), self.temperature))
+        self.student = FeedForwardNet(is_binary=is_binary,
+                                      is_multilabel=self.is_multilabel,
+                                      soft_targets=True,
+                                      temperature=self.temperature,
+                                      **student_kwargs)
+        self.student.fit(X, soft_targets)
+        self.student.set_temperature(1.0)
+        self.student.export()
+        return self
+
+    def predict(self, X, is_sparse=False):
+        return self.student.predict(X, is_sparse)
+
+    def predict_proba(self, X, is_sparse=False):
+        return self.student.predict_proba(X, is_sparse)
@@ -0,0 +1,162 @@
+"""
+ Batched prediction of ensemble members that share their architecture
+"""
+import types
+
+import numpy as np
+import theano
+import theano.tensor as T
+import theano.sparse as S
+
+from .FeedForwardNet import sharedX
+from .Profiling import function_profile, profiling_enabled
+
+DEBUG = True
+
+
+def _nonlinearity_key(nonlinearity):
+    # Parametrized nonlinearities are equal if their parameters are, shared
+    # parameters like the temperature by their current value
+    if isinstance(nonlinearity, (types.FunctionType, types.BuiltinFunctionType)):
+        return nonlinearity
+    return type(nonlinearity), tuple(sorted((k, _parameter_key(v)) for k, v in
+                                            vars(nonlinearity).items()))
+
+
+def _parameter_key(value):
+    if isinstance(value, theano.compile.SharedVariable):
+        return repr(np.asarray(value.get_value()).tolist())
+    if callable(value):
+        return _nonlinearity_key(value)
+    return repr(value)
+
+
+class EnsemblePredictor(object):
+    """
+    Weighted average of the predict_proba of fitted FeedForwardNets, or of
+    components holding one as estimator, of their predicted values for
+    regression, in the target scale of components that normalize it.
+    Members whose exported layers
+    have the same shapes and nonlinearities are stacked into one forward
+    pass, with their first layers as a single wide product with X.
+    """
+    def __init__(self, members, weights=None, is_sparse=False, chunk_size=10000,
+                 profile=None):
+        self.members = list(members)
+        if weights is None:
+            weights = np.ones(len(self.members))
+        weights = np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+        self.is_sparse = is_sparse
+        self.chunk_size = chunk_size
+        self.profile = profiling_enabled(profile)
+        # (net, transform, is_sparse, predict_fn, weight) of each group,
+        # net is its first member and weight the sum of the member weights
+        self.groups = []
+        self._build_groups()
+
+    def _member_net(self, member):
+        # Also returns the scale and shift that map the outputs of the net
+        # to the predictions of the member, RegDeepNet normalizes targets
+        if hasattr(member, 'estimator'):
+            transform = getattr(member, '_transform', lambda X: X)
+            compactor = getattr(member, 'compactor', None)
+            compactor_key = None if compactor is None else compactor.kept_columns.tobytes()
+            scale = getattr(member, 'std_y', 1.)
+            shift = getattr(member, 'mean_y', 0.)
+            return member.estimator, transform, member.m_issparse, compactor_key, scale, shift
+        return member, lambda X: X, self.is_sparse, None, 1., 0.
+
+    def _build_groups(self):
+        grouped = {}
+        scales = np.ones(len(self.members))
+        shifts = np.zeros(len(self.members))
+        for i, member in enumerate(self.members):
+            net, transform, is_sparse, compactor_key, scales[i], shifts[i] = \
+                self._member_net(member)
+            if net.exported_layers is None:
+                net.export()
+            key = (tuple((W.shape, b.shape, _nonlinearity_key(nonlinearity))
+                         for W, b, nonlinearity in net.exported_layers),
+                   net.is_binary, is_sparse, net.hash_buckets, compactor_key)
+            grouped.setdefault(key, []).append((i, net, transform))
+        for key, group in grouped.items():
+            indices = [i for i, _, _ in group]
+            nets = [net for _, net, _ in group]
+            is_sparse = key[2]
+            weights = self.weights[indices]
+            predict_fn = self._compile_group(nets, weights * scales[indices], is_sparse,
+                                             offset=np.dot(weights, shifts[indices]))
+            self.groups.append((nets[0], group[0][2], is_sparse, predict_fn,
+                                self.weights[indices].sum()))
+        if DEBUG:
+            print("... %d ensemble members in %d forward passes" %
+                  (len(self.members), len(self.groups)))
+
+    @staticmethod
+    def _apply(nonlinearity, h):
+        # Softmax works on matrices, the members are folded into the rows
+        shape = h.shape
+        h = nonlinearity(h.reshape((shape[0] * shape[1], shape[2])))
+        return h.reshape((shape[0], shape[1], h.shape[1]))
+
+    def _compile_group(self, nets, weights, is_sparse, offset=0.):
+        """
+        Returns a function of X with the weighted sum of the outputs of
+        the nets, which have the same exported layer shapes, plus offset
+        """
+        if is_sparse:
+            input_var = S.csr_matrix('inputs', dtype=theano.config.floatX)
+        else:
+            input_var = T.matrix('inputs')
+        num_members = len(nets)
+        layers = list(zip(*[net.exported_layers for net in nets]))
+
+        first_layer = layers[0]
+        num_units = first_layer[0][0].shape[1]
+        W = sharedX(np.concatenate([W_m for W_m, _, _ in first_layer], axis=1))
+        b = sharedX(np.concatenate([b_m for _, b_m, _ in first_layer]))
+        dot = S.dot if is_sparse else T.dot
+        h = dot(input_var, W) + b.dimshuffle('x', 0)
+        # (rows, members * units) -> (members, rows, units)
+        h = h.reshape((h.shape[0], num_members, num_units)).dimshuffle(1, 0, 2)
+        h = self._apply(first_layer[0][2], h)
+
+        for layer in layers[1:]:
+            W = sharedX(np.stack([W_m for W_m, _, _ in layer]))
+            b = sharedX(np.stack([b_m for _, b_m, _ in layer]))
+            h = T.batched_dot(h, W) + b.dimshuffle(0, 'x', 1)
+            h = self._apply(layer[0][2], h)
+
+        output = T.tensordot(T.constant(weights.astype(theano.config.floatX)), h, axes=1)
+        if offset:
+            output = output + np.asarray(offset, dtype=theano.config.floatX)
+        return theano.function([input_var], output,
+                               allow_input_downcast=True,
+                               profile=function_profile(self.profile, 'ensemble_predict_fn'),
+                               name='ensemble_predict_fn')
+
+    def predict_proba(self, X):
+        predictions = None
+        for net, transform, is_sparse, predict_fn, weight in self.groups:
+            X_group = transform(X)
+            for start_idx in range(0, X.shape[0], self.chunk_size):
+                X_chunk = net._cast_predict_data(X_group[start_idx:start_idx + self.chunk_size],
+                                                 is_sparse)
+                chunk = predict_fn(X_chunk)
+                if net.is_binary:
+                    # The negative class gets the rest of the group weight
+                    chunk = np.column_stack((weight - chunk[:, 0], chunk[:, 0]))
+                if predictions is None:
+                    predictions = np.zeros((X.shape[0], chunk.shape[1]),
+                                           dtype=chunk.dtype)
+                predictions[start_idx:start_idx + self.chunk_size] += chunk
+        return predictions
+
+    def predict(self, X):
+        predictions = self.predict_proba(X)
+        if self.groups[0][0].is_multilabel:
+            return np.round(predictions)
+        elif self.groups[0][0].is_regression:
+            return predictions
+        return np.argmax(predictions, axis=1)
@@ -0,0 +1,64 @@
+"""
+ Drops the constant and duplicate input columns before the first layer
+"""
+import numpy as np
+import scipy.sparse as sp
+
+DEBUG = True
+
+
+class FeatureCompactor(object):
+    """
+    Keeps the first of each group of equal columns and no constant ones.
+    Sparse input stays CSR, with its column indices remapped to the range
+    of the kept columns.
+    """
+    def __init__(self, random_state=1):
+        self.random_state = random_state
+        self.kept_columns = None
+        self.n_features_in = None
+
+    def fit(self, X):
+        if sp.issparse(X):
+            X = X.tocsc()
+            constant = (X.max(axis=0).toarray().ravel() ==
+                        X.min(axis=0).toarray().ravel())
+        else:
+            constant = np.ptp(X, axis=0) == 0
+        # Equal columns have the same random projection, columns with
+        # close projections are compared one by one
+        rng = np.random.RandomState(self.random_state)
+        projection = np.asarray(X.T.dot(rng.randn(X.shape[0]))).ravel()
+        candidates = np.flatnonzero(~constant)
+        order = candidates[np.argsort(projection[candidates], kind='mergesort')]
+        kept = []
+        group = []
+        for column in order:
+            if group and not np.isclose(projection[column], projection[group[0]]):
+                group = []
+            if not any(self._equal_columns(X, column, other) for other in group):
+                group.append(column)
+                kept.append(column)
+        # At least one input for the network
+        self.kept_columns = np.sort(kept) if kept else np.arange(1)
+        self.n_features_in = X.shape[1]
+        if DEBUG:
+            print("... compacted %d input features to %d" %
+                  (self.n_features_in, len(self.kept_columns)))
+        return self
+
+    @staticmethod
+    def _equal_columns(X, i, j):
+        if sp.issparse(X):
+            return (X[:, i] != X[:, j]).nnz == 0
+        return np.array_equal(X[:, i], X[:, j])
+
+    def transform(self, X):
+        assert X.shape[1] == self.n_features_in,\
+            "Number of features is different than at fit"
+        if sp.issparse(X):
+            return X.tocsr()[:, self.kept_columns]
+        return X[:, self.kept_columns]
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
@@ -5,12 +5,30 @@ Modified on Apr 21, 2016
 @author: Aaron Klein
 @modified: Hector Mendoza
 """
+from collections import OrderedDict
+import contextlib
+import itertools
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
 import numpy as np
+import scipy.optimize
+import scipy.sparse as sp
+import scipy.special
 from sklearn.utils.validation import check_random_state
 import theano
 import theano.tensor as T
 import theano.sparse as S
 import lasagne
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+from .Profiling import function_profile, profiling_enabled, profile_summary, write_profile
 
 DEBUG = True
 
@@ -22,7 +40,7 @@ def sharedX(X, dtype=theano.config.floatX, name=None):
 def smorm3s(cost, params, learning_rate=1e-3, eps=1e-16, gather=False):
     updates = []
     optim_params = []
-    grads = T.grad(cost, params)
+    grads = lasagne.updates.get_or_compute_grads(cost, params)
 
     for p, grad in zip(params, grads):
         mem = sharedX(p.get_value() * 0. + 1.)
@@ -48,22 +66,363 @@ def smorm3s(cost, params, learning_rate=1e-3, eps=1e-16, gather=False):
     return updates
 
 
-def iterate_minibatches(inputs, targets, batchsize, shuffle=False, random_state=None):
+@contextlib.contextmanager
+def blas_threads(num_threads):
+    # Limits the threads of the loaded BLAS, if threadpoolctl is available
+    if threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits=num_threads, user_api='blas'):
+            yield
+
+
+def numpy_nonlinearity(nonlinearity):
+    """
+    numpy version of a lasagne nonlinearity, working in place on the
+    output of a layer. Like the GEMMs of the layers its ufuncs release
+    the GIL, so threads can run the forward pass at the same time.
+    """
+    nl = lasagne.nonlinearities
+    if isinstance(nonlinearity, TemperatureNonlinearity):
+        inner = numpy_nonlinearity(nonlinearity.nonlinearity)
+        temperature = nonlinearity.temperature
+        return lambda x: inner(np.divide(x, temperature.get_value(), out=x))
+    elif nonlinearity in (None, nl.linear, nl.identity):
+        return lambda x: x
+    elif nonlinearity is nl.rectify:
+        return lambda x: np.maximum(x, 0, out=x)
+    elif isinstance(nonlinearity, nl.LeakyRectify):
+        leakiness = nonlinearity.leakiness
+        return lambda x: np.where(x > 0, x, leakiness * x)
+    elif isinstance(nonlinearity, nl.ScaledTanH):
+        scale_in, scale_out = nonlinearity.scale_in, nonlinearity.scale_out
+        return lambda x: np.multiply(np.tanh(np.multiply(x, scale_in, out=x), out=x),
+                                     scale_out, out=x)
+    elif nonlinearity is nl.sigmoid:
+        return lambda x: scipy.special.expit(x, out=x)
+    elif nonlinearity is nl.tanh:
+        return lambda x: np.tanh(x, out=x)
+    elif nonlinearity is nl.elu:
+        return lambda x: np.where(x > 0, x, np.expm1(x))
+    elif nonlinearity is nl.softplus:
+        return lambda x: np.logaddexp(0, x, out=x)
+    elif nonlinearity is nl.softmax:
+        def softmax(x):
+            x -= x.max(axis=1, keepdims=True)
+            np.exp(x, out=x)
+            x /= x.sum(axis=1, keepdims=True)
+            return x
+        return softmax
+    raise ValueError("No numpy version of the nonlinearity %s" % nonlinearity)
+
+
+def stratified_order(targets, random_state=None):
+    """
+    Permutation of the training points that spreads every class evenly,
+    so each minibatch holds about its share of each class. Binary and
+    multilabel targets are stratified by their label pattern.
+    """
+    rng = check_random_state(random_state)
+    if targets.ndim == 2:
+        _, labels = np.unique(targets, axis=0, return_inverse=True)
+    else:
+        _, labels = np.unique(targets, return_inverse=True)
+    labels = labels.ravel()
+    positions = np.empty(len(labels))
+    for label in range(labels.max() + 1):
+        members = np.flatnonzero(labels == label)
+        positions[members] = (rng.permutation(len(members)) + rng.uniform()) / len(members)
+    return np.argsort(positions, kind='mergesort')
+
+
+def loss_weighted_order(example_losses, random_state=None, uniform_mix=0.5):
+    """
+    Draws as many training points as there are, with replacement and with
+    a probability p that grows with their last seen loss. The uniform part
+    keeps every point in play. Returns the order and the importance weight
+    1 / (N * p) of every drawn point, which keeps the weighted loss of a
+    minibatch an unbiased estimate of the loss of the training set.
+    """
+    rng = check_random_state(random_state)
+    num_points = len(example_losses)
+    probs = uniform_mix / num_points + \
+        (1 - uniform_mix) * example_losses / np.sum(example_losses)
+    probs /= np.sum(probs)
+    order = rng.choice(num_points, size=num_points, p=probs)
+    return order, 1. / (num_points * probs[order])
+
+
+def iterate_minibatches(inputs, targets, batchsize, shuffle=False, random_state=None,
+                        indices=None):
+    # indices, if given, is the order of the training points in this epoch
     assert inputs.shape[0] == targets.shape[0],\
            "The number of training points is not the same"
-    if shuffle:
+    if shuffle and indices is None:
         seed = check_random_state(random_state)
         indices = np.arange(inputs.shape[0])
         seed.shuffle(indices)
         # np.random.shuffle(indices)
     for start_idx in range(0, inputs.shape[0] - batchsize + 1, batchsize):
-        if shuffle:
+        if indices is not None:
             excerpt = indices[start_idx:start_idx + batchsize]
         else:
             excerpt = slice(start_idx, start_idx + batchsize)
         yield inputs[excerpt], targets[excerpt]
 
 
+def iterate_minibatch_stacks(inputs, targets, batchsize, num_batches,
+                             shuffle=False, random_state=None, indices=None):
+    """
+    Same batches as iterate_minibatches, but num_batches of them at a
+    time, stacked into arrays of shape (<= num_batches, batchsize, ...)
+    """
+    assert inputs.shape[0] == targets.shape[0],\
+           "The number of training points is not the same"
+    if indices is not None:
+        shuffle = False
+    else:
+        indices = np.arange(inputs.shape[0])
+    if shuffle:
+        seed = check_random_state(random_state)
+        seed.shuffle(indices)
+    usable = (inputs.shape[0] // batchsize) * batchsize
+    stride = batchsize * num_batches
+    for start_idx in range(0, usable, stride):
+        excerpt = indices[start_idx:min(start_idx + stride, usable)]
+        yield (inputs[excerpt].reshape((-1, batchsize) + inputs.shape[1:]),
+               targets[excerpt].reshape((-1, batchsize) + targets.shape[1:]))
+
+
+def hash_features(X, num_buckets, seed=0):
+    """
+    Signed hashing trick on the column indices of a CSR matrix. Every
+    column goes to one of num_buckets columns, with a sign taken from
+    another bit of its hash, so that colliding columns cancel out in
+    expectation instead of adding up.
+    """
+    X = X.tocsr()
+    # Murmur3 finalizer of the 32 bit column index, kept in uint64 so the
+    # products wrap around without overflow warnings
+    mask = np.uint64(0xffffffff)
+    h = X.indices.astype(np.uint64) ^ np.uint64((seed * 0x9e3779b9) & 0xffffffff)
+    h ^= h >> np.uint64(16)
+    h = (h * np.uint64(0x85ebca6b)) & mask
+    h ^= h >> np.uint64(13)
+    h = (h * np.uint64(0xc2b2ae35)) & mask
+    h ^= h >> np.uint64(16)
+    buckets = (h % np.uint64(num_buckets)).astype(X.indices.dtype)
+    signs = np.where(h >> np.uint64(31), -1, 1).astype(X.dtype)
+    hashed = sp.csr_matrix((X.data * signs, buckets, X.indptr.copy()),
+                           shape=(X.shape[0], num_buckets))
+    hashed.sum_duplicates()
+    return hashed
+
+
+def _stack_rows(A, B):
+    if sp.issparse(A):
+        return sp.vstack((A, B), format='csr')
+    return np.concatenate((A, B))
+
+
+def _json_params(value):
+    # Constructor arguments as JSON, a random state is not kept
+    if isinstance(value, dict):
+        return dict((k, _json_params(v)) for k, v in value.items())
+    if isinstance(value, (tuple, list)):
+        return [_json_params(v) for v in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, np.random.RandomState):
+        return None
+    return value
+
+
+def _params_from_json(value):
+    if isinstance(value, dict):
+        return dict((str(k), _params_from_json(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_params_from_json(v) for v in value)
+    return value
+
+
+class TemperatureNonlinearity(object):
+    """
+    Output nonlinearity applied to the logits divided by a temperature.
+    The temperature is a shared variable, compiled functions follow it.
+    """
+    def __init__(self, nonlinearity, temperature):
+        self.nonlinearity = nonlinearity
+        self.temperature = temperature
+
+    def __call__(self, x):
+        return self.nonlinearity(x / self.temperature)
+
+
+class LowRankDenseLayer(lasagne.layers.Layer):
+    """
+    Fully connected layer with its weight matrix factorized as W = U.V,
+    U of shape (num_inputs, rank) and V of shape (rank, num_units)
+    """
+    def __init__(self, incoming, num_units, rank,
+                 U=lasagne.init.GlorotUniform(), V=None,
+                 b=lasagne.init.Constant(0.),
+                 nonlinearity=lasagne.nonlinearities.rectify, **kwargs):
+        super(LowRankDenseLayer, self).__init__(incoming, **kwargs)
+        self.nonlinearity = (lasagne.nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+        self.num_units = num_units
+        self.rank = rank
+        num_inputs = int(np.prod(self.input_shape[1:]))
+        # Keeps the variance of x.U through V
+        if V is None:
+            V = lasagne.init.Normal(std=np.sqrt(1.0 / rank))
+        self.U = self.add_param(U, (num_inputs, rank), name='U')
+        self.V = self.add_param(V, (rank, num_units), name='V')
+        self.b = self.add_param(b, (num_units,), name='b', regularizable=False)
+
+    def get_output_shape_for(self, input_shape):
+        return (input_shape[0], self.num_units)
+
+    def get_output_for(self, input, **kwargs):
+        activation = T.dot(T.dot(input, self.U), self.V) + self.b.dimshuffle('x', 0)
+        return self.nonlinearity(activation)
+
+
+class QROrthogonal(lasagne.init.Initializer):
+    """
+    Orthogonal init as lasagne.init.Orthogonal, from the QR decomposition
+    of a gaussian matrix with the signs of R folded into Q, which is
+    uniform over orthogonal matrices like the SVD one but much faster.
+    Bases are cached by shape and seed, so the many configurations that
+    share the random_state and a layer shape decompose it only once. The
+    cache keeps the most recently used bases up to cache_bytes in total,
+    0 turns it off. It is shared by all instances and threads.
+    """
+    cache = OrderedDict()
+    cache_bytes = 32 * 2 ** 20
+    cache_lock = threading.Lock()
+
+    def __init__(self, gain=1.0):
+        if gain == 'relu':
+            gain = np.sqrt(2)
+        self.gain = gain
+
+    def sample(self, shape):
+        if len(shape) < 2:
+            raise RuntimeError("Only shapes of length 2 or more are supported.")
+        flat_shape = (shape[0], int(np.prod(shape[1:])))
+        seed = lasagne.random.get_rng().randint(2147462579)
+        key = (flat_shape, seed)
+        with self.cache_lock:
+            q = self.cache.pop(key, None)
+        if q is None:
+            rng = np.random.RandomState(seed)
+            # Q of a tall matrix has orthonormal columns
+            transpose = flat_shape[0] < flat_shape[1]
+            a = rng.normal(0.0, 1.0, flat_shape[::-1] if transpose else flat_shape)
+            q, r = np.linalg.qr(a)
+            q *= np.sign(np.diag(r))
+            q = lasagne.utils.floatX(q.T if transpose else q)
+        with self.cache_lock:
+            if q.nbytes <= self.cache_bytes:
+                self.cache[key] = q
+                while sum(cached.nbytes for cached in self.cache.values()) > self.cache_bytes:
+                    self.cache.popitem(last=False)
+        return lasagne.utils.floatX(self.gain * q.reshape(shape))
+
+
+class VectorizedSparse(lasagne.init.Initializer):
+    """
+    Sparse init as lasagne.init.Sparse, sparsity * num_inputs gaussian
+    weights at random rows of each column, drawn for all columns at once.
+    The scratch memory is of the size of the nonzero weights, not of the
+    whole matrix.
+    """
+    def __init__(self, sparsity=0.1, std=0.01):
+        self.sparsity = sparsity
+        self.std = std
+
+    def sample(self, shape):
+        if len(shape) != 2:
+            raise RuntimeError("sparse initializer only works with shapes of length 2")
+        num_inputs, num_outputs = shape
+        size = int(self.sparsity * num_inputs)
+        w = np.zeros(shape, dtype=theano.config.floatX)
+        if size > 0:
+            rng = lasagne.random.get_rng()
+            if 8 * size <= num_inputs:
+                rows = self._distinct_rows(rng, num_inputs, size, num_outputs)
+            else:
+                # Few draws would be distinct. The size smallest of uniform
+                # keys are a random subset per column, keyed a block of
+                # columns at a time.
+                rows = np.empty((size, num_outputs), dtype=np.intp)
+                block = max(1, 2 ** 20 // num_inputs)
+                for start in range(0, num_outputs, block):
+                    keys = rng.uniform(size=(num_inputs, min(block, num_outputs - start)))
+                    rows[:, start:start + block] = np.argpartition(keys, size - 1,
+                                                                   axis=0)[:size]
+            w[rows, np.arange(num_outputs)] = rng.normal(0.0, self.std,
+                                                         size=(size, num_outputs))
+        return w
+
+    @staticmethod
+    def _distinct_rows(rng, num_inputs, size, num_outputs):
+        # size distinct rows per column, repeated rows are drawn again
+        # until there are none. A redraw repeats with a probability of at
+        # most size / num_inputs.
+        rows = rng.randint(num_inputs, size=(size, num_outputs))
+        while True:
+            rows.sort(axis=0)
+            repeated = np.zeros(rows.shape, dtype=bool)
+            repeated[1:] = rows[1:] == rows[:-1]
+            num_repeated = np.count_nonzero(repeated)
+            if num_repeated == 0:
+                return rows
+            rows[repeated] = rng.randint(num_inputs, size=num_repeated)
+
+
+class LazySparseDenseLayer(lasagne.layers.DenseLayer):
+    """
+    Dense layer on sparse input whose weight rows may lag behind by a
+    deferred decay: row r stands for W[r] * exp(decay - row_decay[r]).
+    The training output only gathers the rows of the columns present in
+    the minibatch, as active_W, so gradients and updates are of that size.
+    """
+    def __init__(self, incoming, num_units, **kwargs):
+        super(LazySparseDenseLayer, self).__init__(incoming, num_units, **kwargs)
+        num_inputs = int(np.prod(self.input_shape[1:]))
+        self.decay = sharedX(0., name='decay')
+        self.row_decay = sharedX(np.zeros(num_inputs), name='row_decay')
+        self.active_rows = None
+        self.active_W = None
+
+    def get_output_for(self, input, deterministic=False, **kwargs):
+        data, indices, indptr, shape = S.csm_properties(input)
+        if deterministic:
+            # The lag of every row is folded into the input columns
+            scale = T.exp(self.decay - self.row_decay)
+            activation = S.dot(S.CSR(data * scale[indices], indices, indptr, shape), self.W)
+        else:
+            rows, positions = T.extra_ops.Unique(return_inverse=True)(indices)
+            self.active_rows = rows
+            self.active_W = self.W[rows] * \
+                T.exp(self.decay - self.row_decay[rows]).dimshuffle(0, 'x')
+            local_shape = T.stack([shape[0], T.cast(rows.shape[0], 'int32')])
+            activation = S.dot(S.CSR(data, T.cast(positions, 'int32'), indptr, local_shape),
+                               self.active_W)
+        activation = activation + self.b.dimshuffle('x', 0)
+        return self.nonlinearity(activation)
+
+    def flush(self):
+        # Applies the deferred decay to all rows
+        scale = np.exp(self.decay.get_value() - self.row_decay.get_value())
+        W = self.W.get_value()
+        self.W.set_value(W * scale[:, np.newaxis].astype(W.dtype))
+        self.decay.set_value(np.zeros_like(self.decay.get_value()))
+        self.row_decay.set_value(np.zeros_like(self.row_decay.get_value()))
+
+
 class FeedForwardNet(object):
     def __init__(self, input_shape=(100, 28*28), random_state=None,
                  batch_size=100, num_layers=4, num_units_per_layer=(10, 10, 10),
@@ -72,11 +431,30 @@ class FeedForwardNet(object):
                  lambda2=1e-4, momentum=0.9, beta1=0.9, beta2=0.9,
                  rho=0.95, solver='adam', num_epochs=2,
                  lr_policy='fixed', gamma=0.01, power=1.0, epoch_step=1,
-                 activation_per_layer=('relu',)*3, weight_init_per_layer=('henormal',)*3,
+                 activation_per_layer=('relu',)*3, weight_init_per_layer=('he_normal',)*3,
                  leakiness_per_layer=(1./3.,)*3, tanh_alpha_per_layer=(2./3.,)*3,
-                 tanh_beta_per_layer=(1.7159,)*3,
-                 is_sparse=False, is_binary=False, is_regression=False, is_multilabel=False):
+                 tanh_beta_per_layer=(1.7159,)*3, rank_fraction_per_layer=(1.0,)*3,
+                 is_sparse=False, is_binary=False, is_regression=False, is_multilabel=False,
+                 batches_per_call=1, lr_range_test_steps=0, sampler='uniform',
+                 time_budget=None, accumulation_steps=1, replay_size=0,
+                 soft_targets=False, temperature=1.0, sampled_softmax=0,
+                 lbfgs_threshold=0, lbfgs_max_iter=200, batch_policy='fixed',
+                 hash_buckets=0, lazy_updates=False, profile=None,
+                 compile_functions=True):
+
+        # Constructor arguments, stored with the training state so that a
+        # checkpoint can rebuild the network
+        self.init_params = dict((k, v) for k, v in locals().items() if k != 'self')
 
+        # Sparse columns are hashed into hash_buckets inputs, so the first
+        # layer does not grow with the raw number of columns
+        self.hash_buckets = hash_buckets
+        assert hash_buckets == 0 or is_sparse, "Feature hashing needs sparse input"
+        if hash_buckets > 0:
+            input_shape = (input_shape[0], hash_buckets)
+        # (X, cast and hashed X) of the last fit. Iterative fits pass the
+        # same sparse X every epoch and reuse it.
+        self.prepared_X = None
         self.random_state = random_state
         self.batch_size = batch_size
         self.input_shape = input_shape
@@ -84,15 +462,23 @@ class FeedForwardNet(object):
         self.num_units_per_layer = num_units_per_layer
         self.dropout_per_layer = np.asarray(dropout_per_layer, dtype=theano.config.floatX)
         self.num_output_units = num_output_units
-        self.dropout_output = T.cast(dropout_output, dtype=theano.config.floatX)
+        self.dropout_output = np.asarray(dropout_output, dtype=theano.config.floatX)
         self.activation_per_layer = activation_per_layer
         self.weight_init_per_layer = weight_init_per_layer
         self.std_per_layer = np.asarray(std_per_layer, dtype=theano.config.floatX)
         self.leakiness_per_layer = np.asarray(leakiness_per_layer, dtype=theano.config.floatX)
         self.tanh_alpha_per_layer = np.asarray(tanh_alpha_per_layer, dtype=theano.config.floatX)
         self.tanh_beta_per_layer = np.asarray(tanh_beta_per_layer, dtype=theano.config.floatX)
+        self.rank_fraction_per_layer = rank_fraction_per_layer
         self.momentum = T.cast(momentum, dtype=theano.config.floatX)
         self.learning_rate = np.asarray(learning_rate, dtype=theano.config.floatX)
+        self.base_learning_rate = np.asarray(learning_rate, dtype=theano.config.floatX)
+        # With the 'growth' batch policy the decay of the lr policy grows the
+        # batch size instead, the lr the policy is at is kept aside
+        self.batch_policy = batch_policy
+        self.base_batch_size = batch_size
+        self.num_train_points = batch_size
+        self.policy_learning_rate = np.asarray(learning_rate, dtype=theano.config.floatX)
         self.lambda2 = T.cast(lambda2, dtype=theano.config.floatX)
         self.beta1 = T.cast(beta1, dtype=theano.config.floatX)
         self.beta2 = T.cast(beta2, dtype=theano.config.floatX)
@@ -107,13 +493,59 @@ class FeedForwardNet(object):
         self.is_multilabel = is_multilabel
         self.is_sparse = is_sparse
         self.solver = solver
+        self.batches_per_call = batches_per_call
+        self.lr_range_test_steps = lr_range_test_steps
+        self.lr_range = None
+        self.sampler = sampler
+        # Micro-batches that each minibatch is split into, only the
+        # activations of one micro-batch are held in memory at a time
+        self.accumulation_steps = accumulation_steps
+        # Past points that partial_fit trains on along with new data
+        self.replay_size = replay_size
+        self.replay_X = None
+        self.replay_y = None
+        self.replay_keys = None
+        # Class probabilities as targets, e.g. of a teacher network, fit
+        # with the output softened by the temperature
+        self.soft_targets = soft_targets
+        self.temperature = sharedX(temperature, name='temperature')
+        # Other classes drawn per minibatch to train the softmax over them
+        # and the classes of the minibatch only, 0 for the full softmax
+        self.sampled_softmax = sampled_softmax
+        assert sampled_softmax == 0 or not (is_binary or is_multilabel or is_regression or
+                                            soft_targets),\
+            "Sampled softmax needs single label classification targets"
+        assert sampled_softmax == 0 or accumulation_steps == 1,\
+            "Sampled softmax is not supported with gradient accumulation"
+        assert sampled_softmax == 0 or solver != 'adadelta',\
+            "Sampled softmax updates are not implemented for adadelta"
+        # Datasets of up to lbfgs_threshold points are fit in full batch
+        # with L-BFGS instead of the minibatch solver
+        self.lbfgs_threshold = lbfgs_threshold
+        self.lbfgs_max_iter = lbfgs_max_iter
+        self.full_batch_fn = None
+        # Only the rows of the first layer used by a minibatch are updated
+        self.lazy_updates = lazy_updates
+        self.lazy_layer = None
+        assert not lazy_updates or is_sparse, "Lazy updates need sparse input"
+        assert not lazy_updates or accumulation_steps == 1,\
+            "Lazy updates are not supported with gradient accumulation"
+        assert not lazy_updates or solver in ('sgd', 'momentum', 'nesterov'),\
+            "Lazy updates are only implemented for sgd and momentum"
+        # Op level profiles of the compiled functions, by default when
+        # $AUTONET_PROFILE is set. Fits write a summary to profile_fname.
+        self.profile = profiling_enabled(profile)
+        self.profile_fname = None
+        # Seconds for building and training, counted from here
+        self.time_budget = time_budget
+        self.start_time = time.time()
 
         if is_sparse:
             input_var = S.csr_matrix('inputs', dtype=theano.config.floatX)
         else:
             input_var = T.matrix('inputs')
 
-        if self.is_binary or self.is_multilabel or self.is_regression:
+        if self.is_binary or self.is_multilabel or self.is_regression or self.soft_targets:
             target_var = T.matrix('targets')
         else:
             target_var = T.ivector('targets')
@@ -133,21 +565,44 @@ class FeedForwardNet(object):
         # Added for reproducibility
         seed = check_random_state(self.random_state)
         lasagne.random.set_rng(seed)
+        # Kept over epochs, so that each epoch gets a different order
+        self.sampler_rng = check_random_state(self.random_state)
 
+        self.input_var = input_var
         self.network = lasagne.layers.InputLayer(shape=input_shape,
                                                  input_var=input_var)
 
         # Define each layer
+        num_inputs = input_shape[1]
         for i in range(num_layers - 1):
             init_weight = self._choose_weight_init(i)
             activation_function = self._choose_activation(i)
-            self.network = lasagne.layers.DenseLayer(
-                 lasagne.layers.dropout(self.network,
-                                        p=self.dropout_per_layer[i]),
-                 num_units=self.num_units_per_layer[i],
-                 W=init_weight,
-                 b=lasagne.init.Constant(val=0.0),
-                 nonlinearity=activation_function)
+            rank = self._choose_rank(i, num_inputs)
+            if i == 0 and self.lazy_updates:
+                # The rows of a factorized first layer cannot be updated
+                # lazily, its rank_fraction is ignored
+                self.network = self.lazy_layer = LazySparseDenseLayer(
+                     self._dropout(self.network, self.dropout_per_layer[i]),
+                     num_units=self.num_units_per_layer[i],
+                     W=init_weight,
+                     b=lasagne.init.Constant(val=0.0),
+                     nonlinearity=activation_function)
+            elif rank is None:
+                self.network = lasagne.layers.DenseLayer(
+                     self._dropout(self.network, self.dropout_per_layer[i]),
+                     num_units=self.num_units_per_layer[i],
+                     W=init_weight,
+                     b=lasagne.init.Constant(val=0.0),
+                     nonlinearity=activation_function)
+            else:
+                self.network = LowRankDenseLayer(
+                     self._dropout(self.network, self.dropout_per_layer[i]),
+                     num_units=self.num_units_per_layer[i],
+                     rank=rank,
+                     U=init_weight,
+                     b=lasagne.init.Constant(val=0.0),
+                     nonlinearity=activation_function)
+            num_inputs = self.num_units_per_layer[i]
 
         # Define output layer and nonlinearity of last layer
         if self.is_regression:
@@ -156,17 +611,99 @@ class FeedForwardNet(object):
             output_activation = lasagne.nonlinearities.sigmoid
         else:
             output_activation = lasagne.nonlinearities.softmax
+        if self.soft_targets:
+            output_activation = TemperatureNonlinearity(output_activation, self.temperature)
 
         self.network = lasagne.layers.DenseLayer(
-                 lasagne.layers.dropout(self.network,
-                                        p=self.dropout_output),
+                 self._dropout(self.network, self.dropout_output),
                  num_units=self.num_output_units,
                  W=lasagne.init.GlorotNormal(),
                  b=lasagne.init.Constant(),
                  nonlinearity=output_activation)
 
-        prediction = lasagne.layers.get_output(self.network)
+        if self.sampled_softmax > 0:
+            prediction = self._sampled_softmax_output()
+        else:
+            prediction = lasagne.layers.get_output(self.network)
+
+        # Importance weights of the points drawn by the loss aware sampler
+        if self.sampler == 'loss':
+            self.weight_var = T.vector('weights', dtype=theano.config.floatX)
+        else:
+            self.weight_var = None
+        example_loss, data_loss = self._data_loss(prediction, target_var, self.weight_var)
+
+        # Aggregate loss mean function with l2
+        # Regularization on all layers' params
+        l2_penalty = self.lambda2 * lasagne.regularization.regularize_network_params(
+            self.network, lasagne.regularization.l2)
+        if self.lazy_updates or self.sampled_softmax > 0:
+            # The minibatch rows of the first layer and the candidate columns
+            # of the output layer stand in for all of them, the decay of the
+            # others is deferred or skipped
+            regularizable = lasagne.layers.get_all_params(self.network, regularizable=True)
+            partial = [(param, subset) for param, subset, _ in self._partial_params()
+                       if any(param is p for p in regularizable)]
+            other_params = [p for p in regularizable
+                            if not any(p is param for param, _ in partial)]
+            loss = data_loss + self.lambda2 * (
+                lasagne.regularization.apply_penalty(other_params, lasagne.regularization.l2) +
+                sum(lasagne.regularization.l2(subset) for _, subset in partial))
+        else:
+            loss = data_loss + l2_penalty
+        params = lasagne.layers.get_all_params(self.network, trainable=True)
+
+        # Create the symbolic scalar lr for loss & updates function
+        lr_scalar = T.scalar('lr', dtype=theano.config.floatX)
+
+        if self.accumulation_steps > 1:
+            updates = self._accumulation_updates(data_loss, l2_penalty, params, lr_scalar)
+        elif self.lazy_updates or self.sampled_softmax > 0:
+            updates = self._partial_updates(loss, params, lr_scalar)
+        else:
+            updates = self._solver_updates(loss, params, lr_scalar)
+        self.data_loss = data_loss
+        self.l2_penalty = l2_penalty
+        self.target_var = target_var
+        self.lr_scalar = lr_scalar
+        self.train_loss = loss
+        self.example_loss = example_loss
+        self.train_updates = updates
+        self.example_losses = None
 
+        # Validation was removed, as auto-sklearn handles that, if this net
+        # is to be used independently, validation accuracy has to be included
+        if compile_functions:
+            self._compile_train_functions()
+        else:
+            self.train_fn = None
+            self.train_scan_fn = None
+            self.train_example_fn = None
+            self.update_function = None
+        # Prediction function is compiled on first use
+        self.predict_fn = None
+        self.network_predict_fn = None
+        self.exported_layers = None
+        self.loss_history = []
+        # Epochs over all calls to fit
+        self.epochs_trained = 0
+        # Epoch the lr policy is at, runs ahead of epochs_trained when a
+        # time budget compressed the schedule
+        self.schedule_epoch = 0
+        self.budget_schedule = []
+        self.epoch_time = None
+        self.timeouts_avoided = 0
+        # Gets the training state after every epoch, e.g. a Checkpointer
+        self.checkpointer = None
+        # Parameters at the end of each cycle of the cyclic policy
+        self.snapshots = []
+
+    def _data_loss(self, prediction, target_var, weights=None):
+        """
+        Returns the loss of every training point, which drives the loss
+        aware sampler, and their aggregate, weighted per point by weights
+        if given
+        """
         if self.is_regression:
             loss_function = lasagne.objectives.squared_error
         elif self.is_binary or self.is_multilabel:
@@ -175,65 +712,362 @@ class FeedForwardNet(object):
             loss_function = lasagne.objectives.categorical_crossentropy
 
         loss = loss_function(prediction, target_var)
+        example_loss = T.sum(loss, axis=1) if loss.ndim == 2 else loss
+        if weights is not None:
+            loss = loss * (weights.dimshuffle(0, 'x') if loss.ndim == 2 else weights)
 
-        # Aggregate loss mean function with l2
-        # Regularization on all layers' params
         if self.is_binary or self.is_multilabel:
             loss = T.sum(loss, dtype=theano.config.floatX)
         else:
             loss = T.mean(loss, dtype=theano.config.floatX)
-        l2_penalty = self.lambda2 * lasagne.regularization.regularize_network_params(
-            self.network, lasagne.regularization.l2)
-        loss += l2_penalty
-        params = lasagne.layers.get_all_params(self.network, trainable=True)
+        if self.soft_targets:
+            # Keeps the size of the gradients independent of the temperature
+            loss = loss * self.temperature ** 2
+        return example_loss, loss
 
-        # Create the symbolic scalar lr for loss & updates function
-        lr_scalar = T.scalar('lr', dtype=theano.config.floatX)
-
-        if solver == "nesterov":
+    def _solver_updates(self, loss, params, lr_scalar):
+        if self.solver == "nesterov":
             updates = lasagne.updates.nesterov_momentum(loss, params,
                                                         learning_rate=lr_scalar,
                                                         momentum=self.momentum)
-        elif solver == "adam":
+        elif self.solver == "adam":
             updates = lasagne.updates.adam(loss, params,
                                            learning_rate=lr_scalar,
                                            beta1=self.beta1, beta2=self.beta2)
-        elif solver == "adadelta":
+        elif self.solver == "adadelta":
             updates = lasagne.updates.adadelta(loss, params,
                                                learning_rate=lr_scalar,
                                                rho=self.rho)
-        elif solver == "adagrad":
+        elif self.solver == "adagrad":
             updates = lasagne.updates.adagrad(loss, params,
                                               learning_rate=lr_scalar)
-        elif solver == "sgd":
+        elif self.solver == "sgd":
             updates = lasagne.updates.sgd(loss, params,
                                           learning_rate=lr_scalar)
-        elif solver == "momentum":
+        elif self.solver == "momentum":
             updates = lasagne.updates.momentum(loss, params,
                                                learning_rate=lr_scalar,
                                                momentum=self.momentum)
-        elif solver == "smorm3s":
+        elif self.solver == "smorm3s":
             updates = smorm3s(loss, params,
                               learning_rate=lr_scalar)
         else:
             updates = lasagne.updates.sgd(loss, params,
                                           learning_rate=lr_scalar)
+        return OrderedDict(updates)
 
-        # Validation was removed, as auto-sklearn handles that, if this net
-        # is to be used independently, validation accuracy has to be included
+    def _partial_params(self):
+        """
+        Parameters that a minibatch uses only in part, as triples of the
+        parameter, the part in the training graph and the function that
+        takes that part of the parameter or of a state of its shape: the
+        rows of the first layer of the columns present in the minibatch
+        with lazy_updates, the output layer columns and biases of the
+        candidate classes with sampled_softmax.
+        """
+        partial = []
+        if self.lazy_updates:
+            layer = self.lazy_layer
+            rows = layer.active_rows
+            partial.append((layer.W, layer.active_W, lambda x: x[rows]))
+        if self.sampled_softmax > 0:
+            candidates = self.candidates
+            partial.append((self.network.W, self.candidate_W, lambda x: x[:, candidates]))
+            partial.append((self.network.b, self.candidate_b, lambda x: x[candidates]))
+        return partial
+
+    def _partial_updates(self, loss, params, lr_scalar):
+        """
+        Solver updates with the weights and optimizer state of the partial
+        parameters changed only in the part the minibatch uses, so their
+        gradients and updates are of that size. The L2 decay of the other
+        first layer rows is kept as a running log decay and applied when
+        they are next used, the output columns of the classes left out are
+        not decayed. This is exact for sgd. Momentum and the adaptive
+        solvers neither decay nor apply the state of the parts left out,
+        so they only approximate their dense versions. The deferred decay
+        is the one of sgd, so lazy rows are only trained with sgd and
+        momentum, which at least share it.
+        """
+        partial = self._partial_params()
+        updates = self._solver_updates(loss, [p for p in params
+                                              if not any(p is param for param, _, _ in partial)],
+                                       lr_scalar)
+        for param, subset, index in partial:
+            subset_t = self._subset_update(updates, param, subset, index,
+                                           T.grad(loss, subset), lr_scalar)
+            updates[param] = T.set_subtensor(index(param), subset_t)
+
+        if self.lazy_updates:
+            layer = self.lazy_layer
+            # A step of 2 * lambda2 * lr >= 1 zeroes the rows, kept finite
+            tiny = np.asarray(np.finfo(theano.config.floatX).tiny, dtype=theano.config.floatX)
+            decay = layer.decay + T.log(T.maximum(1 - 2 * self.lambda2 * lr_scalar, tiny))
+            updates[layer.row_decay] = T.set_subtensor(layer.row_decay[layer.active_rows], decay)
+            updates[layer.decay] = decay
+        return updates
+
+    def _subset_update(self, updates, param, subset, index, grad, lr_scalar):
+        """
+        Returns the new value of the subset of param, adds the updates of
+        the optimizer state, which is of the shape of param and is read
+        and written through index
+        """
+        shape = param.get_value().shape
+
+        def state(value=0.):
+            full = sharedX(np.full(shape, value))
+            return full, index(full)
+
+        if self.solver in ("momentum", "nesterov"):
+            velocity, velocity_sub = state()
+            velocity_t = self.momentum * velocity_sub - lr_scalar * grad
+            updates[velocity] = T.set_subtensor(velocity_sub, velocity_t)
+            if self.solver == "nesterov":
+                return subset - lr_scalar * grad + self.momentum * velocity_t
+            return subset + velocity_t
+        elif self.solver == "adam":
+            m, m_sub = state()
+            v, v_sub = state()
+            t = sharedX(0.)
+            t_t = t + 1
+            a_t = lr_scalar * T.sqrt(1 - self.beta2 ** t_t) / (1 - self.beta1 ** t_t)
+            m_t = self.beta1 * m_sub + (1 - self.beta1) * grad
+            v_t = self.beta2 * v_sub + (1 - self.beta2) * grad ** 2
+            updates[m] = T.set_subtensor(m_sub, m_t)
+            updates[v] = T.set_subtensor(v_sub, v_t)
+            updates[t] = t_t
+            return subset - a_t * m_t / (T.sqrt(v_t) + 1e-8)
+        elif self.solver == "adagrad":
+            accu, accu_sub = state()
+            accu_t = accu_sub + grad ** 2
+            updates[accu] = T.set_subtensor(accu_sub, accu_t)
+            return subset - lr_scalar * grad / T.sqrt(accu_t + 1e-6)
+        elif self.solver == "smorm3s":
+            eps = 1e-16
+            mem, mem_sub = state(1.)
+            g, g_sub = state()
+            g2, g2_sub = state()
+            r_t = 1. / (mem_sub + 1)
+            g_t = (1 - r_t) * g_sub + r_t * grad
+            g2_t = (1 - r_t) * g2_sub + r_t * grad**2
+            updates[mem] = T.set_subtensor(mem_sub, 1 + mem_sub * (1 - g_t * g_t / (g2_t + eps)))
+            updates[g] = T.set_subtensor(g_sub, g_t)
+            updates[g2] = T.set_subtensor(g2_sub, g2_t)
+            return subset - grad * T.minimum(lr_scalar, g_t * g_t / (g2_t + eps)) / \
+                (T.sqrt(g2_t + eps) + eps)
+        return subset - lr_scalar * grad
+
+    def _accumulation_updates(self, data_loss, l2_penalty, params, lr_scalar):
+        """
+        Returns the solver updates for a gradient accumulated over
+        micro-batches, and sets the updates that accumulate it. Each
+        micro-batch adds its gradient weighted by micro_scale, which
+        makes the sum the gradient of the whole minibatch.
+        """
+        self.micro_scale = T.scalar('micro_scale', dtype=theano.config.floatX)
+        accumulators = [sharedX(p.get_value() * 0.) for p in params]
+        micro_grads = T.grad(data_loss, params)
+        self.accumulate_updates = OrderedDict(
+            (acc, acc + self.micro_scale * grad) for acc, grad in zip(accumulators, micro_grads))
+
+        # Biases are not regularized, their L2 gradient is zero
+        l2_grads = T.grad(l2_penalty, params, disconnected_inputs='ignore')
+        grads = [acc + l2_grad for acc, l2_grad in zip(accumulators, l2_grads)]
+        updates = self._solver_updates(grads, params, lr_scalar)
+        for acc in accumulators:
+            updates[acc] = T.zeros_like(acc)
+        return updates
+
+    def _compile_train_functions(self):
         if DEBUG:
             print("... compiling theano functions")
-        self.train_fn = theano.function([input_var, target_var, lr_scalar],
-                                        loss,
-                                        updates=updates,
+        if self.accumulation_steps > 1:
+            self._compile_accumulation_functions()
+            return
+        self.train_fn = theano.function([self.input_var, self.target_var, self.lr_scalar],
+                                        self.train_loss,
+                                        updates=self.train_updates,
+                                        givens=self._unit_weights(),
                                         allow_input_downcast=True,
-                                        profile=False,
+                                        profile=function_profile(self.profile, 'train_fn'),
                                         on_unused_input='warn',
                                         name='train_fn')
+        if self.sampler == 'loss':
+            if DEBUG:
+                print('... compiling per example loss train function')
+            self.train_example_fn = theano.function([self.input_var, self.target_var,
+                                                     self.weight_var, self.lr_scalar],
+                                                    [self.train_loss, self.example_loss],
+                                                    updates=self.train_updates,
+                                                    allow_input_downcast=True,
+                                                    profile=function_profile(self.profile,
+                                                                             'train_example_fn'),
+                                                    on_unused_input='warn',
+                                                    name='train_example_fn')
+        else:
+            self.train_example_fn = None
+        # Sparse batches cannot be stacked into a 3D tensor, the loss aware
+        # sampler needs the losses after every minibatch and the sampled
+        # softmax new candidates
+        if self.batches_per_call > 1 and not self.is_sparse and self.sampler != 'loss' \
+                and self.sampled_softmax == 0:
+            if DEBUG:
+                print('... compiling scan train function')
+            self.train_scan_fn = self._scan_train_function(self.input_var, self.target_var,
+                                                           self.lr_scalar, self.train_loss,
+                                                           self.train_updates)
+        else:
+            self.train_scan_fn = None
+        if self.sampled_softmax > 0:
+            # The compiled functions take targets as positions among the
+            # candidates, the wrappers take classes
+            self.candidates_train_fn = self.train_fn
+            self.train_fn = self._sampled_train_fn
+            if self.train_example_fn is not None:
+                self.candidates_train_example_fn = self.train_example_fn
+                self.train_example_fn = self._sampled_train_example_fn
+        if DEBUG:
+            print('... compiling update function')
+        self.update_function = self._policy_function()
+
+    def _sampled_softmax_output(self):
+        """
+        Softmax over the columns of the output layer of the candidate
+        classes only. Prediction still goes through the full softmax.
+        """
+        self.candidates = theano.shared(np.zeros(1, dtype=np.int32), name='candidates')
+        self.candidate_W = self.network.W[:, self.candidates]
+        self.candidate_b = self.network.b[self.candidates]
+        hidden = lasagne.layers.get_output(self.network.input_layer)
+        logits = T.dot(hidden, self.candidate_W) + self.candidate_b.dimshuffle('x', 0)
+        return T.nnet.softmax(logits)
+
+    def _sample_candidates(self, targets):
+        """
+        Sets the classes of the minibatch plus sampled_softmax others drawn
+        uniformly as the candidates, returns the targets as their positions
+        """
+        targets = np.asarray(targets, dtype=np.int32)
+        negatives = self.sampler_rng.randint(0, self.num_output_units, self.sampled_softmax)
+        candidates, positions = np.unique(np.concatenate((targets, negatives)),
+                                          return_inverse=True)
+        self.candidates.set_value(candidates.astype(np.int32))
+        return positions[:len(targets)].astype(np.int32)
+
+    def _sampled_train_fn(self, inputs, targets, lr):
+        return self.candidates_train_fn(inputs, self._sample_candidates(targets), lr)
+
+    def _sampled_train_example_fn(self, inputs, targets, weights, lr):
+        return self.candidates_train_example_fn(inputs, self._sample_candidates(targets),
+                                                weights, lr)
+
+    def _unit_weights(self):
+        # Givens of the functions that train on points without weights
+        if self.weight_var is None:
+            return []
+        return [(self.weight_var, T.ones_like(self.example_loss))]
+
+    def _compile_accumulation_functions(self):
+        inputs = [self.input_var, self.target_var, self.micro_scale]
+        if self.weight_var is not None:
+            inputs.append(self.weight_var)
+        self.accumulate_fn = theano.function(inputs,
+                                             [self.data_loss, self.example_loss],
+                                             updates=self.accumulate_updates,
+                                             allow_input_downcast=True,
+                                             profile=function_profile(self.profile, 'accumulate_fn'),
+                                             name='accumulate_fn')
+        self.apply_fn = theano.function([self.lr_scalar],
+                                        self.l2_penalty,
+                                        updates=self.train_updates,
+                                        allow_input_downcast=True,
+                                        profile=function_profile(self.profile, 'apply_fn'),
+                                        name='apply_fn')
+        self.train_fn = self._accumulated_train_fn
+        self.train_example_fn = self._accumulated_train_step if self.sampler == 'loss' else None
+        self.train_scan_fn = None
         if DEBUG:
             print('... compiling update function')
         self.update_function = self._policy_function()
 
+    def _accumulated_train_step(self, inputs, targets, weights, lr):
+        """
+        One solver step on the minibatch, run as accumulation_steps
+        micro-batches. Returns the loss of the minibatch and the loss of
+        every example, like the train functions that take it whole.
+        weights are the importance weights of the loss aware sampler.
+        """
+        num_points = inputs.shape[0]
+        # Batches grown by the batch policy take more micro-batches, not
+        # larger ones
+        micro_size = min(-(-num_points // self.accumulation_steps),
+                         -(-self.base_batch_size // self.accumulation_steps))
+        train_err = 0
+        example_losses = []
+        for start_idx in range(0, num_points, micro_size):
+            excerpt = slice(start_idx, start_idx + micro_size)
+            # Summed losses add up, mean losses are weighted by micro-batch size
+            if self.is_binary or self.is_multilabel:
+                scale = 1.0
+            else:
+                scale = float(min(micro_size, num_points - start_idx)) / num_points
+            micro_inputs = [inputs[excerpt], targets[excerpt], scale]
+            if weights is not None:
+                micro_inputs.append(weights[excerpt])
+            micro_err, micro_example_losses = self.accumulate_fn(*micro_inputs)
+            train_err += scale * micro_err
+            example_losses.append(micro_example_losses)
+        train_err += self.apply_fn(lr)
+        return train_err, np.concatenate(example_losses)
+
+    def _accumulated_train_fn(self, inputs, targets, lr):
+        weights = None
+        if self.weight_var is not None:
+            weights = np.ones(inputs.shape[0], dtype=theano.config.floatX)
+        return self._accumulated_train_step(inputs, targets, weights, lr)[0]
+
+    @staticmethod
+    def _dropout(incoming, p):
+        # Zero probability dropout is a no-op, so the layer is left out of
+        # the graph. Its seed is still drawn to keep the initialization of
+        # the following layers the same.
+        if p == 0.0:
+            lasagne.random.get_rng().randint(1, 2147462579)
+            return incoming
+        return lasagne.layers.dropout(incoming, p=p)
+
+    def _scan_train_function(self, input_var, target_var, lr_scalar, loss, updates):
+        """
+        Compiles a function that runs several consecutive minibatches in one
+        call. The step graph is a clone of the train_fn graph, so both
+        functions share the network and optimizer state.
+        """
+        inputs_stack = T.tensor3('inputs_stack')
+        if target_var.ndim == 2:
+            targets_stack = T.tensor3('targets_stack')
+        else:
+            targets_stack = T.imatrix('targets_stack')
+        shared_vars = list(updates.keys())
+
+        def _step(x_t, y_t, lr_t):
+            outputs = theano.clone([loss] + list(updates.values()),
+                                   replace={input_var: x_t,
+                                            target_var: y_t,
+                                            lr_scalar: lr_t})
+            return outputs[0], OrderedDict(zip(shared_vars, outputs[1:]))
+
+        batch_losses, scan_updates = theano.scan(_step,
+                                                 sequences=[inputs_stack, targets_stack],
+                                                 non_sequences=[lr_scalar],
+                                                 name='train_scan')
+        return theano.function([inputs_stack, targets_stack, lr_scalar],
+                               batch_losses,
+                               updates=scan_updates,
+                               allow_input_downcast=True,
+                               profile=function_profile(self.profile, 'train_scan_fn'),
+                               name='train_scan_fn')
+
     def _policy_function(self):
         epoch, gm, powr, step = T.scalars('epoch', 'gm', 'powr', 'step')
         if self.lr_policy == 'inv':
@@ -244,6 +1078,10 @@ class FeedForwardNet(object):
             decay = T.switch(T.eq(T.mod_check(epoch, step), 0.0),
                              T.power(gm, T.floor_div(epoch, step)),
                              1.0)
+        elif self.lr_policy == 'cyclic':
+            # Cosine annealing restarted every step epochs. Unlike the
+            # others this is the factor on the base and not on the last lr
+            decay = 0.5 * (1.0 + T.cos(np.pi * T.mod_check(epoch, step) / step))
         else:
             decay = T.constant(1.0, name='fixed', dtype=theano.config.floatX)
 
@@ -254,34 +1092,603 @@ class FeedForwardNet(object):
                                name='update_fn')
 
     def fit(self, X, y):
+        X, y = self._prepare_data(X, y)
+        if X.shape[0] <= self.lbfgs_threshold:
+            self._fit_full_batch(X, y)
+        else:
+            # Once per run, a restored state has its lr clipped already
+            if self.lr_range_test_steps > 0 and self.lr_range is None and \
+                    self.epochs_trained == 0:
+                self._clip_learning_rate(X, y)
+            self._fit_epochs(X, y, self.num_epochs)
+        if self.replay_size > 0:
+            self._update_replay_buffer(X, y)
+        if self.profile:
+            self.write_profile()
+        return self
+
+    def partial_fit(self, X, y, num_epochs=1):
+        """
+        Trains num_epochs epochs on a new chunk of data and the replay
+        buffer. The compiled functions, optimizer state and lr schedule
+        carry over from previous fits. The classes are the ones the
+        network was built for.
+        """
+        y = np.asarray(y)
+        if self.is_binary or self.is_multilabel:
+            if y.ndim != 2 or y.shape[1] != self.num_output_units:
+                raise ValueError("Targets do not match the output units")
+        elif not self.is_regression and not self.soft_targets:
+            if np.min(y) < 0 or np.max(y) >= self.num_output_units:
+                raise ValueError("Classes outside of the ones of the network")
+        batch_size = self.batch_size
+        X, y = self._prepare_data(X, y)
+        X_train, y_train = X, y
+        if self.replay_X is not None:
+            X_train = _stack_rows(X, self.replay_X)
+            y_train = np.concatenate((y, self.replay_y))
+            self.batch_size = batch_size
+        if self.batch_size > X_train.shape[0]:
+            self.batch_size = X_train.shape[0]
+        self._fit_epochs(X_train, y_train, num_epochs)
+        # A small chunk does not shrink the batches of later calls
+        self.batch_size = batch_size
+        if self.replay_size > 0:
+            self._update_replay_buffer(X, y)
+        if self.profile:
+            self.write_profile()
+        return self
+
+    def _compile_full_batch_function(self):
+        # Loss without dropout, the line search needs a deterministic one
+        prediction = lasagne.layers.get_output(self.network, deterministic=True)
+        _, data_loss = self._data_loss(prediction, self.target_var)
+        loss = data_loss + self.l2_penalty
+        params = lasagne.layers.get_all_params(self.network, trainable=True)
+        return theano.function([self.input_var, self.target_var],
+                               [loss] + T.grad(loss, params),
+                               allow_input_downcast=True,
+                               profile=function_profile(self.profile, 'full_batch_fn'),
+                               name='full_batch_fn')
+
+    def _fit_full_batch(self, X, y):
+        """
+        Fits the flattened parameters to the whole of X with L-BFGS.
+        On small datasets a few hundred full batch iterations replace
+        many epochs of per minibatch call overhead.
+        """
+        if self.full_batch_fn is None:
+            if DEBUG:
+                print('... compiling full batch loss and gradient function')
+            self.full_batch_fn = self._compile_full_batch_function()
+        params = lasagne.layers.get_all_params(self.network, trainable=True)
+        shapes = [p.get_value().shape for p in params]
+        splits = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+
+        def set_flat_params(flat_params):
+            for p, value, shape in zip(params, np.split(flat_params, splits), shapes):
+                p.set_value(value.reshape(shape).astype(p.dtype))
+
+        def loss_and_grad(flat_params):
+            set_flat_params(flat_params)
+            outputs = self.full_batch_fn(X, y)
+            flat_grad = np.concatenate([np.ravel(g) for g in outputs[1:]])
+            return float(outputs[0]), flat_grad.astype(np.float64)
+
+        start = time.time()
+        x0 = np.concatenate([np.ravel(p.get_value()) for p in params]).astype(np.float64)
+        options = {'maxiter': self.lbfgs_max_iter}
+        budget_evaluations = None
+        if self.time_budget is not None:
+            # Every evaluation is a pass over the same X, the one at x0
+            # times them all and bounds how many fit into the budget
+            loss_and_grad(x0)
+            evaluation_time = time.time() - start
+            time_left = self.time_budget - (time.time() - self.start_time)
+            budget_evaluations = max(1, int(max(0, time_left) // max(evaluation_time, 1e-6)))
+            options['maxfun'] = budget_evaluations
+        result = scipy.optimize.minimize(loss_and_grad, x0, jac=True, method='L-BFGS-B',
+                                         options=options)
+        if budget_evaluations is not None and result.nfev >= budget_evaluations and \
+                result.nit < self.lbfgs_max_iter:
+            self.timeouts_avoided += 1
+            if DEBUG:
+                print("... time budget: L-BFGS stopped after %d evaluations" % result.nfev)
+        set_flat_params(result.x)
+        self.epoch_time = time.time() - start
+        self.loss_history.append(float(result.fun))
+        if DEBUG:
+            print("... L-BFGS: %d iterations, loss %.6f" % (result.nit, result.fun))
+        if self.exported_layers is not None:
+            self.exported_layers = None
+            self.predict_fn = None
+
+    def _update_replay_buffer(self, X, y):
+        # Every point gets a random key and the buffer keeps the ones with
+        # the smallest keys, a uniform sample of all points seen so far
+        keys = self.sampler_rng.uniform(size=X.shape[0])
+        if self.replay_X is not None:
+            X = _stack_rows(self.replay_X, X)
+            y = np.concatenate((self.replay_y, y))
+            keys = np.concatenate((self.replay_keys, keys))
+        keep = np.argsort(keys)[:self.replay_size]
+        self.replay_X = X[keep]
+        self.replay_y = y[keep]
+        self.replay_keys = keys[keep]
+
+    def _fit_epochs(self, X, y, num_epochs):
+        self.num_train_points = X.shape[0]
+        epoch = 0
+        while epoch < num_epochs:
+            epoch_start = time.time()
+            train_err, train_batches = self._train_epoch(X, y)
+            self.epoch_time = time.time() - epoch_start
+            self._finish_epoch(train_err, train_batches)
+            epoch += 1
+            if self.time_budget is not None and epoch < num_epochs:
+                # Projected again after every epoch, as later epochs can be
+                # slower, e.g. with grown batches or a fuller replay buffer
+                num_epochs = epoch + self.budget_epochs(num_epochs - epoch)
+        # An exported network holds copies of the weights before this fit
+        if self.exported_layers is not None:
+            self.exported_layers = None
+            self.predict_fn = None
+
+    def _prepare_data(self, X, y):
         if self.batch_size > X.shape[0]:
             self.batch_size = X.shape[0]
             print('One update per epoch batch size')
 
         if self.is_sparse:
-            X = X.astype(np.float32)
+            if self.prepared_X is not None and self.prepared_X[0] is X:
+                return self.prepared_X[1], y
+            prepared = X.astype(np.float32)
+            if self.hash_buckets > 0:
+                prepared = hash_features(prepared, self.hash_buckets)
+            self.prepared_X = (X, prepared)
+            X = prepared
         else:
             try:
                 X = np.asarray(X, dtype=theano.config.floatX)
                 y = np.asarray(y, dtype=theano.config.floatX)
             except Exception as E:
                 print('Fit casting error: %s' % E)
+        return X, y
 
-        for epoch in range(self.num_epochs):
-            train_err = 0
-            train_batches = 0
-            for inputs, targets in iterate_minibatches(X, y, self.batch_size, shuffle=True,
-                                                       random_state=self.random_state):
+    def _finish_epoch(self, train_err, train_batches):
+        if self.lazy_layer is not None:
+            # Snapshots, checkpoints and exports read the plain weights
+            self.lazy_layer.flush()
+        self.epochs_trained += 1
+        last_schedule_epoch = self.schedule_epoch
+        if self.budget_schedule:
+            self.schedule_epoch, self.policy_learning_rate = self.budget_schedule.pop(0)
+        else:
+            self.schedule_epoch += 1
+            self.policy_learning_rate = self._scheduled_learning_rate(self.schedule_epoch,
+                                                                      self.policy_learning_rate)
+        if self.batch_policy == 'growth':
+            self._grow_batch_size()
+        else:
+            self.learning_rate = self.policy_learning_rate
+        # Lowest lr of the cycle was just used
+        if self.lr_policy == 'cyclic' and \
+                self.schedule_epoch // self.epoch_step > last_schedule_epoch // self.epoch_step:
+            self.snapshots.append(self.get_param_values())
+        self.loss_history.append(train_err / train_batches)
+        print("  training loss:\t\t{:.6f}".format(train_err / train_batches))
+        if self.checkpointer is not None:
+            self.checkpointer.save(self.get_train_state)
+
+    def _grow_batch_size(self):
+        """
+        Grows the batch by the factor the lr policy decayed the lr, up to
+        the size of the training set. For mean losses this keeps the noise
+        of the steps that the decayed lr would give, summed losses also
+        scale their lr with the batch.
+        """
+        growth = self.base_learning_rate / max(self.policy_learning_rate, 1e-12)
+        # The batch stops at the training set, the lr takes the rest of the decay
+        batch_growth = min(growth, max(1., float(self.num_train_points) / self.base_batch_size))
+        self.batch_size = int(round(self.base_batch_size * batch_growth))
+        if self.is_binary or self.is_multilabel:
+            self.learning_rate = np.asarray(self.base_learning_rate / growth,
+                                            dtype=theano.config.floatX)
+        else:
+            self.learning_rate = np.asarray(self.base_learning_rate * batch_growth / growth,
+                                            dtype=theano.config.floatX)
+
+    def _scheduled_learning_rate(self, epoch, learning_rate):
+        # Learning rate after the given epoch of the lr policy
+        decay = self.update_function(self.gamma, epoch, self.power, self.epoch_step)
+        if self.lr_policy == 'cyclic':
+            return self.base_learning_rate * decay
+        return np.asarray(learning_rate * decay, dtype=theano.config.floatX)
+
+    def budget_epochs(self, num_epochs):
+        """
+        Returns how many of the next num_epochs epochs fit into what is
+        left of time_budget, at the duration of the last epoch. When they
+        are fewer, the lr schedule of all num_epochs is compressed into
+        them, so the run still ends at the final lr of its schedule. A
+        schedule compressed before is compressed further.
+        """
+        time_left = self.time_budget - (time.time() - self.start_time)
+        affordable = int(max(0, time_left) // max(self.epoch_time, 1e-6))
+        if affordable >= num_epochs:
+            return num_epochs
+        # A run counts once, however often its schedule is compressed
+        if not self.budget_schedule:
+            self.timeouts_avoided += 1
+        if DEBUG:
+            print("... time budget: %d of %d epochs fit in %.1fs" %
+                  (affordable, num_epochs, time_left))
+        # What is left of a compressed schedule, then the lr policy
+        schedule = list(self.budget_schedule[:num_epochs])
+        if schedule:
+            epoch, learning_rate = schedule[-1]
+        else:
+            epoch, learning_rate = self.schedule_epoch, self.policy_learning_rate
+        while len(schedule) < num_epochs:
+            epoch += 1
+            learning_rate = self._scheduled_learning_rate(epoch, learning_rate)
+            schedule.append((epoch, learning_rate))
+        # Budget epoch i takes over the lr of planned epoch ceil(i * num_epochs / affordable)
+        self.budget_schedule = [schedule[-((-i * num_epochs) // affordable) - 1]
+                                for i in range(1, affordable + 1)]
+        return affordable
+
+    def _lr_range_test(self, X, y, min_lr=1e-6, max_lr=1.0, beta=0.98):
+        """
+        Trains lr_range_test_steps minibatches with an exponentially growing
+        lr and returns the lr with the lowest smoothed loss. Parameters and
+        optimizer state are restored afterwards.
+        """
+        shared_vars = list(self.train_updates.keys())
+        saved_values = [v.get_value() for v in shared_vars]
+
+        # In float64, a floatX min_lr can round below itself
+        learning_rates = np.logspace(np.log10(min_lr), np.log10(max_lr),
+                                     self.lr_range_test_steps)
+        batches = itertools.chain.from_iterable(
+            iterate_minibatches(X, y, self.batch_size, shuffle=True,
+                                random_state=self.random_state)
+            for _ in itertools.count())
+        smoothed_loss = 0.0
+        best_loss = np.inf
+        best_lr = min_lr
+        for step, (lr, (inputs, targets)) in enumerate(zip(learning_rates, batches)):
+            smoothed_loss = beta * smoothed_loss + (1 - beta) * float(self.train_fn(inputs, targets, lr))
+            loss = smoothed_loss / (1 - beta ** (step + 1))
+            if not np.isfinite(loss) or loss > 4 * best_loss:
+                break
+            if loss < best_loss:
+                best_loss = loss
+                best_lr = lr
+
+        for v, value in zip(shared_vars, saved_values):
+            v.set_value(value)
+        return best_lr
+
+    def _clip_learning_rate(self, X, y):
+        # Usable lrs sit about a decade below the one of lowest loss
+        best_lr = self._lr_range_test(X, y)
+        # In floatX, so the clipped lr stays within the range once cast
+        self.lr_range = tuple(float(np.asarray(lr, dtype=theano.config.floatX))
+                              for lr in (best_lr / 1000., best_lr / 10.))
+        clipped_lr = np.clip(self.learning_rate, *self.lr_range)
+        if DEBUG:
+            print("... lr range test: lr %.3E clipped to %.3E" % (self.learning_rate, clipped_lr))
+        self.learning_rate = np.asarray(clipped_lr, dtype=theano.config.floatX)
+        self.base_learning_rate = np.asarray(clipped_lr, dtype=theano.config.floatX)
+        self.policy_learning_rate = np.asarray(clipped_lr, dtype=theano.config.floatX)
+
+    def _epoch_order(self, y):
+        """
+        Order in which the next epoch visits the training points, and the
+        importance weights of the points of the loss aware sampler. Regression
+        targets have no classes, so the stratified sampler shuffles them.
+        """
+        if self.sampler == 'stratified' and not self.is_regression:
+            return stratified_order(y, self.sampler_rng), None
+        elif self.sampler == 'loss':
+            if self.example_losses is None or len(self.example_losses) != y.shape[0]:
+                self.example_losses = np.ones(y.shape[0])
+            return loss_weighted_order(self.example_losses, self.sampler_rng)
+        return self.sampler_rng.permutation(y.shape[0]), None
+
+    def _train_epoch(self, X, y):
+        train_err = 0
+        train_batches = 0
+        order, weights = self._epoch_order(y)
+        # A grown batch is at most the whole training set
+        batch_size = min(self.batch_size, X.shape[0])
+        # An epoch longer than what is left of the time budget stops early
+        deadline = None if self.time_budget is None else self.start_time + self.time_budget
+        if self.train_scan_fn is not None:
+            for inputs, targets in iterate_minibatch_stacks(X, y, batch_size,
+                                                            self.batches_per_call,
+                                                            indices=order):
+                batch_losses = self.train_scan_fn(inputs, targets, self.learning_rate)
+                train_err += np.sum(batch_losses)
+                train_batches += len(batch_losses)
+                if deadline is not None and time.time() > deadline:
+                    break
+        elif self.train_example_fn is not None:
+            for start_idx in range(0, len(order) - batch_size + 1, batch_size):
+                excerpt = order[start_idx:start_idx + batch_size]
+                err, example_losses = self.train_example_fn(
+                    X[excerpt], y[excerpt], weights[start_idx:start_idx + batch_size],
+                    self.learning_rate)
+                self.example_losses[excerpt] = example_losses
+                train_err += err
+                train_batches += 1
+                if deadline is not None and time.time() > deadline:
+                    break
+        else:
+            for inputs, targets in iterate_minibatches(X, y, batch_size, indices=order):
                 train_err += self.train_fn(inputs, targets, self.learning_rate)
                 train_batches += 1
-            decay = self.update_function(self.gamma, epoch+1.0,
-                                         self.power, self.epoch_step)
-            self.learning_rate *= decay
-            print("  training loss:\t\t{:.6f}".format(train_err / train_batches))
+                if deadline is not None and time.time() > deadline:
+                    break
+        return train_err, train_batches
+
+    def set_temperature(self, temperature):
+        # Predictions of a distilled student are made at temperature 1
+        self.temperature.set_value(np.asarray(temperature, dtype=theano.config.floatX))
+
+    def profile_summary(self):
+        config = {'solver': self.solver,
+                  'activations': ','.join(self.activation_per_layer[:self.num_layers - 1]),
+                  'lr_policy': self.lr_policy,
+                  'is_sparse': self.is_sparse}
+        return profile_summary(self, self.network, config)
+
+    def write_profile(self, directory=None):
+        """
+        Writes the profile summary of this net, the same file on every
+        call as the profiles add up over fits
+        """
+        self.profile_fname = write_profile(self.profile_summary(), self.profile_fname,
+                                           directory)
+        return self.profile_fname
+
+    def get_param_values(self):
+        return lasagne.layers.get_all_param_values(self.network)
+
+    def get_train_state(self):
+        """
+        Returns parameters, optimizer state and the position in the lr
+        schedule as a dict of arrays, to be restored by set_train_state
+        """
+        state = dict(('shared_%d' % i, v.get_value())
+                     for i, v in enumerate(self.train_updates.keys()))
+        state['init_params'] = np.asarray(json.dumps(_json_params(self.init_params)))
+        state['learning_rate'] = self.learning_rate
+        state['base_learning_rate'] = self.base_learning_rate
+        state['policy_learning_rate'] = self.policy_learning_rate
+        if self.lr_range is not None:
+            state['lr_range'] = np.asarray(self.lr_range)
+        state['batch_size'] = self.batch_size
+        state['epochs_trained'] = self.epochs_trained
+        state['schedule_epoch'] = self.schedule_epoch
+        state['budget_schedule'] = np.asarray(self.budget_schedule,
+                                              dtype=np.float64).reshape(-1, 2)
+        state['loss_history'] = np.asarray(self.loss_history)
+        for i, values in enumerate(self.snapshots):
+            for j, value in enumerate(values):
+                state['snapshot_%d_%d' % (i, j)] = value
+        if self.example_losses is not None:
+            state['example_losses'] = self.example_losses
+        _, keys, pos, has_gauss, cached_gaussian = self.sampler_rng.get_state()
+        state['sampler_rng_keys'] = keys
+        state['sampler_rng_pos'] = np.asarray([pos, has_gauss])
+        state['sampler_rng_gauss'] = np.asarray(cached_gaussian)
+        return state
+
+    def set_train_state(self, state):
+        shared_vars = list(self.train_updates.keys())
+        assert len(shared_vars) == len([k for k in state if k.startswith('shared_')]),\
+            "Training state of a different network"
+        for i, v in enumerate(shared_vars):
+            v.set_value(np.asarray(state['shared_%d' % i], dtype=v.dtype))
+        self.learning_rate = np.asarray(state['learning_rate'], dtype=theano.config.floatX)
+        self.base_learning_rate = np.asarray(state['base_learning_rate'],
+                                             dtype=theano.config.floatX)
+        self.policy_learning_rate = np.asarray(state['policy_learning_rate'],
+                                               dtype=theano.config.floatX)
+        if 'lr_range' in state:
+            self.lr_range = tuple(float(lr) for lr in state['lr_range'])
+        self.batch_size = int(state['batch_size'])
+        self.epochs_trained = int(state['epochs_trained'])
+        self.schedule_epoch = int(state['schedule_epoch'])
+        self.budget_schedule = [(int(epoch), np.asarray(lr, dtype=theano.config.floatX))
+                                for epoch, lr in state['budget_schedule']]
+        self.loss_history = list(state['loss_history'])
+        snapshots = {}
+        for key in state:
+            if key.startswith('snapshot_'):
+                i, j = key.split('_')[1:]
+                snapshots.setdefault(int(i), {})[int(j)] = state[key]
+        self.snapshots = [[values[j] for j in sorted(values)]
+                          for _, values in sorted(snapshots.items())]
+        if 'example_losses' in state:
+            self.example_losses = np.asarray(state['example_losses'])
+        pos, has_gauss = state['sampler_rng_pos']
+        self.sampler_rng.set_state(('MT19937', state['sampler_rng_keys'], int(pos),
+                                    int(has_gauss), float(state['sampler_rng_gauss'])))
+        self.exported_layers = None
+        self.predict_fn = None
+
+    @classmethod
+    def from_train_state(cls, state, **kwargs):
+        """
+        Builds the network of a state returned by get_train_state and
+        restores it. kwargs override constructor arguments, e.g.
+        compile_functions=False for a network that only predicts.
+        """
+        init_params = _params_from_json(json.loads(str(state['init_params'])))
+        init_params.update(kwargs)
+        net = cls(**init_params)
+        net.set_train_state(state)
+        return net
+
+    def set_param_values(self, values):
+        """
+        Sets the first len(values) parameters of the network, e.g. a warm
+        start for a network that only shares its first layers
+        """
+        params = lasagne.layers.get_all_params(self.network)
+        assert len(values) <= len(params),\
+            "More values than network parameters"
+        for p, v in zip(params, values):
+            p.set_value(np.asarray(v, dtype=p.dtype))
+
+    def _inference_layers(self):
+        """
+        Returns the dense layers of the trained network as a list of
+        (W, b, nonlinearity), with dropout left out and runs of linear
+        layers multiplied into the following layer when that is cheaper.
+        """
+        linear = lasagne.nonlinearities.linear
+        # A factorized layer is a linear layer of rank units followed by V
+        dense_layers = []
+        for layer in lasagne.layers.get_all_layers(self.network):
+            if isinstance(layer, lasagne.layers.DenseLayer):
+                dense_layers.append((layer.W.get_value(), layer.b.get_value(),
+                                     layer.nonlinearity))
+            elif isinstance(layer, LowRankDenseLayer):
+                U = layer.U.get_value()
+                dense_layers.append((U, np.zeros(U.shape[1], dtype=U.dtype), linear))
+                dense_layers.append((layer.V.get_value(), layer.b.get_value(),
+                                     layer.nonlinearity))
+        layers = []
+        W, b = None, None
+        for W_l, b_l, nonlinearity in dense_layers:
+            if W is not None:
+                # x.W.W_l + b.W_l + b_l, fused only if it saves work
+                if W.shape[0] * W_l.shape[1] <= W.size + W_l.size:
+                    b_l = np.dot(b, W_l) + b_l
+                    W_l = np.dot(W, W_l)
+                else:
+                    layers.append((W, b, linear))
+            W, b = W_l, b_l
+            if nonlinearity not in (None, linear):
+                layers.append((W, b, nonlinearity))
+                W, b = None, None
+        if W is not None:
+            layers.append((W, b, linear))
+        return layers
+
+    def export(self):
+        """
+        Freezes the trained weights into a simplified inference graph,
+        used by predict until the net is fitted again
+        """
+        self.exported_layers = self._inference_layers()
+        # Training is over, the training data is not kept with the net
+        self.prepared_X = None
+        if DEBUG:
+            print("... exported %d dense layers out of %d" %
+                  (len(self.exported_layers), self.num_layers))
+        network = self._build_inference_network(self.exported_layers)
+        self.predict_fn = self._compile_predict_function(network[-1])
         return self
 
-    def predict(self, X, is_sparse=False):
-        predictions = self.predict_proba(X, is_sparse)
+    def _build_inference_network(self, layers):
+        # Returns every dense layer of the network, the output one last
+        network = [lasagne.layers.InputLayer(shape=(None, self.input_shape[1]),
+                                             input_var=self.input_var)]
+        for W, b, nonlinearity in layers:
+            network.append(lasagne.layers.DenseLayer(network[-1],
+                                                     num_units=W.shape[1],
+                                                     W=W, b=b,
+                                                     nonlinearity=nonlinearity))
+        return network[1:]
+
+    def prune(self, X, is_sparse=False, tol=1e-6, chunk_size=10000):
+        """
+        Removes the hidden units whose activation over X varies less than
+        tol, e.g. dead relus. Their constant output is folded into the
+        biases of the next layer, so predictions on data like X do not
+        change. Works on the exported network, exporting it if needed.
+        """
+        if self.exported_layers is None:
+            self.export()
+        layers = self.exported_layers
+        if len(layers) < 2:
+            return self
+        network = self._build_inference_network(layers)
+        activations_fn = theano.function([self.input_var],
+                                         lasagne.layers.get_output(network[:-1],
+                                                                   deterministic=True),
+                                         allow_input_downcast=True,
+                                         name='activations_fn')
+
+        # Activation range of each hidden unit in one pass over X
+        min_activations = [np.inf] * (len(layers) - 1)
+        max_activations = [-np.inf] * (len(layers) - 1)
+        for start_idx in range(0, X.shape[0], chunk_size):
+            X_chunk = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            for i, a in enumerate(activations_fn(X_chunk)):
+                if not np.isfinite(a).all():
+                    raise ValueError("Non-finite activations, the network diverged")
+                min_activations[i] = np.minimum(min_activations[i], a.min(axis=0))
+                max_activations[i] = np.maximum(max_activations[i], a.max(axis=0))
+
+        # Counted on the trained network, before export fused its linear
+        # layers and before earlier calls pruned it
+        flops_before = 0
+        for layer in lasagne.layers.get_all_layers(self.network):
+            if isinstance(layer, lasagne.layers.DenseLayer):
+                flops_before += layer.W.get_value(borrow=True).size
+            elif isinstance(layer, LowRankDenseLayer):
+                flops_before += layer.U.get_value(borrow=True).size + \
+                    layer.V.get_value(borrow=True).size
+        pruned_layers = [list(layer) for layer in layers]
+        units_removed = []
+        for i in range(len(layers) - 1):
+            keep = (max_activations[i] - min_activations[i]) > tol
+            if not keep.any():
+                keep[0] = True
+            constant = 0.5 * (max_activations[i] + min_activations[i])
+            W, b, nonlinearity = pruned_layers[i]
+            W_next, b_next, _ = pruned_layers[i + 1]
+            pruned_layers[i][0] = W[:, keep]
+            pruned_layers[i][1] = b[keep]
+            pruned_layers[i + 1][0] = W_next[keep]
+            pruned_layers[i + 1][1] = (b_next + np.dot(constant[~keep],
+                                                       W_next[~keep])).astype(b_next.dtype)
+            units_removed.append(int((~keep).sum()))
+
+        self.exported_layers = [tuple(layer) for layer in pruned_layers]
+        flops_after = sum(W.size for W, _, _ in self.exported_layers)
+        self.pruning_stats = {'units_removed': units_removed,
+                              'flops_before': 2 * flops_before,
+                              'flops_after': 2 * flops_after}
+        if DEBUG:
+            print("... pruned %s units, multiply-adds per row %d -> %d" %
+                  (units_removed, flops_before, flops_after))
+        network = self._build_inference_network(self.exported_layers)
+        self.predict_fn = self._compile_predict_function(network[-1])
+        return self
+
+    def _predict_function(self):
+        if self.predict_fn is not None:
+            return self.predict_fn
+        if self.network_predict_fn is None:
+            self.network_predict_fn = self._compile_predict_function(self.network)
+        return self.network_predict_fn
+
+    def _compile_predict_function(self, network):
+        prediction = lasagne.layers.get_output(network, deterministic=True)
+        return theano.function([self.input_var], prediction,
+                               allow_input_downcast=True,
+                               profile=function_profile(self.profile, 'predict_fn'),
+                               name='predict_fn')
+
+    def predict(self, X, is_sparse=False, chunk_size=None, n_jobs=1):
+        predictions = self.predict_proba(X, is_sparse, chunk_size, n_jobs)
         if self.is_multilabel:
             return np.round(predictions)
         elif self.is_regression:
@@ -289,20 +1696,101 @@ class FeedForwardNet(object):
         else:
             return np.argmax(predictions, axis=1)
 
-    def predict_proba(self, X, is_sparse=False):
+    def predict_proba(self, X, is_sparse=False, chunk_size=None, n_jobs=1):
+        """
+        Feeds X through the network chunk_size rows at a time (all of them
+        by default), writing the results into a single output array. With
+        n_jobs > 1 the chunks are spread over a pool of threads, which run
+        the exported network in numpy.
+        """
+        if chunk_size is None:
+            chunk_size = max(1, -(-X.shape[0] // n_jobs))
+        num_columns = 2 if self.is_binary else self.num_output_units
+        predictions = np.empty((X.shape[0], num_columns), dtype=theano.config.floatX)
+        if n_jobs > 1:
+            self._parallel_predict(X, is_sparse, chunk_size, n_jobs, predictions)
+            return predictions
+        predict_fn = self._predict_function()
+        for start_idx in range(0, X.shape[0], chunk_size):
+            X_chunk = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            self._format_predictions(predict_fn(X_chunk),
+                                     out=predictions[start_idx:start_idx + chunk_size])
+        return predictions
+
+    def _parallel_predict(self, X, is_sparse, chunk_size, n_jobs, predictions):
+        # The VM of a theano function holds the GIL while it runs, so the
+        # workers compute the exported layers with numpy instead, whose
+        # GEMMs and ufuncs release it. The BLAS threads are split among
+        # the workers so that they do not oversubscribe the cores.
+        if self.exported_layers is None:
+            self.exported_layers = self._inference_layers()
+        layers = [(W, b, numpy_nonlinearity(nonlinearity))
+                  for W, b, nonlinearity in self.exported_layers]
+
+        def _predict_chunk(start_idx):
+            activation = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            for W, b, nonlinearity in layers:
+                activation = activation.dot(W)
+                activation += b
+                activation = nonlinearity(activation)
+            self._format_predictions(activation,
+                                     out=predictions[start_idx:start_idx + chunk_size])
+
+        pool = ThreadPool(n_jobs)
+        try:
+            with blas_threads(max(1, multiprocessing.cpu_count() // n_jobs)):
+                pool.map(_predict_chunk, range(0, X.shape[0], chunk_size))
+        finally:
+            pool.close()
+            pool.join()
+
+    def predict_proba_iter(self, X, is_sparse=False, chunk_size=10000):
+        """
+        Yields the predicted probabilities of X, chunk_size rows at a time
+        """
+        predict_fn = self._predict_function()
+        for start_idx in range(0, X.shape[0], chunk_size):
+            X_chunk = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            yield self._format_predictions(predict_fn(X_chunk))
+
+    def predict_proba_snapshots(self, X, is_sparse=False):
+        """
+        Returns one prediction set per snapshot of the cyclic policy
+        """
+        X = self._cast_predict_data(X, is_sparse)
+        if self.network_predict_fn is None:
+            self.network_predict_fn = self._compile_predict_function(self.network)
+        current_values = self.get_param_values()
+        all_predictions = []
+        for values in self.snapshots:
+            self.set_param_values(values)
+            all_predictions.append(self._format_predictions(self.network_predict_fn(X)))
+        self.set_param_values(current_values)
+        return all_predictions
+
+    def _cast_predict_data(self, X, is_sparse=False):
         if is_sparse:
             X = X.astype(np.float32)
-            X = S.as_sparse_or_tensor_variable(X)
+            if self.hash_buckets > 0:
+                X = hash_features(X, self.hash_buckets)
         else:
             try:
                 X = np.asarray(X, dtype=theano.config.floatX)
             except Exception as E:
                 print('Prediction casting error: %s' % E)
+        return X
 
-        predictions = lasagne.layers.get_output(self.network,
-                                                X, deterministic=True).eval()
+    def _format_predictions(self, predictions, out=None):
         if self.is_binary:
-            return np.append(1.0 - predictions, predictions, axis=1)
+            # Two column probabilities without an intermediate copy
+            if out is None:
+                out = np.empty((predictions.shape[0], 2), dtype=predictions.dtype)
+            np.subtract(1.0, predictions[:, 0], out=out[:, 0])
+            out[:, 1] = predictions[:, 0]
+            return out
+        elif out is not None:
+            out[...] = predictions
+            return out
         else:
             return predictions
 
@@ -322,6 +1810,15 @@ class FeedForwardNet(object):
 
         return layer_activation
 
+    def _choose_rank(self, index, num_inputs):
+        # Rank of a factorized layer, None when the full matrix is cheaper
+        num_units = self.num_units_per_layer[index]
+        rank = max(1, int(round(self.rank_fraction_per_layer[index] *
+                                min(num_inputs, num_units))))
+        if rank * (num_inputs + num_units) >= num_inputs * num_units:
+            return None
+        return rank
+
     def _choose_weight_init(self, index=0, output=False):
         wi = getattr(self, 'weight_initializations', None)
         initialization = self.weight_init_per_layer[index]
@@ -357,7 +1854,7 @@ class FeedForwardNet(object):
         'glorot_uniform': lasagne.init.GlorotUniform,
         'he_normal': lasagne.init.HeNormal,
         'he_uniform': lasagne.init.HeUniform,
-        'ortogonal': lasagne.init.Orthogonal,
-        'sparse': lasagne.init.Sparse
+        'ortogonal': QROrthogonal,
+        'sparse': VectorizedSparse
     }
 
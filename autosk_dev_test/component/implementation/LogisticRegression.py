@@ -9,6 +9,8 @@ import theano.tensor as T
 import theano.sparse as S
 import lasagne
 
+from .Profiling import function_profile, profiling_enabled, profile_summary, write_profile
+
 DEBUG = True
 
 
@@ -33,7 +35,7 @@ class LogisticRegression(object):
                  rho=0.95, solver="sgd", num_epochs=10,
                  lr_policy="fixed", gamma=0.01, power=1.0, epoch_step=1,
                  is_sparse=False, is_binary=False, is_regression=False,
-                 is_multilabel=False):
+                 is_multilabel=False, profile=None):
 
         self.batch_size = batch_size
         self.input_shape = input_shape
@@ -59,6 +61,10 @@ class LogisticRegression(object):
         self.is_multilabel = is_multilabel
         self.is_sparse = is_sparse
         self.solver = solver
+        # Op level profiles of the compiled functions, by default when
+        # $AUTONET_PROFILE is set. Fits write a summary to profile_fname.
+        self.profile = profiling_enabled(profile)
+        self.profile_fname = None
 
         if is_sparse:
             input_var = S.csr_matrix('inputs', dtype=theano.config.floatX)
@@ -82,6 +88,7 @@ class LogisticRegression(object):
             print("... with number of epochs")
             print(num_epochs)
 
+        self.input_var = input_var
         self.network = lasagne.layers.InputLayer(shape=input_shape,
                                                  input_var=input_var)
         # Define output layer
@@ -156,9 +163,12 @@ class LogisticRegression(object):
                                         loss,
                                         updates=updates,
                                         allow_input_downcast=True,
-                                        profile=False,
-                                        on_unused_input='warn')
+                                        profile=function_profile(self.profile, 'train_fn'),
+                                        on_unused_input='warn',
+                                        name='train_fn')
         self.update_function = self._policy_function()
+        # Prediction function is compiled on first use
+        self.predict_fn = None
 
     def _policy_function(self):
         epoch, gm, powr, step = T.scalars('epoch', 'gm', 'powr', 'step')
@@ -202,10 +212,20 @@ class LogisticRegression(object):
                                          self.power, self.epoch_step)
             self.learning_rate *= decay
             print("  training loss:\t\t{:.6f}".format(train_err / train_batches))
+        if self.profile:
+            self.write_profile()
         return self
 
-    def predict(self, X, is_sparse=False):
-        predictions = self.predict_proba(X, is_sparse)
+    def write_profile(self, directory=None):
+        # The same file on every call, the profiles add up over fits
+        config = {'solver': self.solver, 'activations': 'logistic',
+                  'lr_policy': self.lr_policy, 'is_sparse': self.is_sparse}
+        self.profile_fname = write_profile(profile_summary(self, self.network, config),
+                                           self.profile_fname, directory)
+        return self.profile_fname
+
+    def predict(self, X, is_sparse=False, chunk_size=None):
+        predictions = self.predict_proba(X, is_sparse, chunk_size)
         if self.is_multilabel:
             return np.round(predictions)
         elif self.is_regression:
@@ -213,20 +233,62 @@ class LogisticRegression(object):
         else:
             return np.argmax(predictions, axis=1)
 
-    def predict_proba(self, X, is_sparse=False):
-        # TODO: Add try-except statements
+    def predict_proba(self, X, is_sparse=False, chunk_size=None):
+        """
+        Feeds X through the network chunk_size rows at a time (all of them
+        by default), writing the results into a single output array
+        """
+        if chunk_size is None:
+            chunk_size = max(1, X.shape[0])
+        predict_fn = self._predict_function()
+        num_columns = 2 if self.is_binary else self.num_output_units
+        predictions = np.empty((X.shape[0], num_columns), dtype=theano.config.floatX)
+        for start_idx in range(0, X.shape[0], chunk_size):
+            X_chunk = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            self._format_predictions(predict_fn(X_chunk),
+                                     out=predictions[start_idx:start_idx + chunk_size])
+        return predictions
+
+    def predict_proba_iter(self, X, is_sparse=False, chunk_size=10000):
+        """
+        Yields the predicted probabilities of X, chunk_size rows at a time
+        """
+        predict_fn = self._predict_function()
+        for start_idx in range(0, X.shape[0], chunk_size):
+            X_chunk = self._cast_predict_data(X[start_idx:start_idx + chunk_size], is_sparse)
+            yield self._format_predictions(predict_fn(X_chunk))
+
+    def _predict_function(self):
+        if self.predict_fn is None:
+            prediction = lasagne.layers.get_output(self.network, deterministic=True)
+            self.predict_fn = theano.function([self.input_var], prediction,
+                                              allow_input_downcast=True,
+                                              profile=function_profile(self.profile,
+                                                                       'predict_fn'),
+                                              name='predict_fn')
+        return self.predict_fn
+
+    @staticmethod
+    def _cast_predict_data(X, is_sparse=False):
         if is_sparse:
             X = X.astype(np.float32)
-            X = S.basic.as_sparse_or_tensor_variable(X)
         else:
             try:
                 X = np.asarray(X, dtype=theano.config.floatX)
             except Exception as E:
                 print('Prediction casting error: %s' % E)
+        return X
 
-        predictions = lasagne.layers.get_output(self.network, X, deterministic=True).eval()
-
+    def _format_predictions(self, predictions, out=None):
         if self.is_binary:
-            return np.append(1.0 - predictions, predictions, axis=1)
+            # Two column probabilities without an intermediate copy
+            if out is None:
+                out = np.empty((predictions.shape[0], 2), dtype=predictions.dtype)
+            np.subtract(1.0, predictions[:, 0], out=out[:, 0])
+            out[:, 1] = predictions[:, 0]
+            return out
+        elif out is not None:
+            out[...] = predictions
+            return out
         else:
             return predictions
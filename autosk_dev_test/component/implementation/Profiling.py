@@ -0,0 +1,197 @@
+"""
+ Op level profiles of the compiled Theano functions of a network, summed
+ per layer and kind of op, and merged over many runs
+"""
+import glob
+import json
+import os
+import tempfile
+import time
+
+import theano
+import lasagne
+
+CATEGORIES = ('dense matmul', 'activation', 'dropout', 'gradient', 'optimizer update',
+              'other')
+
+
+def profiling_enabled(profile=None):
+    # Unless set per model, taken from $AUTONET_PROFILE
+    if profile is None:
+        return os.environ.get('AUTONET_PROFILE', '').lower() in ('1', 'true', 'yes')
+    return bool(profile)
+
+
+def function_profile(enabled, name):
+    # Value for the profile argument of theano.function. Theano would
+    # print every profile at exit, the summaries are written instead.
+    if not enabled:
+        return False
+    return theano.compile.profiling.ProfileStats(atexit_print=False, message=name)
+
+
+def profile_directory(directory=None):
+    if directory is None:
+        directory = os.environ.get('AUTONET_PROFILE_DIR',
+                                   os.path.join(tempfile.gettempdir(),
+                                                'autonet_profiles'))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another run created it meanwhile
+            pass
+    return directory
+
+
+def _op_category(node, forward_nodes, update_nodes, dropout_node):
+    """
+    Dropout is the random ops and the forward ops of dropout layers,
+    matrix products count whether they are forward or backward. Of the
+    other backward ops, the ones that read the optimizer state or the
+    lr are the optimizer update, the rest the gradient.
+    """
+    name = type(node.op).__name__.lower()
+    if 'mrg' in name or 'random' in name:
+        return 'dropout'
+    if 'dot' in name or 'gemm' in name or 'gemv' in name or name.endswith('ger') or \
+            'usmm' in name:
+        return 'dense matmul'
+    if node in update_nodes:
+        return 'optimizer update'
+    if node not in forward_nodes:
+        return 'gradient'
+    if dropout_node:
+        return 'dropout'
+    if 'elemwise' in name or 'softmax' in name:
+        return 'activation'
+    return 'other'
+
+
+def _layer_seeds(network):
+    """
+    Maps the containers of the parameters and dropout streams of each
+    layer to the index of the layer, and returns it with the labels
+    """
+    labels = []
+    seeds = {}
+    for index, layer in enumerate(lasagne.layers.get_all_layers(network)):
+        labels.append(layer.name or '%d_%s' % (index, type(layer).__name__))
+        for param in layer.params:
+            seeds[id(param.container)] = index
+        if isinstance(layer, lasagne.layers.DropoutLayer):
+            for update in layer._srng.state_updates:
+                seeds[id(update[0].container)] = index
+    return seeds, labels
+
+
+def _node_layers(fgraph, nodes, forward_nodes, seeds):
+    """
+    Index of the layer of every node. A node that reads a parameter or
+    dropout stream belongs to its layer. Otherwise forward nodes belong
+    to the last layer among their inputs, e.g. an activation follows its
+    matrix product, and backward nodes to the first layer among the
+    nodes that use their output, the one whose gradient they compute.
+    """
+    layers = {}
+    for node in nodes:
+        for variable in node.inputs:
+            container = getattr(variable, 'container', None)
+            if container is not None and id(container) in seeds:
+                layers[node] = max(layers.get(node, -1), seeds[id(container)])
+    for node in nodes:
+        if node in forward_nodes and node not in layers:
+            inputs = [layers[v.owner] for v in node.inputs if v.owner in layers]
+            if inputs:
+                layers[node] = max(inputs)
+    for node in reversed(nodes):
+        if node not in forward_nodes and node not in layers:
+            clients = [layers[client] for output in node.outputs
+                       for client, _ in fgraph.clients(output)
+                       if not isinstance(client, str) and client in layers]
+            if clients:
+                layers[node] = min(clients)
+    for node in nodes:
+        if node not in layers:
+            # Backward ops that only feed the outputs of the function
+            inputs = [layers[v.owner] for v in node.inputs if v.owner in layers]
+            if inputs:
+                layers[node] = min(inputs)
+    return layers
+
+
+def profile_summary(model, network, config=None):
+    """
+    Sums the op times of the profiled functions held by model per layer
+    and category, keyed as 'layer/category'. Ops that are not linked to a
+    layer of network are keyed by the function name.
+    """
+    seeds, labels = _layer_seeds(network)
+    dropout_layers = set(i for i, layer in enumerate(lasagne.layers.get_all_layers(network))
+                         if isinstance(layer, lasagne.layers.DropoutLayer))
+
+    functions = {}
+    ops = {}
+    for fn in vars(model).values():
+        if not isinstance(fn, theano.compile.function_module.Function) or not fn.profile:
+            continue
+        fn_name = fn.name or 'function'
+        stats = fn.profile
+        functions[fn_name] = {'calls': stats.fct_callcount, 'time': stats.fct_call_time}
+        fgraph = fn.maker.fgraph
+        outputs = fgraph.outputs[:len(fn.maker.outputs)]
+        forward_variables = set(theano.gof.graph.ancestors(outputs))
+        forward_nodes = set(v.owner for v in forward_variables if v.owner is not None)
+        # Inputs that the outputs do not depend on, the lr and the
+        # optimizer state, and the backward ops that read them
+        update_inputs = set(v for v in fgraph.inputs if v not in forward_variables)
+        nodes = fgraph.toposort()
+        update_nodes = set()
+        for node in nodes:
+            if node not in forward_nodes and \
+                    any(v in update_inputs or v.owner in update_nodes for v in node.inputs):
+                update_nodes.add(node)
+        layers = _node_layers(fgraph, nodes, forward_nodes, seeds)
+        for key, op_time in stats.apply_time.items():
+            # Keyed by (fgraph, node) since Theano 0.9
+            node = key[1] if isinstance(key, tuple) else key
+            layer = layers.get(node)
+            category = _op_category(node, forward_nodes, update_nodes, layer in dropout_layers)
+            entry = '%s/%s' % (fn_name if layer is None else labels[layer], category)
+            ops[entry] = ops.get(entry, 0.0) + op_time
+    return {'config': config or {}, 'functions': functions, 'ops': ops}
+
+
+def write_profile(summary, fname=None, directory=None):
+    """
+    Writes summary as JSON to fname, a new file in the profile directory
+    by default, and returns fname
+    """
+    if fname is None:
+        fname = os.path.join(profile_directory(directory),
+                             'profile_%.6f_%d.json' % (time.time(), os.getpid()))
+    # Written aside and renamed, a merge never reads half a file
+    with open(fname + '.tmp', 'w') as fh:
+        json.dump(summary, fh, indent=1, sort_keys=True)
+    os.rename(fname + '.tmp', fname)
+    return fname
+
+
+def merge_profiles(directory=None, by='solver'):
+    """
+    Sums the op times of all summaries in directory per category and
+    value of their config entry by, e.g. per solver or per activations
+    """
+    totals = {}
+    for fname in glob.glob(os.path.join(profile_directory(directory), 'profile_*.json')):
+        try:
+            with open(fname) as fh:
+                summary = json.load(fh)
+        except (IOError, ValueError):
+            continue
+        group = totals.setdefault(str(summary['config'].get(by)),
+                                  dict((c, 0.0) for c in CATEGORIES))
+        for entry, op_time in summary['ops'].items():
+            category = entry.rsplit('/', 1)[1]
+            group[category] = group.get(category, 0.0) + op_time
+    return totals
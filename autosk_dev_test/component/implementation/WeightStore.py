@@ -0,0 +1,85 @@
+"""
+ Weight store to warm start FeedForwardNet fits
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+
+class WeightStore(object):
+    """
+    Keeps the final weights of the most recent fits on disk, so they
+    survive between the evaluations of a SMAC run. Entries are keyed by
+    dataset and matched against new networks by their parameter shapes.
+    """
+    def __init__(self, directory=None, max_entries=20):
+        if directory is None:
+            directory = os.environ.get('AUTONET_WEIGHT_STORE',
+                                       os.path.join(tempfile.gettempdir(),
+                                                    'autonet_weight_store'))
+        self.directory = directory
+        self.max_entries = max_entries
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another run created it meanwhile
+                pass
+
+    @staticmethod
+    def dataset_key(X, num_rows=100):
+        fingerprint = hashlib.md5(str(X.shape).encode())
+        if sp.issparse(X):
+            head = X[:num_rows].tocsr()
+            fingerprint.update(np.ascontiguousarray(head.data).tobytes())
+            fingerprint.update(np.ascontiguousarray(head.indices).tobytes())
+        else:
+            fingerprint.update(np.ascontiguousarray(X[:num_rows]).tobytes())
+        return fingerprint.hexdigest()
+
+    def _entries(self, dataset_key):
+        # Newest first
+        fname = os.path.join(self.directory, dataset_key + '_*.npz')
+        return sorted(glob.glob(fname), reverse=True)
+
+    def save(self, dataset_key, values):
+        fname = os.path.join(self.directory, '%s_%.6f_%d.npz' %
+                             (dataset_key, time.time(), os.getpid()))
+        # Written aside and renamed, parallel runs never see half a file
+        with open(fname + '.tmp', 'wb') as fh:
+            np.savez(fh, *values)
+        os.rename(fname + '.tmp', fname)
+
+        for old_entry in self._entries(dataset_key)[self.max_entries:]:
+            try:
+                os.remove(old_entry)
+            except OSError:
+                pass
+
+    def load(self, dataset_key, shapes):
+        """
+        Returns the parameter values of the stored entry that shares the
+        longest prefix of shapes, or an empty list when none matches
+        """
+        best_values = []
+        for entry in self._entries(dataset_key):
+            try:
+                with np.load(entry) as stored:
+                    values = [stored['arr_%d' % i] for i in range(len(stored.files))]
+            except (IOError, ValueError, KeyError):
+                continue
+            prefix = 0
+            for value, shape in zip(values, shapes):
+                if value.shape != tuple(shape):
+                    break
+                prefix += 1
+            if prefix > len(best_values):
+                best_values = values[:prefix]
+            if prefix == len(shapes):
+                break
+        return best_values
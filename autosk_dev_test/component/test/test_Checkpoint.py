@@ -0,0 +1,41 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from component.implementation.Checkpoint import Checkpointer
+
+
+class CheckpointerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fname = os.path.join(self.directory, 'checkpoint.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_last_state_written(self):
+        checkpointer = Checkpointer(self.fname)
+        self.assertIsNone(Checkpointer.load(self.fname))
+        for epoch in range(5):
+            checkpointer.save(lambda: {'W': np.ones((100, 100)) * epoch,
+                                       'epochs_trained': epoch + 1})
+        checkpointer.flush()
+        state = Checkpointer.load(self.fname)
+        self.assertEqual(int(state['epochs_trained']), 5)
+        self.assertTrue((state['W'] == 4).all())
+        self.assertEqual(len(checkpointer.save_times), 5)
+        self.assertFalse(os.path.exists(self.fname + '.tmp'))
+
+        checkpointer.remove()
+        self.assertFalse(os.path.exists(self.fname))
+
+    def test_partial_write_ignored(self):
+        checkpointer = Checkpointer(self.fname)
+        checkpointer.save(lambda: {'W': np.zeros(3)})
+        checkpointer.close()
+        # A run killed while writing leaves only the temporary file behind
+        with open(self.fname + '.tmp', 'wb') as fh:
+            fh.write(b'PK\x03\x04')
+        self.assertTrue((Checkpointer.load(self.fname)['W'] == 0).all())
@@ -1,4 +1,6 @@
 import unittest
+import numpy as np
+import scipy.sparse as sp
 from component.DeepFeedNet import DeepFeedNet
 from autosklearn.pipeline.util import _test_classifier
 import sklearn.metrics
@@ -37,6 +39,42 @@ class NetComponentTest(unittest.TestCase):
             print(ave_precision_score)
             self.assertAlmostEqual(0.767777777778, ave_precision_score)
 
+    def test_sampled_softmax_fallback(self):
+        # Adadelta and accumulation train many classes with the full softmax
+        rng = np.random.RandomState(1)
+        X = rng.randn(200, 7).astype(np.float32)
+        y = rng.randint(0, 20, 200)
+        for solver, max_micro_batch_size in [('adadelta', None), ('adam', None), ('sgd', 10)]:
+            model = DeepFeedNet(number_updates=20, batch_size=50, num_layers='c',
+                                num_units_layer_1=16, dropout_layer_1=0.0,
+                                dropout_output=0.0, std_layer_1=0.005,
+                                learning_rate=0.01, solver=solver, lambda2=1e-4,
+                                num_units_layer_2=16, dropout_layer_2=0.0,
+                                max_micro_batch_size=max_micro_batch_size,
+                                sampled_softmax_threshold=5, random_state=1)
+            model.fit(X, y)
+            self.assertEqual(model.sampled_softmax, 0)
+            self.assertEqual(model.predict_proba(X).shape, (200, 20))
+
+    def test_lazy_updates_fallback(self):
+        # Adaptive solvers and accumulation train sparse input with dense
+        # updates
+        rng = np.random.RandomState(1)
+        X = sp.random(200, 100, density=0.05, format='csr', random_state=rng,
+                      dtype=np.float32)
+        y = rng.randint(0, 3, 200)
+        for solver, max_micro_batch_size in [('adadelta', None), ('adam', None), ('sgd', 10)]:
+            model = DeepFeedNet(number_updates=20, batch_size=50, num_layers='c',
+                                num_units_layer_1=16, dropout_layer_1=0.0,
+                                dropout_output=0.0, std_layer_1=0.005,
+                                learning_rate=0.01, solver=solver, lambda2=1e-4,
+                                num_units_layer_2=16, dropout_layer_2=0.0,
+                                max_micro_batch_size=max_micro_batch_size,
+                                lazy_updates=True, random_state=1)
+            model.fit(X, y)
+            self.assertFalse(model.use_lazy_updates)
+            self.assertEqual(model.predict_proba(X).shape, (200, 3))
+
     def test_constrained_individual_configspace(self):
         # TODO: Test for fixed cs
         pass
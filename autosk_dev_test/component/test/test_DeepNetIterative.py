@@ -1,5 +1,7 @@
 import unittest
 import os
+import subprocess
+import sys
 from component.DeepNetIterative import DeepNetIterative
 from autosklearn.pipeline.util import _test_classifier_iterative_fit
 import sklearn.metrics
@@ -20,3 +22,37 @@ class IterativeNetComponentTest(unittest.TestCase):
             acc_score = sklearn.metrics.accuracy_score(y_pred=predictions, y_true=targets)
             print(acc_score)
             self.assertAlmostEqual(0.54, acc_score)
+
+    def test_configuration_key(self):
+        # Restarted evaluations run in new processes and must find the
+        # checkpoint of the same configuration
+        code = ("import numpy as np\n"
+                "from component.DeepNetIterative import DeepNetIterative\n"
+                "net = DeepNetIterative(number_epochs=10, batch_size=50, num_layers='d',\n"
+                "                       dropout_output=0.5, learning_rate=0.01, solver='adam',\n"
+                "                       lambda2=1e-4, random_state=np.random.RandomState(1))\n"
+                "print(net.configuration_key)")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        keys = [subprocess.check_output([sys.executable, '-c', code], cwd=root).strip()
+                for _ in range(2)]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_compacted_data_is_reused(self):
+        # The compactor is fit and applied once, not in every iteration
+        import numpy as np
+        rng = np.random.RandomState(1)
+        X = np.hstack((rng.randn(100, 5), np.ones((100, 2))))
+        y = (X[:, 0] > 0).astype(int)
+        net = DeepNetIterative(number_epochs=3, batch_size=20, num_layers='c',
+                               dropout_output=0.0, learning_rate=0.01, solver='sgd',
+                               lambda2=1e-4, random_state=1, compact_features=True,
+                               dropout_layer_1=0.0)
+        net.iterative_fit(X, y, n_iter=1)
+        transform = net.compactor.transform
+        calls = []
+        net.compactor.transform = lambda X: calls.append(X) or transform(X)
+        while not net.configuration_fully_fitted():
+            net.iterative_fit(X, y, n_iter=1)
+        self.assertEqual(calls, [])
+        self.assertIsNone(net._fit_data)
+        self.assertEqual(net.n_features, 5)
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+
+from component.implementation.FeedForwardNet import FeedForwardNet
+from component.implementation.Distillation import DistillationTrainer
+
+
+class TestDistillation(unittest.TestCase):
+    dataset_dir = '/home/mendozah/workspace/datasets'
+
+    X_train = np.load(dataset_dir + 'train.npy')
+    y_train = np.load(dataset_dir + 'train_labels.npy')
+    X_test = np.load(dataset_dir + 'test.npy')
+
+    def test_student_of_ensemble(self):
+        teachers = []
+        for seed in range(2):
+            teacher = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                                     learning_rate=0.1, num_layers=3,
+                                     num_units_per_layer=(200, 200),
+                                     weight_init_per_layer=('he_normal',)*2,
+                                     solver='sgd', num_epochs=5, random_state=seed)
+            teachers.append(teacher.fit(self.X_train, self.y_train))
+
+        trainer = DistillationTrainer(teachers, temperature=3.0, num_units_per_layer=(10,),
+                                      batch_size=50, num_epochs=5, random_state=1)
+        soft_targets = trainer.soft_targets(self.X_train)
+        # Two classes, the student gets a single sigmoid output
+        self.assertEqual(soft_targets.shape, (self.X_train.shape[0], 1))
+        # Softer than the averaged teachers
+        teacher_probabilities = np.mean([t.predict_proba(self.X_train) for t in teachers],
+                                        axis=0)
+        self.assertLess(soft_targets.max(), teacher_probabilities[:, 1].max())
+        self.assertGreater(soft_targets.min(), teacher_probabilities[:, 1].min())
+
+        trainer.fit(self.X_train, soft_targets)
+        self.assertEqual(trainer.student.temperature.get_value(), 1.0)
+        predictions = trainer.predict_proba(self.X_test)
+        self.assertEqual(predictions.shape, teachers[0].predict_proba(self.X_test).shape)
+        self.assertTrue((1 - predictions.sum(axis=1) < 1e-3).all())
@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+
+from component.implementation.FeedForwardNet import FeedForwardNet
+from component.implementation.EnsembleInference import EnsemblePredictor
+
+
+class TestEnsemblePredictor(unittest.TestCase):
+    dataset_dir = '/home/mendozah/workspace/datasets'
+
+    X_train = np.load(dataset_dir + 'train.npy')
+    y_train = np.load(dataset_dir + 'train_labels.npy')
+    X_test = np.load(dataset_dir + 'test.npy')
+
+    def _fitted_net(self, num_units, activation, random_state):
+        net = FeedForwardNet(input_shape=(50, 7), batch_size=50, learning_rate=0.01,
+                             num_layers=3, num_units_per_layer=(num_units, num_units),
+                             activation_per_layer=(activation,)*2,
+                             weight_init_per_layer=('he_normal',)*2,
+                             num_epochs=2, random_state=random_state)
+        net.fit(self.X_train, self.y_train)
+        net.export()
+        return net
+
+    def test_weighted_average(self):
+        members = [self._fitted_net(20, 'relu', 1), self._fitted_net(20, 'relu', 2),
+                   self._fitted_net(30, 'relu', 3), self._fitted_net(20, 'tahn', 4)]
+        weights = [0.4, 0.2, 0.3, 0.1]
+        ensemble = EnsemblePredictor(members, weights)
+        # The two relu nets of 20 units share a forward pass
+        self.assertEqual(len(ensemble.groups), 3)
+
+        expected = sum(w * m.predict_proba(self.X_test) for w, m in zip(weights, members))
+        predictions = ensemble.predict_proba(self.X_test)
+        np.testing.assert_allclose(predictions, expected, rtol=1e-4, atol=1e-6)
+        np.testing.assert_array_equal(ensemble.predict(self.X_test),
+                                      np.argmax(expected, axis=1))
+
+    def test_regression(self):
+        members = [FeedForwardNet(input_shape=(50, 7), batch_size=50, learning_rate=0.01,
+                                  num_layers=3, num_units_per_layer=(20, 20),
+                                  weight_init_per_layer=('he_normal',)*2,
+                                  num_output_units=1, is_regression=True,
+                                  num_epochs=2, random_state=random_state)
+                   for random_state in (1, 2)]
+        y = self.X_train[:, :1].astype(np.float32)
+        for member in members:
+            member.fit(self.X_train, y)
+        ensemble = EnsemblePredictor(members, [0.7, 0.3])
+
+        expected = 0.7 * members[0].predict(self.X_test) + 0.3 * members[1].predict(self.X_test)
+        np.testing.assert_allclose(ensemble.predict(self.X_test), expected,
+                                   rtol=1e-4, atol=1e-6)
+
+    def test_regdeepnet_members(self):
+        from component.RegDeepNet import RegDeepNet
+        members = [RegDeepNet(number_epochs=2, batch_size=50, num_layers='d',
+                              dropout_output=0., learning_rate=0.01, solver='adam',
+                              lambda2=1e-4, dropout_layer_1=0., dropout_layer_2=0.,
+                              random_state=random_state)
+                   for random_state in (1, 2)]
+        # Different target scales, the members normalize them differently
+        for member, offset in zip(members, (10., -5.)):
+            member.fit(self.X_train, 3. * self.X_train[:, 0] + offset)
+        ensemble = EnsemblePredictor(members, [0.6, 0.4])
+        self.assertEqual(len(ensemble.groups), 1)
+
+        expected = 0.6 * members[0].predict(self.X_test) + 0.4 * members[1].predict(self.X_test)
+        np.testing.assert_allclose(ensemble.predict(self.X_test), expected,
+                                   rtol=1e-4, atol=1e-4)
+
+    def test_temperature_key(self):
+        from component.implementation.EnsembleInference import _nonlinearity_key
+        from component.implementation.FeedForwardNet import TemperatureNonlinearity, sharedX
+        import lasagne
+        softmax = lasagne.nonlinearities.softmax
+        key = _nonlinearity_key(TemperatureNonlinearity(softmax, sharedX(2.)))
+        self.assertEqual(key, _nonlinearity_key(TemperatureNonlinearity(softmax, sharedX(2.))))
+        self.assertNotEqual(key, _nonlinearity_key(TemperatureNonlinearity(softmax, sharedX(1.))))
+
+
+if __name__ == '__main__':
+    unittest.main()
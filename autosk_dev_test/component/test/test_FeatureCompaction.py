@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+import scipy.sparse as sp
+
+from component.implementation.FeatureCompaction import FeatureCompactor
+
+
+class FeatureCompactorTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        informative = rng.randn(50, 4)
+        # Columns 1 and 5 are constant, 3 and 6 repeat 0 and 2
+        self.X = np.column_stack([informative[:, 0], np.ones(50), informative[:, 1],
+                                  informative[:, 0], informative[:, 2], np.zeros(50),
+                                  informative[:, 1], informative[:, 3]])
+
+    def test_dense(self):
+        compactor = FeatureCompactor().fit(self.X)
+        np.testing.assert_array_equal(compactor.kept_columns, [0, 2, 4, 7])
+        Xc = compactor.transform(self.X)
+        self.assertEqual(Xc.shape, (50, 4))
+        np.testing.assert_array_equal(Xc, self.X[:, [0, 2, 4, 7]])
+        # Constant at fit, the same columns are dropped from new data
+        X_new = self.X + 1.
+        np.testing.assert_array_equal(compactor.transform(X_new), X_new[:, [0, 2, 4, 7]])
+
+    def test_sparse(self):
+        X = self.X.copy()
+        X[X < 0] = 0
+        X[:, 1] = 0
+        Xs = sp.csr_matrix(X)
+        compactor = FeatureCompactor().fit(Xs)
+        np.testing.assert_array_equal(compactor.kept_columns, [0, 2, 4, 7])
+        Xc = compactor.transform(Xs)
+        self.assertTrue(sp.isspmatrix_csr(Xc))
+        self.assertEqual(Xc.shape, (50, 4))
+        self.assertLess(Xc.indices.max(), 4)
+        np.testing.assert_array_equal(Xc.toarray(), X[:, [0, 2, 4, 7]])
+
+    def test_all_constant(self):
+        compactor = FeatureCompactor().fit(np.ones((10, 3)))
+        self.assertEqual(compactor.transform(np.ones((10, 3))).shape, (10, 1))
+
+    def test_shape_mismatch(self):
+        compactor = FeatureCompactor().fit(self.X)
+        self.assertRaises(AssertionError, compactor.transform, self.X[:, :4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
 import unittest
+import json
+import os
+import shutil
+import tempfile
 import numpy as np
+import scipy.sparse as sp
+import lasagne
 
-from component.implementation.FeedForwardNet import FeedForwardNet
+from component.implementation.FeedForwardNet import FeedForwardNet, hash_features, \
+    QROrthogonal, VectorizedSparse, numpy_nonlinearity
+from component.implementation.Profiling import CATEGORIES, merge_profiles
 
 
 class TestFeedForwardNet(unittest.TestCase):
@@ -94,3 +102,635 @@ class TestFeedForwardNet(unittest.TestCase):
         for i in range(10):
             self.test_policy_solver_comparison()
         print("==Done==")
+
+    def test_scan_training(self):
+        # Without dropout both paths have to follow the same trajectory
+        kwargs = dict(input_shape=(50, 7), batch_size=50, learning_rate=0.1,
+                      num_layers=3, num_units_per_layer=(20, 20),
+                      dropout_per_layer=(0.0, 0.0), dropout_output=0.0,
+                      weight_init_per_layer=('he_normal',)*3,
+                      solver='sgd', num_epochs=5, random_state=1)
+        model_loop = FeedForwardNet(**kwargs)
+        model_loop.fit(self.X_train, self.y_train)
+        model_scan = FeedForwardNet(batches_per_call=4, **kwargs)
+        model_scan.fit(self.X_train, self.y_train)
+
+        self.assertIsNotNone(model_scan.train_scan_fn)
+        np.testing.assert_allclose(model_loop.predict_proba(self.X_test),
+                                   model_scan.predict_proba(self.X_test),
+                                   rtol=1e-4)
+
+    def test_export_simplified_network(self):
+        # Zero dropout is not built and the linear hidden layers get fused
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1, num_layers=4,
+                               num_units_per_layer=(20, 20, 20),
+                               dropout_per_layer=(0.0, 0.0, 0.0),
+                               dropout_output=0.0,
+                               activation_per_layer=('linear', 'linear', 'relu'),
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', num_epochs=5, random_state=1)
+        model.fit(self.X_train, self.y_train)
+        self.assertFalse(any(isinstance(l, lasagne.layers.DropoutLayer)
+                             for l in lasagne.layers.get_all_layers(model.network)))
+
+        predicted_full = model.predict_proba(self.X_test)
+        model.export()
+        self.assertEqual(len(model.exported_layers), 2)
+        np.testing.assert_allclose(predicted_full, model.predict_proba(self.X_test),
+                                   rtol=1e-4, atol=1e-6)
+
+        # The FLOPs before pruning are those of the trained layers, not of
+        # the fused ones
+        model.prune(self.X_train, tol=-1)
+        output_units = model.exported_layers[-1][0].shape[1]
+        self.assertEqual(model.pruning_stats['flops_before'],
+                         2 * (7 * 20 + 20 * 20 + 20 * 20 + 20 * output_units))
+        self.assertEqual(model.pruning_stats['flops_after'],
+                         2 * (7 * 20 + 20 * output_units))
+
+    def test_cyclic_policy_snapshots(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='momentum',
+                               lr_policy='cyclic',
+                               epoch_step=4,
+                               num_epochs=12)
+        model.fit(self.X_train, self.y_train)
+
+        # Back at the base lr after each restart
+        self.assertAlmostEqual(model.learning_rate, 0.1, places=6)
+        all_predictions = model.predict_proba_snapshots(self.X_test)
+        self.assertEqual(len(all_predictions), 3)
+        for predicted_probability_matrix in all_predictions:
+            self.assertTrue((1 - predicted_probability_matrix.sum(axis=1) < 1e-3).all())
+        # Last snapshot are the current weights
+        np.testing.assert_allclose(all_predictions[-1], model.predict_proba(self.X_test),
+                                   rtol=1e-5)
+
+    def test_lr_range_test(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=1.0,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd',
+                               lr_range_test_steps=200,
+                               num_epochs=2)
+        X, y = model._prepare_data(self.X_train, self.y_train)
+        initial_values = model.get_param_values()
+        best_lr = model._lr_range_test(X, y)
+        self.assertTrue(1e-6 <= best_lr <= 1.0)
+        for initial, current in zip(initial_values, model.get_param_values()):
+            np.testing.assert_array_equal(initial, current)
+
+        model.fit(self.X_train, self.y_train)
+        self.assertIsNotNone(model.lr_range)
+        self.assertTrue(model.base_learning_rate <= model.lr_range[1])
+
+    def test_prune_dead_units(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1, num_layers=3,
+                               num_units_per_layer=(50, 50),
+                               weight_init_per_layer=('he_normal',)*2,
+                               solver='sgd', num_epochs=5, random_state=1)
+        model.fit(self.X_train, self.y_train)
+        model.export()
+        # Kill some units of the first layer
+        W, b, nonlinearity = model.exported_layers[0]
+        b[:10] = -1e3
+        model.exported_layers[0] = (W, b, nonlinearity)
+        network = model._build_inference_network(model.exported_layers)
+        model.predict_fn = model._compile_predict_function(network[-1])
+        predictions = model.predict_proba(self.X_train)
+
+        model.prune(self.X_train)
+        self.assertTrue(model.pruning_stats['units_removed'][0] >= 10)
+        self.assertTrue(model.pruning_stats['flops_after'] < model.pruning_stats['flops_before'])
+        np.testing.assert_allclose(predictions, model.predict_proba(self.X_train),
+                                   rtol=1e-5, atol=1e-6)
+
+        # A diverged network has no units to tell apart
+        W, b, nonlinearity = model.exported_layers[0]
+        model.exported_layers[0] = (W, np.full_like(b, np.nan), nonlinearity)
+        self.assertRaises(ValueError, model.prune, self.X_train)
+
+    def test_low_rank_layers(self):
+        from component.implementation.FeedForwardNet import LowRankDenseLayer
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1, num_layers=3,
+                               num_units_per_layer=(100, 100),
+                               weight_init_per_layer=('he_normal',)*2,
+                               rank_fraction_per_layer=(0.25, 0.25),
+                               solver='sgd', num_epochs=5, random_state=1)
+        low_rank_layers = [l for l in lasagne.layers.get_all_layers(model.network)
+                           if isinstance(l, LowRankDenseLayer)]
+        self.assertEqual([l.rank for l in low_rank_layers], [2, 25])
+
+        model.fit(self.X_train, self.y_train)
+        predictions = model.predict_proba(self.X_test)
+        self.assertTrue((1 - predictions.sum(axis=1) < 1e-3).all())
+        model.export()
+        np.testing.assert_allclose(predictions, model.predict_proba(self.X_test),
+                                   rtol=1e-4, atol=1e-6)
+        # Both factors of each layer are counted
+        model.prune(self.X_train, tol=-1)
+        output_units = model.exported_layers[-1][0].shape[1]
+        flops = 2 * (7 * 2 + 2 * 100 + 100 * 25 + 25 * 100 + 100 * output_units)
+        self.assertEqual(model.pruning_stats['flops_before'], flops)
+        self.assertEqual(model.pruning_stats['flops_after'], flops)
+
+    def test_chunked_prediction(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', num_epochs=2)
+        model.fit(self.X_train, self.y_train)
+
+        predicted_probability_matrix = model.predict_proba(self.X_test)
+        np.testing.assert_allclose(predicted_probability_matrix,
+                                   model.predict_proba(self.X_test, chunk_size=33),
+                                   rtol=1e-6)
+        np.testing.assert_allclose(predicted_probability_matrix,
+                                   np.vstack(model.predict_proba_iter(self.X_test,
+                                                                      chunk_size=33)),
+                                   rtol=1e-6)
+        np.testing.assert_array_equal(model.predict(self.X_test),
+                                      model.predict(self.X_test, chunk_size=33))
+
+    def test_threaded_prediction(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', num_epochs=2)
+        model.fit(self.X_train, self.y_train)
+
+        predicted_probability_matrix = model.predict_proba(self.X_test)
+        for n_jobs in [2, 4]:
+            np.testing.assert_allclose(predicted_probability_matrix,
+                                       model.predict_proba(self.X_test, chunk_size=25,
+                                                           n_jobs=n_jobs),
+                                       rtol=1e-6)
+        # The workers run the exported network, pruned units included
+        model.export()
+        model.prune(self.X_train)
+        np.testing.assert_allclose(model.predict_proba(self.X_test),
+                                   model.predict_proba(self.X_test, chunk_size=25, n_jobs=4),
+                                   rtol=1e-6)
+
+    def test_numpy_nonlinearities(self):
+        import theano
+        import theano.tensor as T
+        x = T.matrix('x')
+        values = np.linspace(-3, 3, 24).reshape(4, 6).astype(theano.config.floatX)
+        nonlinearities = list(FeedForwardNet.activation_functions.values()) + \
+            list(FeedForwardNet.output_activations.values())
+        nonlinearities += [lasagne.nonlinearities.LeakyRectify(0.2),
+                           lasagne.nonlinearities.ScaledTanH(0.5, 2.0)]
+        for nonlinearity in nonlinearities:
+            if nonlinearity in (lasagne.nonlinearities.LeakyRectify,
+                                lasagne.nonlinearities.ScaledTanH):
+                continue
+            expected = theano.function([x], nonlinearity(x))(values)
+            np.testing.assert_allclose(expected,
+                                       numpy_nonlinearity(nonlinearity)(values.copy()),
+                                       rtol=1e-5, atol=1e-7)
+
+    def test_samplers(self):
+        from component.implementation.FeedForwardNet import stratified_order, \
+            loss_weighted_order
+        y = np.array([0] * 90 + [1] * 10)
+        order = stratified_order(y, random_state=1)
+        np.testing.assert_array_equal(np.sort(order), np.arange(100))
+        # Every batch of 10 gets exactly one of the minority class
+        np.testing.assert_array_equal(y[order].reshape(10, 10).sum(axis=1), np.ones(10))
+
+        # High loss points are drawn more often, the weighted mean of the
+        # drawn losses is still the mean loss
+        losses = np.random.RandomState(1).exponential(size=100000)
+        order, weights = loss_weighted_order(losses, random_state=1)
+        self.assertGreater(np.mean(losses[order]), 1.2 * np.mean(losses))
+        self.assertAlmostEqual(np.mean(weights * losses[order]), np.mean(losses), delta=0.01)
+
+        for sampler in ['uniform', 'stratified', 'loss']:
+            model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                                   learning_rate=0.1,
+                                   weight_init_per_layer=('he_normal',)*3,
+                                   solver='sgd', num_epochs=3, sampler=sampler,
+                                   random_state=1)
+            # A new order each epoch
+            self.assertFalse(np.array_equal(model._epoch_order(self.y_train)[0],
+                                            model._epoch_order(self.y_train)[0]))
+            model.fit(self.X_train, self.y_train)
+            self.assertEqual(len(model.loss_history), 3)
+            if sampler == 'loss':
+                self.assertEqual(len(model.example_losses), self.X_train.shape[0])
+
+    def test_time_budget(self):
+        import time
+        kwargs = dict(input_shape=(50, 7), batch_size=50, learning_rate=0.1,
+                      weight_init_per_layer=('he_normal',)*3, solver='sgd',
+                      lr_policy='exp', gamma=0.9, random_state=1)
+        model = FeedForwardNet(num_epochs=1, **kwargs)
+        model.fit(self.X_train, self.y_train)
+        # Room for 5 of the 10 remaining epochs
+        model.epoch_time = 1.0
+        model.time_budget = time.time() - model.start_time + 5.5
+        self.assertEqual(model.budget_epochs(10), 5)
+        self.assertEqual(model.timeouts_avoided, 1)
+        self.assertEqual([epoch for epoch, _ in model.budget_schedule], [3, 5, 7, 9, 11])
+
+        model.time_budget = None
+        model.num_epochs = 5
+        model.fit(self.X_train, self.y_train)
+        reference = FeedForwardNet(num_epochs=11, **kwargs)
+        reference.fit(self.X_train, self.y_train)
+        self.assertEqual(model.epochs_trained, 6)
+        self.assertAlmostEqual(model.learning_rate, reference.learning_rate, places=6)
+
+        # Without a chance to finish a second epoch, training stops after the first
+        model = FeedForwardNet(num_epochs=10, time_budget=0.0, **kwargs)
+        model.fit(self.X_train, self.y_train)
+        self.assertEqual(model.epochs_trained, 1)
+
+        # Epochs that slow down compress the rest of the schedule again
+        model = FeedForwardNet(num_epochs=1, **kwargs)
+        model.fit(self.X_train, self.y_train)
+        model.epoch_time = 1.0
+        model.time_budget = time.time() - model.start_time + 5.5
+        model.budget_epochs(10)
+        model.epoch_time = 2.0
+        model.time_budget = time.time() - model.start_time + 5.5
+        self.assertEqual(model.budget_epochs(5), 2)
+        self.assertEqual(model.timeouts_avoided, 1)
+        self.assertEqual([epoch for epoch, _ in model.budget_schedule], [7, 11])
+
+        # L-BFGS stops at the evaluations that fit into the budget
+        model = FeedForwardNet(num_epochs=1, lbfgs_threshold=self.X_train.shape[0],
+                               lbfgs_max_iter=1000, time_budget=0.0, **kwargs)
+        model.fit(self.X_train, self.y_train)
+        self.assertEqual(model.timeouts_avoided, 1)
+        self.assertEqual(len(model.loss_history), 1)
+
+    def test_resume_from_checkpoint(self):
+        import shutil
+        import tempfile
+        from component.implementation.Checkpoint import Checkpointer
+        directory = tempfile.mkdtemp()
+        fname = directory + '/checkpoint.npz'
+        kwargs = dict(input_shape=(50, 7), batch_size=50, learning_rate=0.01,
+                      num_layers=3, num_units_per_layer=(20, 20),
+                      dropout_per_layer=(0.0, 0.0), dropout_output=0.0,
+                      weight_init_per_layer=('he_normal',)*2, solver='adam',
+                      lr_policy='inv', gamma=0.1, power=0.75, lr_range_test_steps=20,
+                      sampler='loss', random_state=1)
+        model = FeedForwardNet(num_epochs=4, **kwargs)
+        model.fit(self.X_train, self.y_train)
+
+        # Killed after the second epoch
+        killed = FeedForwardNet(num_epochs=2, **kwargs)
+        killed.checkpointer = Checkpointer(fname)
+        killed.fit(self.X_train, self.y_train)
+        killed.checkpointer.close()
+
+        # Predictions of the last checkpoint without the configuration
+        loaded = Checkpointer.load_estimator(fname)
+        self.assertEqual(loaded.epochs_trained, 2)
+        self.assertIsNone(loaded.train_fn)
+        np.testing.assert_allclose(killed.predict_proba(self.X_test),
+                                   loaded.predict_proba(self.X_test), rtol=1e-6)
+
+        resumed = FeedForwardNet(num_epochs=2, **kwargs)
+        resumed.set_train_state(Checkpointer.load(fname))
+        self.assertEqual(resumed.epochs_trained, 2)
+        self.assertEqual(resumed.lr_range, killed.lr_range)
+        np.testing.assert_array_equal(resumed.example_losses, killed.example_losses)
+        np.testing.assert_allclose(killed.predict_proba(self.X_test),
+                                   resumed.predict_proba(self.X_test), rtol=1e-6)
+        # The lr range test is not run again
+        resumed._lr_range_test = None
+        resumed.fit(self.X_train, self.y_train)
+        self.assertEqual(resumed.base_learning_rate, model.base_learning_rate)
+        np.testing.assert_allclose(model.loss_history, resumed.loss_history, rtol=1e-5)
+        np.testing.assert_allclose(model.predict_proba(self.X_test),
+                                   resumed.predict_proba(self.X_test), rtol=1e-5)
+        shutil.rmtree(directory)
+
+    def test_gradient_accumulation(self):
+        # Without dropout, micro-batches have to follow the full batch steps
+        for solver in ['sgd', 'momentum', 'nesterov', 'adam', 'adadelta',
+                       'adagrad', 'smorm3s']:
+            kwargs = dict(input_shape=(50, 7), batch_size=50, learning_rate=0.01,
+                          num_layers=3, num_units_per_layer=(20, 20),
+                          dropout_per_layer=(0.0, 0.0), dropout_output=0.0,
+                          weight_init_per_layer=('he_normal',)*2,
+                          solver=solver, num_epochs=3, random_state=1)
+            model = FeedForwardNet(**kwargs)
+            model.fit(self.X_train, self.y_train)
+            # Uneven micro-batches of 17, 17 and 16 points
+            accumulated = FeedForwardNet(accumulation_steps=3, **kwargs)
+            accumulated.fit(self.X_train, self.y_train)
+
+            np.testing.assert_allclose(model.loss_history, accumulated.loss_history,
+                                       rtol=1e-4)
+            np.testing.assert_allclose(model.predict_proba(self.X_test),
+                                       accumulated.predict_proba(self.X_test),
+                                       rtol=1e-4, atol=1e-6)
+
+    def test_partial_fit(self):
+        half = self.X_train.shape[0] // 2
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', num_epochs=2, replay_size=100,
+                               random_state=1)
+        model.fit(self.X_train[:half], self.y_train[:half])
+        train_fn = model.train_fn
+        self.assertEqual(model.replay_X.shape[0], 100)
+
+        model.partial_fit(self.X_train[half:half + 30],
+                          list(self.y_train[half:half + 30]))
+        model.partial_fit(self.X_train[half + 30:], self.y_train[half + 30:], num_epochs=2)
+        self.assertIs(model.train_fn, train_fn)
+        self.assertEqual(model.epochs_trained, 5)
+        self.assertEqual(model.batch_size, 50)
+        self.assertEqual(model.replay_X.shape[0], 100)
+        predictions = model.predict_proba(self.X_test)
+        self.assertTrue((1 - predictions.sum(axis=1) < 1e-3).all())
+
+        with self.assertRaises(ValueError):
+            model.partial_fit(self.X_train[:10], [2] * 10)
+
+    def test_sampled_softmax(self):
+        rng = np.random.RandomState(1)
+        X = rng.randn(1000, 7).astype(np.float32)
+        y = rng.randint(0, 50, 1000).astype(np.int32)
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1, num_output_units=50,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', num_epochs=2, sampled_softmax=10,
+                               random_state=1)
+        model.fit(X, y)
+        candidates = model.candidates.get_value()
+        self.assertLessEqual(len(candidates), 60)
+        self.assertTrue(np.all(np.diff(candidates) > 0))
+
+        # Targets map to their position among the candidates
+        positions = model._sample_candidates(y[:50])
+        np.testing.assert_array_equal(model.candidates.get_value()[positions], y[:50])
+
+        predictions = model.predict_proba(X[:100])
+        self.assertEqual(predictions.shape, (100, 50))
+        self.assertTrue((1 - predictions.sum(axis=1) < 1e-3).all())
+
+        # With state, the solver still changes the output columns of the
+        # candidates only
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.01, num_output_units=50,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='adam', num_epochs=1, sampled_softmax=10,
+                               random_state=1)
+        model.fit(X, y)
+        W, b = model.network.W.get_value(), model.network.b.get_value()
+        model.train_fn(X[:50], y[:50], 0.01)
+        left_out = np.setdiff1d(np.arange(50), model.candidates.get_value())
+        self.assertGreater(len(left_out), 0)
+        np.testing.assert_array_equal(model.network.W.get_value()[:, left_out], W[:, left_out])
+        np.testing.assert_array_equal(model.network.b.get_value()[left_out], b[left_out])
+        self.assertFalse(np.array_equal(model.network.W.get_value(), W))
+
+    def test_full_batch_lbfgs(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               num_layers=3, num_units_per_layer=(20, 20),
+                               weight_init_per_layer=('he_normal',)*2,
+                               lbfgs_threshold=self.X_train.shape[0],
+                               lbfgs_max_iter=50, random_state=1)
+        initial_loss = model._compile_full_batch_function()(self.X_train, self.y_train)[0]
+        model.fit(self.X_train, self.y_train)
+        self.assertIsNotNone(model.full_batch_fn)
+        self.assertEqual(len(model.loss_history), 1)
+        self.assertLess(model.loss_history[0], initial_loss)
+        predictions = model.predict_proba(self.X_test)
+        self.assertTrue((1 - predictions.sum(axis=1) < 1e-3).all())
+
+    def test_batch_growth_policy(self):
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', lr_policy='step', gamma=0.5, epoch_step=2,
+                               batch_policy='growth', num_epochs=2, random_state=1)
+        model.fit(self.X_train, self.y_train)
+        # Instead of halving the lr, the batch doubles
+        self.assertEqual(model.batch_size, 100)
+        self.assertAlmostEqual(model.learning_rate, 0.1, places=6)
+        self.assertAlmostEqual(model.policy_learning_rate, 0.05, places=6)
+        model.fit(self.X_train, self.y_train)
+        self.assertEqual(model.batch_size, 400)
+        self.assertAlmostEqual(model.learning_rate, 0.1, places=6)
+
+        # Past the training set the lr decays by the rest of the factor
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', lr_policy='step', gamma=0.01, epoch_step=1,
+                               batch_policy='growth', num_epochs=1, random_state=1)
+        model.fit(self.X_train, self.y_train)
+        self.assertEqual(model.batch_size, 1000)
+        self.assertAlmostEqual(model.learning_rate, 0.1 * 20 / 100, places=6)
+
+        # Grown batches take more micro-batches of the same size
+        model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                               learning_rate=0.1,
+                               weight_init_per_layer=('he_normal',)*3,
+                               solver='sgd', lr_policy='step', gamma=0.5, epoch_step=1,
+                               batch_policy='growth', accumulation_steps=5,
+                               num_epochs=1, random_state=1)
+        model.fit(self.X_train, self.y_train)
+        self.assertEqual(model.batch_size, 100)
+        accumulate_fn = model.accumulate_fn
+        micro_sizes = []
+
+        def recording_accumulate_fn(inputs, *args):
+            micro_sizes.append(inputs.shape[0])
+            return accumulate_fn(inputs, *args)
+        model.accumulate_fn = recording_accumulate_fn
+        model.partial_fit(self.X_train, self.y_train)
+        self.assertEqual(max(micro_sizes), 10)
+
+    def test_feature_hashing(self):
+        rng = np.random.RandomState(1)
+        X = sp.random(200, 100000, density=0.0005, format='csr', random_state=rng,
+                      dtype=np.float32)
+        y = rng.randint(0, 2, 200).astype(np.int32)
+        hashed = hash_features(X, 64)
+        self.assertEqual(hashed.shape, (200, 64))
+        # Same columns land in the same buckets with the same signs
+        np.testing.assert_array_equal(hashed.toarray(), hash_features(X, 64).toarray())
+        # A single column per row is only moved and signed
+        single = sp.csr_matrix((np.ones(3), [5, 70000, 99999], [0, 1, 2, 3]), shape=(3, 100000))
+        np.testing.assert_array_equal(np.abs(hash_features(single, 64)).sum(axis=1), 1)
+
+        model = FeedForwardNet(input_shape=(50, X.shape[1]), batch_size=50,
+                               num_layers=2, num_units_per_layer=(16,),
+                               dropout_per_layer=(0.0,),
+                               weight_init_per_layer=('he_normal',),
+                               is_sparse=True, hash_buckets=64, num_epochs=2,
+                               random_state=1)
+        self.assertEqual(model.input_shape, (50, 64))
+        self.assertEqual(lasagne.layers.get_all_params(model.network)[0].get_value().shape,
+                         (64, 16))
+        model.fit(X, y)
+        hashed = model.prepared_X[1]
+        model.fit(X, y)
+        # Hashed once for fits on the same X
+        self.assertIs(model.prepared_X[1], hashed)
+        predictions = model.predict_proba(X, is_sparse=True)
+        self.assertEqual(predictions.shape, (200, 2))
+        model.export()
+        self.assertIsNone(model.prepared_X)
+
+    def test_lazy_updates(self):
+        rng = np.random.RandomState(1)
+        X = sp.random(300, 500, density=0.01, format='csr', random_state=rng,
+                      dtype=np.float32)
+        y = rng.randint(0, 2, 300).astype(np.int32)
+
+        def fitted_weights(solver, lazy_updates):
+            model = FeedForwardNet(input_shape=(30, 500), batch_size=30,
+                                   num_layers=2, num_units_per_layer=(16,),
+                                   dropout_per_layer=(0.0,), dropout_output=0.0,
+                                   weight_init_per_layer=('he_normal',),
+                                   solver=solver, learning_rate=0.1, lambda2=1e-2,
+                                   is_sparse=True, lazy_updates=lazy_updates,
+                                   num_epochs=2, random_state=1)
+            initial = model.get_param_values()
+            model.fit(X, y)
+            return initial, model.get_param_values()
+
+        # With the deferred decay sgd is the dense update
+        _, dense = fitted_weights('sgd', False)
+        _, lazy = fitted_weights('sgd', True)
+        for dense_values, lazy_values in zip(dense, lazy):
+            np.testing.assert_allclose(dense_values, lazy_values, rtol=1e-4, atol=1e-6)
+
+        # Momentum leaves the rows of columns never seen to the L2 decay,
+        # 10 minibatches per epoch
+        unused = np.asarray(X.sum(axis=0)).ravel() == 0
+        self.assertTrue(unused.any())
+        initial, lazy = fitted_weights('momentum', True)
+        np.testing.assert_allclose(lazy[0][unused],
+                                   initial[0][unused] * (1 - 2 * 1e-2 * 0.1) ** 20,
+                                   rtol=1e-4)
+        # The deferred decay is the one of sgd, adaptive solvers are dense
+        self.assertRaises(AssertionError, fitted_weights, 'adam', True)
+
+        # A decay step past 1 zeroes the rows instead of turning them NaN
+        model = FeedForwardNet(input_shape=(30, 500), batch_size=30,
+                               num_layers=2, num_units_per_layer=(16,),
+                               dropout_per_layer=(0.0,), dropout_output=0.0,
+                               weight_init_per_layer=('he_normal',),
+                               solver='sgd', learning_rate=1.0, lambda2=1.0,
+                               is_sparse=True, lazy_updates=True,
+                               num_epochs=1, random_state=1)
+        model.fit(X, y)
+        W = model.get_param_values()[0]
+        self.assertTrue(np.isfinite(W).all())
+        np.testing.assert_array_equal(W[unused], 0)
+
+        # A factorized first layer falls back to full rank
+        model = FeedForwardNet(input_shape=(30, 500), batch_size=30,
+                               num_layers=2, num_units_per_layer=(16,),
+                               dropout_per_layer=(0.0,),
+                               weight_init_per_layer=('he_normal',),
+                               rank_fraction_per_layer=(0.25,), solver='sgd',
+                               is_sparse=True, lazy_updates=True,
+                               num_epochs=1, random_state=1)
+        self.assertEqual(model.lazy_layer.W.get_value().shape, (500, 16))
+        model.fit(X, y)
+
+    def test_fast_initializers(self):
+        lasagne.random.set_rng(np.random.RandomState(1))
+        for shape in [(300, 100), (100, 300)]:
+            W = QROrthogonal().sample(shape)
+            self.assertEqual(W.shape, shape)
+            gram = np.dot(W.T, W) if shape[0] > shape[1] else np.dot(W, W.T)
+            np.testing.assert_allclose(gram, np.eye(min(shape)), atol=1e-4)
+        # Same shape and seed reuse the cached basis
+        lasagne.random.set_rng(np.random.RandomState(2))
+        W = QROrthogonal(gain='relu').sample((200, 50))
+        cached = next(reversed(QROrthogonal.cache.values()))
+        lasagne.random.set_rng(np.random.RandomState(2))
+        np.testing.assert_array_equal(QROrthogonal(gain='relu').sample((200, 50)), W)
+        self.assertIs(next(reversed(QROrthogonal.cache.values())), cached)
+        np.testing.assert_allclose(np.dot(W.T, W), 2 * np.eye(50), atol=1e-4)
+
+        # The cache stays within its bytes, bases larger than it are not kept
+        cache_bytes = QROrthogonal.cache_bytes
+        QROrthogonal.cache_bytes = cached.nbytes * 2
+        try:
+            for shape in [(200, 50), (200, 51), (200, 52), (500, 500)]:
+                QROrthogonal().sample(shape)
+                self.assertLessEqual(sum(q.nbytes for q in QROrthogonal.cache.values()),
+                                     QROrthogonal.cache_bytes)
+            self.assertFalse(any(q.shape == (500, 500) for q in QROrthogonal.cache.values()))
+        finally:
+            QROrthogonal.cache_bytes = cache_bytes
+
+        W = VectorizedSparse(sparsity=0.1, std=0.01).sample((500, 400))
+        np.testing.assert_array_equal((W != 0).sum(axis=0), 50)
+        self.assertAlmostEqual(W[W != 0].std(), 0.01, places=3)
+        lasagne_W = lasagne.init.Sparse(sparsity=0.1, std=0.01).sample((500, 400))
+        np.testing.assert_array_equal((lasagne_W != 0).sum(axis=0), (W != 0).sum(axis=0))
+        # Above half of the rows, the empty ones are drawn instead
+        W = VectorizedSparse(sparsity=0.9, std=0.01).sample((100, 30))
+        np.testing.assert_array_equal((W != 0).sum(axis=0), 90)
+
+        # Threads share the cache of the orthogonal bases
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(4)
+        try:
+            shapes = [(60 + i % 5, 40) for i in range(40)]
+            for W, shape in zip(pool.map(QROrthogonal().sample, shapes), shapes):
+                self.assertEqual(W.shape, shape)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertLessEqual(sum(q.nbytes for q in QROrthogonal.cache.values()),
+                             QROrthogonal.cache_bytes)
+
+    def test_profiling(self):
+        directory = tempfile.mkdtemp()
+        os.environ['AUTONET_PROFILE_DIR'] = directory
+        try:
+            for solver in ['sgd', 'adam']:
+                model = FeedForwardNet(input_shape=(50, 7), batch_size=50,
+                                       num_layers=3, num_units_per_layer=(20, 20),
+                                       weight_init_per_layer=('he_normal',)*2,
+                                       solver=solver, num_epochs=2, profile=True,
+                                       random_state=1)
+                model.fit(self.X_train, self.y_train)
+                fname = model.profile_fname
+                self.assertTrue(fname.startswith(directory))
+                model.predict_proba(self.X_test)
+                # Later writes update the same file
+                self.assertEqual(model.write_profile(), fname)
+
+            with open(fname) as fh:
+                summary = json.load(fh)
+            self.assertEqual(summary['config']['solver'], 'adam')
+            self.assertGreater(summary['functions']['train_fn']['calls'], 0)
+            categories = set(entry.rsplit('/', 1)[1] for entry in summary['ops'])
+            self.assertTrue(categories <= set(CATEGORIES))
+            self.assertIn('dense matmul', categories)
+            self.assertIn('gradient', categories)
+            self.assertIn('optimizer update', categories)
+            # Activations and dropout masks belong to their layers
+            self.assertIn('2_DenseLayer/activation', summary['ops'])
+            self.assertIn('2_DenseLayer/gradient', summary['ops'])
+            self.assertIn('1_DropoutLayer/dropout', summary['ops'])
+
+            totals = merge_profiles(directory, by='solver')
+            self.assertEqual(sorted(totals.keys()), ['adam', 'sgd'])
+            self.assertGreater(totals['adam']['dense matmul'], 0)
+        finally:
+            del os.environ['AUTONET_PROFILE_DIR']
+            shutil.rmtree(directory)
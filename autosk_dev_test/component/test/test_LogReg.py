@@ -1,6 +1,8 @@
 import unittest
+import numpy as np
 
 from component.LogReg import LogReg
+from component.implementation.LogisticRegression import LogisticRegression
 from autosklearn.pipeline.util import _test_classifier
 import sklearn.metrics
 
@@ -32,3 +34,29 @@ class LogRegComponentTest(unittest.TestCase):
                                                        y_pred=predictions)
             print(acc_score)
             self.assertAlmostEqual(0.28, acc_score)
+
+
+class LogisticRegressionTest(unittest.TestCase):
+    dataset_dir = '/home/mendozah/workspace/datasets'
+
+    X_train = np.load(dataset_dir + 'train.npy')
+    y_train = np.load(dataset_dir + 'train_labels.npy')
+    X_test = np.load(dataset_dir + 'test.npy')
+
+    def test_chunked_prediction(self):
+        model = LogisticRegression(input_shape=(50, 7), batch_size=50,
+                                   num_output_units=2, learning_rate=0.1,
+                                   solver='sgd', num_epochs=2)
+        model.fit(self.X_train, self.y_train)
+
+        # 200 test points in chunks of 33, the last chunk has 2
+        predicted_probability_matrix = model.predict_proba(self.X_test)
+        np.testing.assert_allclose(predicted_probability_matrix,
+                                   model.predict_proba(self.X_test, chunk_size=33),
+                                   rtol=1e-6)
+        chunks = list(model.predict_proba_iter(self.X_test, chunk_size=33))
+        self.assertEqual(chunks[-1].shape[0], self.X_test.shape[0] % 33)
+        np.testing.assert_allclose(predicted_probability_matrix, np.vstack(chunks),
+                                   rtol=1e-6)
+        np.testing.assert_array_equal(model.predict(self.X_test),
+                                      model.predict(self.X_test, chunk_size=33))
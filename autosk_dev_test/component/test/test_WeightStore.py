@@ -0,0 +1,38 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+
+from component.implementation.WeightStore import WeightStore
+
+
+class WeightStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.X = np.random.RandomState(1).randn(100, 7)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_longest_prefix_match(self):
+        store = WeightStore(self.directory, max_entries=2)
+        key = store.dataset_key(self.X)
+        short_net = [np.ones((7, 10)), np.zeros(10), np.ones((10, 3)), np.zeros(3)]
+        long_net = [np.ones((7, 10)) * 2, np.zeros(10), np.ones((10, 5)), np.zeros(5),
+                    np.ones((5, 3)), np.zeros(3)]
+        store.save(key, short_net)
+        store.save(key, long_net)
+
+        values = store.load(key, [(7, 10), (10,), (10, 5), (5,), (5, 2), (2,)])
+        self.assertEqual(len(values), 4)
+        self.assertTrue((values[0] == 2).all())
+        self.assertEqual(store.load(key, [(8, 10), (10,)]), [])
+        self.assertEqual(store.load(store.dataset_key(self.X[1:]), [(7, 10)]), [])
+
+    def test_eviction(self):
+        store = WeightStore(self.directory, max_entries=2)
+        key = store.dataset_key(self.X)
+        for i in range(4):
+            store.save(key, [np.ones((7, 2)) * i])
+        self.assertEqual(len(store._entries(key)), 2)
+        self.assertTrue((store.load(key, [(7, 2)])[0] == 3).all())
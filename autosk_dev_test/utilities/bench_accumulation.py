@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+"""
+Peak memory and time per epoch of FeedForwardNet with a minibatch of
+4096 points trained as micro-batches of different sizes by gradient
+accumulation. Each configuration runs in its own process, its peak
+resident memory is read from getrusage.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_accumulation.py
+"""
+import multiprocessing
+import resource
+import time
+import numpy as np
+
+batch_size = 4096
+n_features = 1000
+
+
+def train(accumulation_steps, results):
+    from component.implementation import FeedForwardNet
+    FeedForwardNet.DEBUG = False
+    rng = np.random.RandomState(42)
+    X = rng.randn(4 * batch_size, n_features).astype(np.float32)
+    y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+    net = FeedForwardNet.FeedForwardNet(input_shape=(batch_size, n_features),
+                                        batch_size=batch_size, num_layers=4,
+                                        num_units_per_layer=(4096, 4096, 4096),
+                                        weight_init_per_layer=('he_normal',)*3,
+                                        num_output_units=2, solver='smorm3s',
+                                        num_epochs=2, random_state=1,
+                                        accumulation_steps=accumulation_steps)
+    start = time.time()
+    net.fit(X, y)
+    # ru_maxrss is in kilobytes on Linux
+    results.put(((time.time() - start) / 2,
+                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+
+if __name__ == '__main__':
+    results = multiprocessing.Queue()
+    for accumulation_steps in [1, 2, 4, 8, 16, 32]:
+        process = multiprocessing.Process(target=train, args=(accumulation_steps, results))
+        process.start()
+        epoch_time, peak_memory = results.get()
+        process.join()
+        print("micro-batch {:5d}: peak memory {:8.1f}MB, {:6.2f}s per epoch".format(
+            batch_size // accumulation_steps, peak_memory, epoch_time))
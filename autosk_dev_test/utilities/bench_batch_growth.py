@@ -0,0 +1,40 @@
+# -*- encoding: utf-8 -*-
+"""
+Epoch time and final training and validation loss of FeedForwardNet
+with the 'step' lr policy, decaying the learning rate against growing
+the batch size on the same schedule.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_batch_growth.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+num_epochs = 30
+rng = np.random.RandomState(42)
+X = rng.randn(60000, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+X_train, y_train = X[:50000], y[:50000]
+X_valid, y_valid = X[50000:], y[50000:]
+
+for batch_policy in ['fixed', 'growth']:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(64, n_features), batch_size=64,
+                                        num_layers=3, num_units_per_layer=(512, 512),
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=2, solver='momentum',
+                                        learning_rate=0.05, lr_policy='step', gamma=0.5,
+                                        epoch_step=5, batch_policy=batch_policy,
+                                        num_epochs=num_epochs, random_state=1)
+    start = time.time()
+    net.fit(X_train, y_train)
+    epoch_time = (time.time() - start) / num_epochs
+    probabilities = net.predict_proba(X_valid)
+    valid_loss = -np.mean(np.log(np.clip(probabilities[np.arange(len(y_valid)), y_valid],
+                                         1e-7, 1)))
+    print("{:>6}: {:.2f}s per epoch, final batch {}, training loss {:.4f}, "
+          "validation loss {:.4f}".format(batch_policy, epoch_time, net.batch_size,
+                                          net.loss_history[-1], valid_loss))
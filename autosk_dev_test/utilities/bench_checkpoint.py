@@ -0,0 +1,46 @@
+# -*- encoding: utf-8 -*-
+"""
+Per epoch overhead of the background checkpoints of FeedForwardNet:
+time the training thread spends copying the state, time the writer
+thread spends on disk, and the change of the wall-clock per epoch.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_checkpoint.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+from component.implementation.Checkpoint import Checkpointer
+
+FeedForwardNet.DEBUG = False
+
+n_features = 500
+num_epochs = 10
+rng = np.random.RandomState(42)
+X = rng.randn(20000, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+directory = tempfile.mkdtemp()
+
+epoch_times = {}
+for checkpoint in [False, True]:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(256, n_features), batch_size=256,
+                                        num_layers=4, num_units_per_layer=(1024, 1024, 1024),
+                                        weight_init_per_layer=('he_normal',)*3,
+                                        num_output_units=2, solver='adam',
+                                        num_epochs=num_epochs, random_state=1)
+    if checkpoint:
+        net.checkpointer = Checkpointer(os.path.join(directory, 'checkpoint.npz'))
+    start = time.time()
+    net.fit(X, y)
+    epoch_times[checkpoint] = (time.time() - start) / num_epochs
+    if checkpoint:
+        net.checkpointer.close()
+        print("state copy {:.4f}s, write {:.4f}s, checkpoint size {:.1f}MB".format(
+            np.mean(net.checkpointer.save_times), np.mean(net.checkpointer.write_times),
+            os.path.getsize(net.checkpointer.fname) / 2.0 ** 20))
+print("epoch {:.3f}s without, {:.3f}s with checkpoints, overhead {:.1%}".format(
+    epoch_times[False], epoch_times[True], epoch_times[True] / epoch_times[False] - 1))
+shutil.rmtree(directory)
@@ -0,0 +1,46 @@
+# -*- encoding: utf-8 -*-
+"""
+Peak memory allocated by FeedForwardNet.predict_proba on a binary task
+as the number of rows grows, predicting all rows at once vs. in chunks.
+Peak memory is traced with tracemalloc, which sees numpy's allocations,
+after the input has been created.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_chunked_predict.py
+"""
+import tracemalloc
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+rng = np.random.RandomState(42)
+X_train = rng.randn(5000, n_features).astype(np.float32)
+y_train = (X_train[:, :10].sum(axis=1) > 0).astype(np.float32)[:, np.newaxis]
+
+net = FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                    num_layers=3, num_units_per_layer=(512, 512),
+                                    weight_init_per_layer=('he_normal',)*2,
+                                    num_output_units=1, is_binary=True,
+                                    solver='adam', num_epochs=1, random_state=1)
+net.fit(X_train, y_train)
+net.predict_proba(X_train[:10])
+
+for n_rows in [10 ** 4, 10 ** 5, 10 ** 6]:
+    X = rng.randn(n_rows, n_features).astype(np.float32)
+    output_mb = n_rows * 2 * 4 / 2. ** 20
+    for chunk_size in [None, 10000]:
+        tracemalloc.start()
+        net.predict_proba(X, chunk_size=chunk_size)
+        peak = tracemalloc.get_traced_memory()[1] / 2. ** 20
+        tracemalloc.stop()
+        print("{:8d} rows, chunk {:>6}: peak {:8.1f}MB, above output array {:8.1f}MB".format(
+            n_rows, str(chunk_size), peak, peak - output_mb))
+
+    tracemalloc.start()
+    for _ in net.predict_proba_iter(X, chunk_size=10000):
+        pass
+    peak = tracemalloc.get_traced_memory()[1] / 2. ** 20
+    tracemalloc.stop()
+    print("{:8d} rows, generator   : peak {:8.1f}MB".format(n_rows, peak))
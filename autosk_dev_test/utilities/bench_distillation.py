@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-
+"""
+Latency and accuracy of an ensemble of wide FeedForwardNets against
+students distilled from it, for a few student sizes and temperatures.
+Latency is the time of predict_proba on a single request of 32 rows.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_distillation.py
+"""
+import timeit
+import numpy as np
+
+from component.implementation import FeedForwardNet
+from component.implementation.Distillation import DistillationTrainer
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+n_classes = 5
+rng = np.random.RandomState(42)
+X = rng.randn(30000, n_features).astype(np.float32)
+y = np.argmax(np.dot(np.tanh(X), rng.randn(n_features, n_classes)), axis=1).astype(np.int32)
+X_train, y_train = X[:25000], y[:25000]
+X_valid, y_valid = X[25000:], y[25000:]
+request = X_valid[:32]
+
+teachers = []
+for seed in range(3):
+    teacher = FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                            num_layers=4,
+                                            num_units_per_layer=(2048, 2048, 2048),
+                                            weight_init_per_layer=('he_normal',)*3,
+                                            dropout_per_layer=(0.3,)*3,
+                                            num_output_units=n_classes, solver='adam',
+                                            learning_rate=0.001, num_epochs=10,
+                                            random_state=seed)
+    teacher.fit(X_train, y_train)
+    teacher.export()
+    teachers.append(teacher)
+
+
+def ensemble_predict_proba(X):
+    return np.mean([t.predict_proba(X) for t in teachers], axis=0)
+
+teacher_error = np.mean(np.argmax(ensemble_predict_proba(X_valid), axis=1) != y_valid)
+teacher_latency = min(timeit.repeat(lambda: ensemble_predict_proba(request),
+                                    number=100, repeat=3)) / 100
+print("teacher ensemble: error {:.4f}, latency {:.2f}ms".format(teacher_error,
+                                                                1000 * teacher_latency))
+
+for num_units_per_layer in [(32,), (128,), (256, 256)]:
+    for temperature in [1.0, 2.0, 4.0]:
+        trainer = DistillationTrainer(teachers, temperature=temperature,
+                                      num_units_per_layer=num_units_per_layer,
+                                      batch_size=128, num_epochs=30, random_state=1)
+        trainer.fit(X_train)
+        student_error = np.mean(trainer.predict(X_valid) != y_valid)
+        student_latency = min(timeit.repeat(lambda: trainer.predict_proba(request),
+                                            number=100, repeat=3)) / 100
+        print("student {} T={}: error {:.4f} (gap {:+.4f}), latency ratio x{:.1f}".format(
+            num_units_per_layer, temperature, student_error, student_error - teacher_error,
+            teacher_latency / student_latency))
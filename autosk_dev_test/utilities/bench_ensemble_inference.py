@@ -0,0 +1,54 @@
+# -*- encoding: utf-8 -*-
+"""
+Prediction throughput of an ensemble of FeedForwardNets, calling
+predict_proba of every member in turn against one batched forward pass
+per group of members with the same architecture.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_ensemble_inference.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet, EnsembleInference
+
+FeedForwardNet.DEBUG = False
+EnsembleInference.DEBUG = False
+
+n_features = 100
+num_members = 8
+rng = np.random.RandomState(42)
+X = rng.randn(5000, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+X_test = rng.randn(50000, n_features).astype(np.float32)
+
+for num_architectures in [1, 2, num_members]:
+    members = []
+    for i in range(num_members):
+        num_units = 256 + 32 * (i % num_architectures)
+        net = FeedForwardNet.FeedForwardNet(input_shape=(100, n_features), batch_size=100,
+                                            num_layers=3, num_units_per_layer=(num_units,)*2,
+                                            weight_init_per_layer=('he_normal',)*2,
+                                            num_output_units=2, solver='adam',
+                                            learning_rate=0.001, num_epochs=1,
+                                            random_state=i)
+        net.fit(X, y)
+        net.export()
+        members.append(net)
+    weights = rng.uniform(size=num_members)
+    weights /= weights.sum()
+    ensemble = EnsembleInference.EnsemblePredictor(members, weights)
+
+    timings = {}
+    for name, predict in [
+            ('sequential', lambda: sum(w * m.predict_proba(X_test)
+                                       for w, m in zip(weights, members))),
+            ('batched', lambda: ensemble.predict_proba(X_test))]:
+        predict()
+        start = time.time()
+        for _ in range(3):
+            predict()
+        timings[name] = (time.time() - start) / 3
+    print("{} architectures, {} forward passes: sequential {:.0f} rows/s, "
+          "batched {:.0f} rows/s".format(num_architectures, len(ensemble.groups),
+                                         X_test.shape[0] / timings['sequential'],
+                                         X_test.shape[0] / timings['batched']))
@@ -0,0 +1,43 @@
+# -*- encoding: utf-8 -*-
+"""
+First layer size and epoch time of FeedForwardNet on sparse data padded
+with empty and duplicated columns, with and without feature compaction.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_feature_compaction.py
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+
+from component.implementation import FeedForwardNet, FeatureCompaction
+
+FeedForwardNet.DEBUG = False
+
+num_epochs = 5
+rng = np.random.RandomState(42)
+informative = sp.random(20000, 2000, density=0.01, format='csr',
+                        random_state=rng, dtype=np.float32)
+# One way encoded data often carries never seen and repeated columns
+X = sp.hstack([informative, sp.csr_matrix((20000, 4000), dtype=np.float32),
+               informative[:, :2000]]).tocsr()
+row_sums = np.asarray(informative.sum(axis=1)).ravel()
+y = (row_sums > np.median(row_sums)).astype(np.int32)
+
+for compact in [False, True]:
+    start = time.time()
+    Xc = X
+    if compact:
+        Xc = FeatureCompaction.FeatureCompactor().fit_transform(X)
+    compaction_time = time.time() - start
+    net = FeedForwardNet.FeedForwardNet(input_shape=(100, Xc.shape[1]), batch_size=100,
+                                        num_layers=3, num_units_per_layer=(256, 256),
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=2, solver='adam',
+                                        learning_rate=0.001, num_epochs=num_epochs,
+                                        is_sparse=True, random_state=1)
+    start = time.time()
+    net.fit(Xc, y)
+    epoch_time = (time.time() - start) / num_epochs
+    print("compact={}: {} inputs, {} first layer weights, compaction {:.2f}s, "
+          "{:.2f}s per epoch".format(compact, Xc.shape[1], Xc.shape[1] * 256,
+                                     compaction_time, epoch_time))
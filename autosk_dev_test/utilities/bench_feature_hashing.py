@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+"""
+Hashing time, first layer size, epoch time and validation accuracy of
+FeedForwardNet on wide sparse data, with all columns as inputs against
+hashing them into fewer buckets.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_feature_hashing.py
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 200000
+num_epochs = 5
+rng = np.random.RandomState(42)
+X = sp.random(60000, n_features, density=0.0002, format='csr',
+              random_state=rng, dtype=np.float32)
+y = (X.dot(rng.randn(n_features)) > 0).astype(np.int32)
+X_train, y_train = X[:50000], y[:50000]
+X_valid, y_valid = X[50000:], y[50000:]
+
+start = time.time()
+FeedForwardNet.hash_features(X, 2 ** 14)
+print("hashing {} nonzeros: {:.3f}s".format(X.nnz, time.time() - start))
+
+for hash_buckets in [0, 2 ** 16, 2 ** 14, 2 ** 12]:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(100, n_features), batch_size=100,
+                                        num_layers=3, num_units_per_layer=(256, 256),
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=2, solver='adam',
+                                        learning_rate=0.001, num_epochs=num_epochs,
+                                        is_sparse=True, hash_buckets=hash_buckets,
+                                        random_state=1)
+    start = time.time()
+    net.fit(X_train, y_train)
+    epoch_time = (time.time() - start) / num_epochs
+    accuracy = np.mean(net.predict(X_valid, is_sparse=True) == y_valid)
+    print("{:>6} buckets: {} first layer weights, {:.2f}s per epoch, "
+          "validation accuracy {:.4f}".format(hash_buckets or 'no', net.input_shape[1] * 256,
+                                              epoch_time, accuracy))
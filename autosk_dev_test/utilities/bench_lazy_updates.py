@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+"""
+Epoch time and validation accuracy of FeedForwardNet on wide sparse data,
+updating every row of the first layer against only the rows of the
+columns present in each minibatch.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_lazy_updates.py
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100000
+num_epochs = 3
+rng = np.random.RandomState(42)
+# 50 columns per row. sp.random draws its positions without replacement
+# among all n_points * n_features, which does not fit in memory.
+n_points, row_nnz = 30000, 50
+X = sp.csr_matrix((rng.uniform(size=n_points * row_nnz).astype(np.float32),
+                   rng.randint(n_features, size=n_points * row_nnz),
+                   np.arange(0, n_points * row_nnz + 1, row_nnz)),
+                  shape=(n_points, n_features))
+X.sum_duplicates()
+y = (X.dot(rng.randn(n_features)) > 0).astype(np.int32)
+X_train, y_train = X[:25000], y[:25000]
+X_valid, y_valid = X[25000:], y[25000:]
+
+for solver in ['sgd', 'momentum', 'nesterov']:
+    for lazy_updates in [False, True]:
+        net = FeedForwardNet.FeedForwardNet(input_shape=(100, n_features), batch_size=100,
+                                            num_layers=3, num_units_per_layer=(256, 256),
+                                            dropout_per_layer=(0.0, 0.5),
+                                            weight_init_per_layer=('he_normal',)*2,
+                                            num_output_units=2, solver=solver,
+                                            learning_rate=0.01, lambda2=1e-5,
+                                            num_epochs=num_epochs, is_sparse=True,
+                                            lazy_updates=lazy_updates, random_state=1)
+        start = time.time()
+        net.fit(X_train, y_train)
+        epoch_time = (time.time() - start) / num_epochs
+        accuracy = np.mean(net.predict(X_valid, is_sparse=True) == y_valid)
+        print("{:>8} lazy={}: {:.2f}s per epoch, validation accuracy {:.4f}".format(
+            solver, lazy_updates, epoch_time, accuracy))
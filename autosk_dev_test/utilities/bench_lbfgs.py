@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+"""
+Time to converge of full batch L-BFGS against the minibatch solvers of
+FeedForwardNet on small datasets. Minibatch solvers train until their
+training loss gets within 1% of the L-BFGS one, or max_epochs.
+
+The datasets are the small ones bundled with scikit-learn, which are
+also on OpenML (digits, breast-w, wine), so the benchmark runs offline.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_lbfgs.py
+"""
+import time
+import numpy as np
+from sklearn.datasets import load_breast_cancer, load_digits, load_wine
+from sklearn.preprocessing import StandardScaler
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+max_epochs = 300
+datasets = [('digits', load_digits), ('breast-w', load_breast_cancer), ('wine', load_wine)]
+
+for name, loader in datasets:
+    X, y = loader(return_X_y=True)
+    X = StandardScaler().fit_transform(X).astype(np.float32)
+    y = y.astype(np.int32)
+    net_kwargs = dict(input_shape=(32, X.shape[1]), batch_size=32, num_layers=3,
+                      num_units_per_layer=(64, 64), dropout_per_layer=(0.0, 0.0),
+                      dropout_output=0.0, weight_init_per_layer=('he_normal',)*2,
+                      num_output_units=len(np.unique(y)), lambda2=1e-4, random_state=1)
+
+    start = time.time()
+    net = FeedForwardNet.FeedForwardNet(lbfgs_threshold=X.shape[0], lbfgs_max_iter=500,
+                                        **net_kwargs)
+    net.fit(X, y)
+    target_loss = 1.01 * net.loss_history[-1]
+    print("{:>9} ({} rows) lbfgs: loss {:.4f} in {:.2f}s".format(
+        name, X.shape[0], net.loss_history[-1], time.time() - start))
+
+    for solver, learning_rate in [('sgd', 0.1), ('momentum', 0.01), ('adam', 0.001),
+                                  ('smorm3s', 0.01)]:
+        start = time.time()
+        net = FeedForwardNet.FeedForwardNet(solver=solver, learning_rate=learning_rate,
+                                            num_epochs=1, **net_kwargs)
+        for epoch in range(max_epochs):
+            net.fit(X, y)
+            if net.loss_history[-1] <= target_loss:
+                break
+        print("{:>9} {:>9}: loss {:.4f} after {} epochs in {:.2f}s".format(
+            '', solver, net.loss_history[-1], epoch + 1, time.time() - start))
@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+"""
+Epoch time, prediction time and accuracy of wide FeedForwardNets with
+full dense layers vs. factorized W = U.V layers of decreasing rank.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_low_rank.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 256
+num_units = 4096
+num_epochs = 3
+rng = np.random.RandomState(42)
+X = rng.randn(24000, n_features).astype(np.float32)
+y = np.argmax(np.dot(np.tanh(X), rng.randn(n_features, 10)), axis=1).astype(np.int32)
+X_train, y_train = X[:20000], y[:20000]
+X_test, y_test = X[20000:], y[20000:]
+
+for rank_fraction in [1.0, 0.25, 0.1, 0.03]:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(256, n_features), batch_size=256,
+                                        num_layers=4, num_units_per_layer=(num_units,)*3,
+                                        dropout_per_layer=(0.2,)*3, dropout_output=0.2,
+                                        weight_init_per_layer=('he_normal',)*3,
+                                        rank_fraction_per_layer=(rank_fraction,)*3,
+                                        num_output_units=10, learning_rate=1e-3,
+                                        solver='adam', num_epochs=num_epochs,
+                                        random_state=1)
+    num_params = sum(v.size for v in net.get_param_values())
+    start = time.time()
+    net.fit(X_train, y_train)
+    epoch_time = (time.time() - start) / num_epochs
+    net.export()
+    net.predict(X_test)
+    start = time.time()
+    accuracy = np.mean(net.predict(X_test) == y_test)
+    predict_time = time.time() - start
+    print("rank fraction {:.2f}: {:9d} params, {:6.2f}s/epoch, predict {:.3f}s, "
+          "accuracy {:.4f}".format(rank_fraction, num_params, epoch_time,
+                                   predict_time, accuracy))
@@ -0,0 +1,43 @@
+# -*- encoding: utf-8 -*-
+"""
+Wall-clock of a random search over learning_rate (log-uniform in
+[1e-6, 1], as in DeepFeedNet) until a validation error is reached, with
+and without the lr range test of FeedForwardNet.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_lr_range_test.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 50
+target_error = 0.12
+max_configs = 30
+rng = np.random.RandomState(42)
+X = rng.randn(12000, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+X_train, y_train = X[:10000], y[:10000]
+X_valid, y_valid = X[10000:], y[10000:]
+
+for lr_range_test_steps in [0, 300]:
+    search_rng = np.random.RandomState(1)
+    start = time.time()
+    for config in range(max_configs):
+        learning_rate = 10 ** search_rng.uniform(-6, 0)
+        solver = search_rng.choice(['sgd', 'momentum', 'adam'])
+        net = FeedForwardNet.FeedForwardNet(input_shape=(64, n_features), batch_size=64,
+                                            num_layers=3, num_units_per_layer=(128, 128),
+                                            dropout_per_layer=(0.2, 0.2), dropout_output=0.2,
+                                            weight_init_per_layer=('he_normal',)*2,
+                                            num_output_units=2, learning_rate=learning_rate,
+                                            solver=solver, num_epochs=5, random_state=1,
+                                            lr_range_test_steps=lr_range_test_steps)
+        net.fit(X_train, y_train)
+        error = np.mean(net.predict(X_valid) != y_valid)
+        if error <= target_error:
+            break
+    print("range test steps {:4d}: {} configs, {:7.1f}s to validation error {:.4f}".format(
+        lr_range_test_steps, config + 1, time.time() - start, error))
@@ -0,0 +1,48 @@
+# -*- encoding: utf-8 -*-
+"""
+Daily chunks of new data: cost of a full refit of FeedForwardNet on all
+data seen so far against partial_fit on the new chunk plus a replay
+buffer, and the validation error of both.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_partial_fit.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+num_days = 10
+chunk_size = 5000
+rng = np.random.RandomState(42)
+weights = rng.randn(n_features)
+X = rng.randn((num_days + 1) * chunk_size, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), weights) > 0).astype(np.int32)
+X_valid, y_valid = X[-chunk_size:], y[-chunk_size:]
+net_kwargs = dict(input_shape=(128, n_features), batch_size=128, num_layers=3,
+                  num_units_per_layer=(256, 256), weight_init_per_layer=('he_normal',)*2,
+                  num_output_units=2, solver='adam', learning_rate=0.001,
+                  num_epochs=5, random_state=1)
+
+incremental = None
+for day in range(1, num_days + 1):
+    X_seen, y_seen = X[:day * chunk_size], y[:day * chunk_size]
+    start = time.time()
+    refit = FeedForwardNet.FeedForwardNet(**net_kwargs)
+    refit.fit(X_seen, y_seen)
+    refit_time = time.time() - start
+
+    start = time.time()
+    X_new, y_new = X_seen[-chunk_size:], y_seen[-chunk_size:]
+    if incremental is None:
+        incremental = FeedForwardNet.FeedForwardNet(replay_size=chunk_size, **net_kwargs)
+        incremental.fit(X_new, y_new)
+    else:
+        incremental.partial_fit(X_new, y_new, num_epochs=2)
+    update_time = time.time() - start
+
+    print("day {:2d}: refit {:6.1f}s error {:.4f} | partial_fit {:6.1f}s error {:.4f}".format(
+        day, refit_time, np.mean(refit.predict(X_valid) != y_valid),
+        update_time, np.mean(incremental.predict(X_valid) != y_valid)))
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+"""
+Prediction time and multiply-adds of wide relu/leaky FeedForwardNets
+before and after pruning dead and constant hidden units.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_pruning.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+rng = np.random.RandomState(42)
+X = rng.randn(30000, n_features).astype(np.float32)
+y = (X[:, :10].sum(axis=1) > 0).astype(np.int32)
+X_train, y_train = X[:20000], y[:20000]
+X_test = X[20000:]
+
+
+def predict_time(net, repeats=5):
+    start = time.time()
+    for _ in range(repeats):
+        net.predict_proba(X_test)
+    return (time.time() - start) / repeats
+
+# Wider nets diverge at the learning rate of the 2048 unit ones
+for activation, num_units in [('relu', 2048), ('relu', 4096), ('leaky', 2048)]:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                        num_layers=3, num_units_per_layer=(num_units, num_units),
+                                        dropout_per_layer=(0.5, 0.5), dropout_output=0.5,
+                                        activation_per_layer=(activation,)*2,
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=2,
+                                        learning_rate=0.01 * 2048 / num_units,
+                                        solver='momentum', num_epochs=5, random_state=1)
+    net.fit(X_train, y_train)
+    net.export()
+    predictions = net.predict_proba(X_test)
+    time_before = predict_time(net)
+    net.prune(X_train)
+    time_after = predict_time(net)
+    stats = net.pruning_stats
+    print("{} {}: removed {}, FLOPs/row {} -> {} ({:.1%}), predict {:.3f}s -> {:.3f}s, "
+          "max diff {:.2e}".format(activation, num_units, stats['units_removed'],
+                                   stats['flops_before'], stats['flops_after'],
+                                   1 - float(stats['flops_after']) / stats['flops_before'],
+                                   time_before, time_after,
+                                   np.abs(predictions - net.predict_proba(X_test)).max()))
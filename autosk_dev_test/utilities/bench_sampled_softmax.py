@@ -0,0 +1,39 @@
+# -*- encoding: utf-8 -*-
+"""
+Epoch time and top-1 error of FeedForwardNet on a synthetic 5000 class
+problem, with the full softmax and with sampled softmax heads of a few
+sizes.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_sampled_softmax.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 64
+n_classes = 5000
+num_epochs = 5
+rng = np.random.RandomState(42)
+centers = rng.randn(n_classes, n_features).astype(np.float32)
+y = rng.randint(0, n_classes, 110000).astype(np.int32)
+X = centers[y] + 0.5 * rng.randn(len(y), n_features).astype(np.float32)
+X_train, y_train = X[:100000], y[:100000]
+X_valid, y_valid = X[100000:], y[100000:]
+
+for sampled_softmax in [0, 128, 512, 2048]:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(256, n_features), batch_size=256,
+                                        num_layers=3, num_units_per_layer=(512, 512),
+                                        dropout_per_layer=(0.0, 0.0), dropout_output=0.0,
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=n_classes, solver='adam',
+                                        learning_rate=0.001, num_epochs=num_epochs,
+                                        sampled_softmax=sampled_softmax, random_state=1)
+    start = time.time()
+    net.fit(X_train, y_train)
+    epoch_time = (time.time() - start) / num_epochs
+    error = np.mean(net.predict(X_valid) != y_valid)
+    print("sampled classes {:5d}: {:6.2f}s per epoch, validation error {:.4f}".format(
+        sampled_softmax, epoch_time, error))
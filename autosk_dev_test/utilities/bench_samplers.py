@@ -0,0 +1,40 @@
+# -*- encoding: utf-8 -*-
+"""
+Epochs until the training loss reaches a target, for the minibatch
+samplers of FeedForwardNet, on an imbalanced binary problem.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_samplers.py
+"""
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 50
+max_epochs = 60
+rng = np.random.RandomState(42)
+X = rng.randn(20000, n_features).astype(np.float32)
+scores = np.dot(np.tanh(X), rng.randn(n_features))
+# About 5% positives
+y = (scores > np.percentile(scores, 95)).astype(np.float32)[:, np.newaxis]
+
+histories = {}
+for sampler in ['uniform', 'stratified', 'loss']:
+    net = FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                        num_layers=3, num_units_per_layer=(128, 128),
+                                        dropout_per_layer=(0.1, 0.1), dropout_output=0.1,
+                                        weight_init_per_layer=('he_normal',)*2,
+                                        num_output_units=1, learning_rate=0.01,
+                                        solver='adam', num_epochs=max_epochs,
+                                        is_binary=True, sampler=sampler, random_state=1)
+    net.fit(X, y)
+    histories[sampler] = np.asarray(net.loss_history)
+
+# Target is the loss the uniform sampler ends with
+target = histories['uniform'][-1]
+for sampler, history in histories.items():
+    reached = np.flatnonzero(history <= target)
+    epochs = reached[0] + 1 if len(reached) else None
+    print("{:>10}: {} epochs to loss {:.4f}, final loss {:.4f}".format(
+        sampler, epochs if epochs else '>%d' % max_epochs, target, history[-1]))
@@ -0,0 +1,40 @@
+# -*- encoding: utf-8 -*-
+"""
+Fit time of FeedForwardNet for small batch sizes, calling train_fn once
+per minibatch vs. running several minibatches per call through scan.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_scan_training.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_samples = 20000
+n_features = 100
+num_epochs = 3
+rng = np.random.RandomState(42)
+X = rng.randn(n_samples, n_features).astype(np.float32)
+y = (X[:, :10].sum(axis=1) > 0).astype(np.int32)
+
+for batch_size in [16, 32, 64, 128]:
+    times = {}
+    for batches_per_call in [1, 8, 32]:
+        model = FeedForwardNet.FeedForwardNet(input_shape=(batch_size, n_features),
+                                              batch_size=batch_size,
+                                              num_layers=3,
+                                              num_units_per_layer=(128, 128),
+                                              dropout_per_layer=(0.5, 0.5),
+                                              num_output_units=2,
+                                              solver='adam',
+                                              num_epochs=num_epochs,
+                                              random_state=1,
+                                              batches_per_call=batches_per_call)
+        start = time.time()
+        model.fit(X, y)
+        times[batches_per_call] = time.time() - start
+    print("batch size {:5d}: ".format(batch_size) +
+          ", ".join("M={:3d} {:7.2f}s (x{:.2f})".format(m, t, times[1] / t)
+                    for m, t in sorted(times.items())))
@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+"""
+Ensemble accuracy per training time: snapshots of one FeedForwardNet run
+with the cyclic lr policy vs. independently trained networks.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_snapshot_ensemble.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 40
+num_members = 5
+cycle_epochs = 6
+rng = np.random.RandomState(42)
+X = rng.randn(12000, n_features).astype(np.float32)
+y = np.argmax(np.dot(np.tanh(X), rng.randn(n_features, 4)), axis=1).astype(np.int32)
+X_train, y_train = X[:10000], y[:10000]
+X_test, y_test = X[10000:], y[10000:]
+
+
+def make_net(lr_policy, num_epochs, seed):
+    return FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                         num_layers=3, num_units_per_layer=(256, 256),
+                                         dropout_per_layer=(0.1, 0.1), dropout_output=0.1,
+                                         weight_init_per_layer=('he_normal',)*2,
+                                         num_output_units=4, learning_rate=0.1,
+                                         solver='momentum', lr_policy=lr_policy,
+                                         gamma=0.5, epoch_step=cycle_epochs,
+                                         num_epochs=num_epochs, random_state=seed)
+
+
+def accuracy(all_predictions):
+    return np.mean(np.argmax(np.mean(all_predictions, axis=0), axis=1) == y_test)
+
+start = time.time()
+snapshot_net = make_net('cyclic', num_members * cycle_epochs, seed=1)
+snapshot_net.fit(X_train, y_train)
+snapshot_time = time.time() - start
+snapshot_predictions = snapshot_net.predict_proba_snapshots(X_test)
+
+start = time.time()
+independent_predictions = []
+for seed in range(num_members):
+    net = make_net('step', num_members * cycle_epochs, seed=seed + 1)
+    net.fit(X_train, y_train)
+    independent_predictions.append(net.predict_proba(X_test))
+independent_time = time.time() - start
+
+for k in range(1, num_members + 1):
+    print("{} members: snapshots acc {:.4f} ({:6.1f}s), independent acc {:.4f} ({:6.1f}s)".format(
+        k, accuracy(snapshot_predictions[:k]), snapshot_time,
+        accuracy(independent_predictions[:k]), independent_time * k / num_members))
@@ -0,0 +1,40 @@
+# -*- encoding: utf-8 -*-
+"""
+Scaling of FeedForwardNet.predict_proba with n_jobs threads, from 1 to
+16, on a large test set. One job runs the compiled theano function, more
+jobs run the exported layers in numpy, which releases the GIL.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_threaded_predict.py
+"""
+import multiprocessing
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 200
+rng = np.random.RandomState(42)
+X_train = rng.randn(5000, n_features).astype(np.float32)
+y_train = (X_train[:, :10].sum(axis=1) > 0).astype(np.int32)
+X_test = rng.randn(100000, n_features).astype(np.float32)
+
+net = FeedForwardNet.FeedForwardNet(input_shape=(128, n_features), batch_size=128,
+                                    num_layers=4, num_units_per_layer=(1024, 1024, 1024),
+                                    weight_init_per_layer=('he_normal',)*3,
+                                    num_output_units=2, solver='adam', num_epochs=1,
+                                    random_state=1)
+net.fit(X_train, y_train)
+net.export()
+
+print("{} cores".format(multiprocessing.cpu_count()))
+timings = {}
+for n_jobs in [1, 2, 4, 8, 16]:
+    # Warm up the predict function
+    net.predict_proba(X_test[:1000], chunk_size=100, n_jobs=n_jobs)
+    start = time.time()
+    net.predict_proba(X_test, chunk_size=10000, n_jobs=n_jobs)
+    timings[n_jobs] = time.time() - start
+    print("{:2d} threads: {:6.2f}s, speedup x{:.2f}".format(n_jobs, timings[n_jobs],
+                                                          timings[1] / timings[n_jobs]))
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+"""
+Random DeepFeedNet-like configurations trained under a per run time
+limit, with and without the time budget of FeedForwardNet. Counts the
+runs that would be killed by the limit and the validation error of the
+others.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_time_budget.py
+"""
+import time
+import numpy as np
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+n_features = 100
+per_run_time_limit = 30.0
+num_configs = 20
+rng = np.random.RandomState(42)
+X = rng.randn(60000, n_features).astype(np.float32)
+y = (np.dot(np.tanh(X), rng.randn(n_features)) > 0).astype(np.int32)
+X_train, y_train = X[:50000], y[:50000]
+X_valid, y_valid = X[50000:], y[50000:]
+
+for time_budget in [None, 0.8 * per_run_time_limit]:
+    search_rng = np.random.RandomState(1)
+    timeouts = 0
+    timeouts_avoided = 0
+    errors = []
+    for config in range(num_configs):
+        batch_size = int(2 ** search_rng.uniform(5, 10))
+        num_updates = int(10 ** search_rng.uniform(np.log10(50), np.log10(3500)))
+        num_epochs = min(max(2, (num_updates * batch_size) // X_train.shape[0]), 80)
+        units = int(2 ** search_rng.uniform(6, 11))
+        start = time.time()
+        net = FeedForwardNet.FeedForwardNet(input_shape=(batch_size, n_features),
+                                            batch_size=batch_size, num_layers=3,
+                                            num_units_per_layer=(units, units),
+                                            weight_init_per_layer=('he_normal',)*2,
+                                            num_output_units=2, learning_rate=0.01,
+                                            solver='adam', num_epochs=num_epochs,
+                                            time_budget=time_budget, random_state=1)
+        net.fit(X_train, y_train)
+        timeouts_avoided += net.timeouts_avoided
+        if time.time() - start > per_run_time_limit:
+            timeouts += 1
+        else:
+            errors.append(np.mean(net.predict(X_valid) != y_valid))
+    print("time budget {}: {} timeouts, {} avoided, mean validation error {:.4f}".format(
+        time_budget, timeouts, timeouts_avoided, np.mean(errors)))
@@ -0,0 +1,58 @@
+# -*- encoding: utf-8 -*-
+"""
+Epochs needed by FeedForwardNet to reach a target training loss when
+initialized from the weight store vs. from _choose_weight_init.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_warm_start.py
+"""
+import tempfile
+import numpy as np
+
+from component.implementation import FeedForwardNet, WeightStore
+
+FeedForwardNet.DEBUG = False
+
+n_samples = 5000
+n_features = 50
+rng = np.random.RandomState(42)
+X = rng.randn(n_samples, n_features).astype(np.float32)
+y = (np.dot(X, rng.randn(n_features)) > 0).astype(np.int32)
+
+store = WeightStore.WeightStore(tempfile.mkdtemp())
+dataset_key = store.dataset_key(X)
+
+
+def make_net(learning_rate, seed, num_epochs=30):
+    return FeedForwardNet.FeedForwardNet(input_shape=(64, n_features), batch_size=64,
+                                         num_layers=3, num_units_per_layer=(256, 256),
+                                         dropout_per_layer=(0.2, 0.2), dropout_output=0.2,
+                                         weight_init_per_layer=('he_normal',)*2,
+                                         num_output_units=2, learning_rate=learning_rate,
+                                         solver='adam', num_epochs=num_epochs,
+                                         random_state=seed)
+
+
+def epochs_to_target(loss_history, target):
+    for epoch, loss in enumerate(loss_history):
+        if loss <= target:
+            return epoch + 1
+    return None
+
+# A previous configuration of the same run
+previous = make_net(1e-3, seed=1)
+previous.fit(X, y)
+store.save(dataset_key, previous.get_param_values())
+target = 1.2 * previous.loss_history[-1]
+
+# Successive configurations sharing the architecture
+for learning_rate, seed in [(5e-4, 2), (2e-3, 3), (1e-4, 4)]:
+    cold = make_net(learning_rate, seed)
+    cold.fit(X, y)
+    warm = make_net(learning_rate, seed)
+    shapes = [v.shape for v in warm.get_param_values()]
+    warm.set_param_values(store.load(dataset_key, shapes))
+    warm.fit(X, y)
+    print("lr {:.0e}: epochs to loss {:.4f}, cold {}, warm {}".format(
+        learning_rate, target,
+        epochs_to_target(cold.loss_history, target),
+        epochs_to_target(warm.loss_history, target)))
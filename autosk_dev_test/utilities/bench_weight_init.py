@@ -0,0 +1,33 @@
+# -*- encoding: utf-8 -*-
+"""
+Time to initialize a layer with the Lasagne orthogonal and sparse
+initializers against their QR based and vectorized versions, across
+layer sizes. The QR orthogonal init is timed on a fresh seed and on a
+cached basis.
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/bench_weight_init.py
+"""
+import time
+import numpy as np
+import lasagne
+
+from component.implementation import FeedForwardNet
+
+FeedForwardNet.DEBUG = False
+
+
+def timed(initializer, shape, seed=1):
+    lasagne.random.set_rng(np.random.RandomState(seed))
+    start = time.time()
+    initializer.sample(shape)
+    return time.time() - start
+
+
+for size in [256, 1024, 2048, 4096]:
+    shape = (size, size)
+    fresh = timed(FeedForwardNet.QROrthogonal(), shape, seed=size)
+    cached = timed(FeedForwardNet.QROrthogonal(), shape, seed=size)
+    print("{:>5}x{:<5} orthogonal: lasagne {:.3f}s, qr {:.3f}s, cached {:.4f}s | "
+          "sparse: lasagne {:.3f}s, vectorized {:.3f}s".format(
+              size, size, timed(lasagne.init.Orthogonal(), shape), fresh, cached,
+              timed(lasagne.init.Sparse(), shape), timed(FeedForwardNet.VectorizedSparse(), shape)))
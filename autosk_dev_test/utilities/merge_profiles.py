@@ -0,0 +1,23 @@
+# -*- encoding: utf-8 -*-
+"""
+Merges the profile summaries written by FeedForwardNet and
+LogisticRegression runs with AUTONET_PROFILE=1, and prints the op time
+per kind of op for each value of a config entry (solver, activations,
+lr_policy or is_sparse).
+
+Run from autosk_dev_test/: PYTHONPATH=. python utilities/merge_profiles.py [directory] [by]
+"""
+import sys
+
+from component.implementation.Profiling import CATEGORIES, merge_profiles
+
+directory = sys.argv[1] if len(sys.argv) > 1 else None
+by = sys.argv[2] if len(sys.argv) > 2 else 'solver'
+
+totals = merge_profiles(directory, by=by)
+print("{:>24} ".format(by) + " ".join("{:>16}".format(c) for c in CATEGORIES))
+for group, times in sorted(totals.items(), key=lambda item: -sum(item[1].values())):
+    total = sum(times.values())
+    print("{:>24} ".format(group) +
+          " ".join("{:>9.2f}s {:>4.0%}".format(times[c], times[c] / total if total else 0)
+                   for c in CATEGORIES))